@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+'''Compare users/sec of per-user and bulk user data requests
+
+    $ PYTHONPATH=. python benchmarks/bench_bulk_storage.py [users]'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import time
+
+from bothub_client.clients import StorageClient
+from stub_server import start_stub_server
+
+
+def run(label, func, count):
+    started = time.time()
+    func()
+    elapsed = time.time() - started
+    print('{:<24} {:>10.1f} users/sec'.format(label, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server, base_url = start_stub_server()
+    keys = [('mychannel', 'user{}'.format(i)) for i in range(count)]
+    items = [(channel, user_id, {'score': 1}) for channel, user_id in keys]
+    client = StorageClient(1, 'key', base_url)
+    try:
+        run('get_user_data', lambda: [client.get_user_data(c, u) for c, u in keys], count)
+        run('set_user_data', lambda: [client.set_user_data(c, u, d) for c, u, d in items], count)
+        run('get_many_user_data', lambda: client.get_many_user_data(keys), count)
+        run('set_many_user_data', lambda: client.set_many_user_data(items), count)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
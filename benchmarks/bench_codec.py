@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''Compare encode and decode speed of JSON libraries and msgpack over channel payloads,
+and sizes of compact payloads
+
+    $ PYTHONPATH=. python benchmarks/bench_codec.py [iterations]'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import time
+
+from bothub_client import codec
+from bothub_client.clients import ChannelClient
+from bothub_client.clients import PayloadSession
+from bothub_client.messages import Message
+
+CONTEXT = {
+    'project_id': 1, 'api_key': 'key', 'request_id': 'req-1',
+    'rabbitmq': {'endpoint': 'amqp://localhost'},
+    'channel': {'endpoint': 'http://localhost', 'channels': [
+        {'type': 'telegram', 'app_id': '123', 'app_secret': 'secret', 'page_access_token': 'x' * 64}]},
+}
+EVENT = {
+    'content': '오늘 날씨 어때?', 'channel': 'telegram', 'chat_id': '12345678',
+    'sender': {'id': '12345678', 'name': 'Jane Doe'}, 'raw_data': {
+        'update_id': 1, 'message': {'message_id': 42, 'date': 1500000000,
+                                    'from': {'id': 12345678, 'first_name': 'Jane', 'language_code': 'ko'},
+                                    'chat': {'id': 12345678, 'type': 'private'},
+                                    'text': '오늘 날씨 어때?'}}}
+
+
+def payloads(payload_session=None):
+    client = ChannelClient(1, 'key', 'http://localhost', context=CONTEXT, payload_session=payload_session)
+    message = Message(EVENT).set_text('Choose a city')
+    for city in ('Seoul', 'Busan', 'Incheon', 'Daegu', 'Daejeon', 'Gwangju'):
+        message.add_quick_reply(city)
+    return [client._prepare_payload(None, 'hello', event=EVENT),
+            client._prepare_payload(None, message, event=EVENT),
+            client._prepare_payload_to_photo(None, 'https://example.com/photo.png', event=EVENT)]
+
+
+def run(label, dumps, loads, data, iterations):
+    started = time.time()
+    for _ in range(iterations):
+        encoded = [dumps(d) for d in data]
+    encode_elapsed = time.time() - started
+    started = time.time()
+    for _ in range(iterations):
+        [loads(e) for e in encoded]
+    decode_elapsed = time.time() - started
+    count = iterations * len(data)
+    print('{:<8} dumps {:>10.0f}/sec  loads {:>10.0f}/sec  {} bytes'.format(
+        label, count / encode_elapsed, count / decode_elapsed, sum(len(e) for e in encoded)))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data = payloads()
+    selected = codec.name
+    for backend in codec.BACKENDS:
+        try:
+            codec.use(backend)
+        except ImportError:
+            print('{:<8} not installed'.format(backend))
+            continue
+        run(backend, codec.dumps, codec.loads, data, iterations)
+    codec.use(selected)
+    try:
+        run('msgpack', codec.get_encoder('msgpack'), codec.get_decoder('msgpack'), data, iterations)
+    except ImportError:
+        print('{:<8} not installed'.format('msgpack'))
+
+    session = PayloadSession()
+    first = sum(len(codec.dumps(d)) for d in payloads(session))
+    later = sum(len(codec.dumps(d)) for d in payloads(session))
+    print('compact  {} bytes on a new session, {} bytes after'.format(first, later))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+'''Measure dispatches/sec of DefaultDispatcher with hundreds of commands
+
+    $ PYTHONPATH=. python benchmarks/bench_dispatch.py [commands] [iterations]'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import time
+
+from bothub_client.decorators import channel
+from bothub_client.decorators import command
+from bothub_client.dispatcher import DefaultDispatcher
+from bothub_client.intent import IntentState
+
+
+def make_bot_class(count):
+    def handler(self, event, context, *args):
+        self.handled += 1
+
+    namespace = {
+        '__init__': lambda self: setattr(self, 'handled', 0),
+        'get_user_data': lambda self: {},
+        'send_message': lambda self, message: None,
+        'default': channel()(handler),
+    }
+    for i in range(count):
+        namespace['cmd{}'.format(i)] = command('cmd{}'.format(i), 'alias{}'.format(i))(handler)
+        namespace['on_old{}'.format(i)] = handler
+    return type(str('BenchBot'), (object,), namespace)
+
+
+def run(label, dispatcher, event, iterations):
+    started = time.time()
+    for _ in range(iterations):
+        dispatcher.dispatch(event, None)
+    elapsed = time.time() - started
+    print('{:<24} {:>12.0f} dispatches/sec'.format(label, iterations / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    bot_class = make_bot_class(count)
+
+    started = time.time()
+    bot = bot_class()
+    dispatcher = DefaultDispatcher(bot, IntentState(bot, []))
+    print('{:<24} {:>12.2f} ms for {} commands'.format('first dispatcher', (time.time() - started) * 1000,
+                                                       count * 3))
+
+    last = count - 1
+    run('command', dispatcher, {'content': '/cmd{} a b'.format(last), 'channel': 'c'}, iterations)
+    run('alias', dispatcher, {'content': '/alias{}'.format(last), 'channel': 'c'}, iterations)
+    run('old style command', dispatcher, {'content': '/old{} a'.format(last), 'channel': 'c'}, iterations)
+    run('unknown command', dispatcher, {'content': '/nothing', 'channel': 'c'}, iterations)
+    run('channel message', dispatcher, {'content': 'hello', 'channel': 'c'}, iterations)
+    run('new dispatcher per event', _PerEvent(bot_class), {'content': '/cmd0', 'channel': 'c'},
+        iterations // 10)
+
+
+class _PerEvent(object):
+    '''Create a bot and a dispatcher per event like handle_message() does'''
+    def __init__(self, bot_class):
+        self.bot_class = bot_class
+
+    def dispatch(self, event, context):
+        bot = self.bot_class()
+        DefaultDispatcher(bot, IntentState(bot, [])).dispatch(event, context)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''Compare requests/sec of HTTP transports sharing a session at 1, 8 and 64 threads
+
+    $ PYTHONPATH=. python benchmarks/bench_http_pool.py [requests]'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import threading
+import time
+
+from bothub_client.transports import HttpTransport
+from bothub_client.transports import create_http_session
+from stub_server import start_stub_server
+
+
+def run(label, transport_factory, threads, count):
+    per_thread = count // threads
+    transports = [transport_factory() for _ in range(threads)]
+
+    def work(transport):
+        for _ in range(per_thread):
+            transport.get('/projects/1')
+
+    workers = [threading.Thread(target=work, args=(t,)) for t in transports]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+    print('{:<38} {:>3} threads {:>10.1f} req/sec'.format(label, threads, per_thread * threads / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3200
+    server, base_url = start_stub_server()
+    try:
+        for threads in (1, 8, 64):
+            run('session per event (no keep-alive)',
+                lambda: HttpTransport(base_url, session=create_http_session(keep_alive=False)),
+                threads, count)
+            default = create_http_session()
+            run('shared session, default pool (10)',
+                lambda: HttpTransport(base_url, session=default), threads, count)
+            sized = create_http_session(pool_maxsize=threads, pool_block=True)
+            run('shared session, pool sized to threads',
+                lambda: HttpTransport(base_url, session=sized), threads, count)
+            print()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''Compare events/sec of handle_message() and a warm BotRuntime
+
+    $ PYTHONPATH=. python benchmarks/bench_runtime.py [events]'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sys
+import time
+
+from bothub_client.bot import BaseBot
+from bothub_client.clients import BotRuntime
+from bothub_client.clients import handle_message
+from stub_server import start_stub_server
+
+
+class Bot(BaseBot):
+    def handle_message(self, event, context):
+        data = self.get_user_data()
+        self.send_message('hello, you said: {} {}'.format(event.get('content'), len(data)))
+
+
+def make_event(i):
+    return {'content': 'hi {}'.format(i),
+            'channel': 'mychannel',
+            'sender': {'id': 'user{}'.format(i % 10)}}
+
+
+def run(label, func, count):
+    started = time.time()
+    for i in range(count):
+        func(make_event(i))
+    elapsed = time.time() - started
+    print('{:<16} {:>8.1f} events/sec'.format(label, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    server, base_url = start_stub_server()
+    context = {'project_id': 1,
+               'api_key': 'key',
+               'channel': {'endpoint': base_url, 'channels': [{'type': 'mychannel'}]},
+               'storage': {'endpoint': base_url}}
+    try:
+        run('handle_message', lambda event: handle_message(event, context, Bot), count)
+        runtime = BotRuntime(context, Bot)
+        run('BotRuntime', runtime.handle, count)
+        runtime.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+'''A local HTTP stand-in for the storage and channel services used by benchmarks
+
+Run benchmarks from the repository root with ``PYTHONPATH=.``, since the
+request handler base is shared with the tests.'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from tests.testutils import JsonHandler
+
+
+class StubHandler(JsonHandler):
+    def do_GET(self):
+        self._reply({'data': {}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.endswith('/users/_mget'):
+            users = json.loads(body.decode('utf8'))['users']
+            self._reply({'data': [{} for _ in users]})
+        else:
+            self._reply({})
+
+    def do_PUT(self):
+        self._read_body()
+        self._reply({})
+
+    def do_PATCH(self):
+        self._read_body()
+        self._reply({})
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_stub_server(handler_class=StubHandler):
+    '''Start a stub server on a random local port in a background thread
+
+    :return: a tuple of the server and its base URL'''
+    server = StubServer(('127.0.0.1', 0), handler_class)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+'''asyncio variants of transports, clients and the bot
+
+This module requires Python 3.5 or later. ``AsyncHttpTransport`` needs the
+``aiohttp`` package.'''
+
+import asyncio
+import functools
+import inspect
+import threading
+import weakref
+
+import zmq
+import zmq.asyncio
+
+from bothub_client import codec
+from bothub_client.bot import BaseBot
+from bothub_client.clients import BaseChannelClient
+from bothub_client.clients import NluClientFactory
+from bothub_client.clients import StorageClient
+from bothub_client.clients import TrackedDict
+from bothub_client.dispatcher import NEW_STYLE
+from bothub_client.dispatcher import DefaultDispatcher
+from bothub_client.intent import IntentState
+from bothub_client.intent import NoSlotRemainsException
+from bothub_client.messages import Message
+from bothub_client.transports import TransportError
+from bothub_client.utils import chunked
+
+
+class AsyncHttpTransport(object):
+    def __init__(self, base_url='', session=None):
+        self.base_url = base_url
+        self.session = session
+
+    def _get_session(self):
+        if self.session is None:
+            aiohttp = __import__('aiohttp')
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def _request(self, method, path, data=None):
+        url = '{}{}'.format(self.base_url, path)
+        kwargs = {}
+        if data is not None:
+            kwargs = {'data': codec.dumps(data), 'headers': {'Content-Type': 'application/json'}}
+        async with self._get_session().request(method, url, **kwargs) as response:
+            content = await response.read()
+        return codec.loads(content) if content else None
+
+    async def get(self, path):
+        return await self._request('GET', path)
+
+    async def post(self, path, data=None):
+        return await self._request('POST', path, data)
+
+    async def put(self, path, data=None):
+        return await self._request('PUT', path, data)
+
+    async def patch(self, path, data=None):
+        return await self._request('PATCH', path, data)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncZmqSocketPool(object):
+    '''Connected asyncio sockets keyed by event loop and address
+
+    A ``zmq.asyncio`` socket is used on one event loop, so each loop gets its
+    own socket for an address. Sockets stay connected until the pool is
+    closed or their loop is garbage collected.'''
+    def __init__(self, context=None, socket_type=zmq.PUSH):
+        self._context = context
+        self.socket_type = socket_type
+        self._sockets = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, address, loop=None):
+        '''Returns a socket connected to the address for the event loop'''
+        _loop = loop or asyncio.get_event_loop()
+        with self._lock:
+            sockets = self._sockets.setdefault(_loop, {})
+            socket = sockets.get(address)
+            if socket is None:
+                socket = (self._context or zmq.asyncio.Context.instance()).socket(self.socket_type)
+                socket.connect(address)
+                sockets[address] = socket
+        return socket
+
+    def close(self, linger=None):
+        with self._lock:
+            sockets = [socket for by_address in self._sockets.values() for socket in by_address.values()]
+            self._sockets.clear()
+        for socket in sockets:
+            socket.close(linger=linger)
+
+
+async_socket_pool = AsyncZmqSocketPool()
+
+
+class AsyncZmqTransport(object):
+    '''An asyncio ZeroMQ PUSH transport
+
+    Without an explicit context, the socket comes from the process-wide pool
+    and is shared by transports of the event loop which point to the same
+    address. ``close()`` then leaves the pooled socket open.'''
+    def __init__(self, address, context=None):
+        self.address = address
+        self.owns_socket = context is not None
+        if self.owns_socket:
+            self.socket = context.socket(zmq.PUSH)
+            self.socket.connect(address)
+        else:
+            self.socket = async_socket_pool.get(address)
+
+    async def send_multipart(self, data):
+        return await self.socket.send_multipart(data)
+
+    async def close(self):
+        if self.owns_socket:
+            self.socket.close()
+
+
+def get_async_channel_client(context, transport=None):
+    '''Returns proper async channel client according to channel URL scheme
+
+    :param context: a context Bot runs
+    :type context: dict
+    :param transport: an optional transport to reuse
+    :return: an AsyncChannelClient instance'''
+    endpoint = context.get('channel', {}).get('endpoint', 'http:')
+    scheme = endpoint.split(':')[0]
+    if scheme in ('http', 'https'):
+        return AsyncChannelClient.init_client(context, transport=transport)
+    return AsyncZmqChannelClient.init_client(context, transport=transport)
+
+
+class AsyncChannelClient(BaseChannelClient):
+    '''A ChannelClient class using async HTTP transport'''
+    @staticmethod
+    def init_client(context, transport=None):
+        project_id = context.get('project_id')
+        api_key = context.get('api_key', '')
+        channel_endpoint = context.get('channel', {}).get('endpoint')
+        _transport = transport or AsyncHttpTransport(channel_endpoint)
+        return AsyncChannelClient(project_id, api_key, channel_endpoint,
+                                  transport=_transport, context=context)
+
+    async def send_message(self, chat_id, message, channel=None, event=None, extra=None):
+        data = self._prepare_payload(chat_id, message, channel, event, extra)
+        await self.transport.post('/messages', data)
+
+    async def send_photo(self, chat_id, photo_url, channel=None, event=None):
+        pass
+
+    async def close(self):
+        await self.transport.close()
+
+
+class AsyncZmqChannelClient(BaseChannelClient):
+    '''A ChannelClient class using asyncio ZeroMQ'''
+    @staticmethod
+    def init_client(context, transport=None):
+        project_id = context.get('project_id')
+        api_key = context.get('api_key', '')
+        channel_endpoint = context.get('channel', {}).get('endpoint')
+        _transport = transport or AsyncZmqTransport(channel_endpoint)
+        return AsyncZmqChannelClient(project_id, api_key, channel_endpoint,
+                                     transport=_transport, context=context)
+
+    async def send_message(self, chat_id, message, channel=None, event=None, extra=None):
+        data = self._prepare_payload(chat_id, message, channel, event, extra)
+        await self.transport.send_multipart([codec.dumps(data)])
+
+    async def send_photo(self, chat_id, photo_url, channel=None, event=None):
+        data = self._prepare_payload_to_photo(chat_id, photo_url, channel, event)
+        await self.transport.send_multipart([codec.dumps(data)])
+
+    async def close(self):
+        await self.transport.close()
+
+
+class AsyncStorageClient(StorageClient):
+    '''A StorageClient whose methods are coroutines
+
+    The unit of work behaves the same as ``StorageClient``.'''
+    @staticmethod
+    def init_client(context, event=None, transport=None):
+        project_id = context.get('project_id')
+        api_key = context.get('api_key', '')
+        storage = context.get('storage', {})
+        storage_endpoint = storage.get('endpoint')
+        user = None if not event else (event['channel'], event.get('sender', {}).get('id'))
+        _transport = transport or AsyncHttpTransport(storage_endpoint)
+        return AsyncStorageClient(project_id, api_key, storage_endpoint, transport=_transport, user=user,
+                                  partial_updates=storage.get('partial_updates', False),
+                                  batch_size=storage.get('batch_size', 100),
+                                  batch_concurrency=storage.get('batch_concurrency', 4))
+
+    async def commit(self):
+        for channel, user_id, data, patch in self._end_unit():
+            if patch:
+                await self.patch_user_data(channel, user_id, data)
+            else:
+                await self.set_user_data(channel, user_id, data)
+
+    async def set_project_data(self, data):
+        await self.transport.put(self._project_url(), {'data': data})
+
+    async def patch_project_data(self, data):
+        await self._patch(self._project_url(), data)
+
+    async def get_project_data(self, key=None):
+        url = self._project_url()
+        if key:
+            return (await self.transport.get(url + '/{}'.format(key))).get('data') or {}
+        return TrackedDict((await self.transport.get(url)).get('data') or {})
+
+    async def set_user_data(self, channel, user_id, data):
+        if self.user_data_map is not None:
+            self._defer_user_data(channel, user_id, data)
+            return
+        await self.transport.put(self._user_url(channel, user_id), {'data': data})
+
+    async def patch_user_data(self, channel, user_id, data):
+        if self.user_data_map is not None:
+            self._defer_user_data(channel, user_id, data)
+            self.patched_users.add((channel, user_id))
+            return
+        await self._patch(self._user_url(channel, user_id), data)
+
+    async def _patch(self, url, data):
+        body = self._patch_body(data)
+        if body is None:
+            return
+        await self.transport.patch(url, body)
+        if isinstance(data, TrackedDict):
+            data.mark_clean()
+
+    async def get_user_data(self, channel, user_id, key=None):
+        if self.user_data_map is None:
+            return await self._fetch_user_data(channel, user_id, key)
+        user = (channel, user_id)
+        if user not in self.loaded_users:
+            self._load_user_data(user, await self._fetch_user_data(channel, user_id))
+        return self._cached_user_data(user, key)
+
+    async def get_many_user_data(self, keys, batch_size=None, concurrency=None):
+        '''Returns user data of many users
+
+        Same as ``StorageClient.get_many_user_data()``, with up to
+        ``concurrency`` requests awaited at once.'''
+        url = '/projects/{}/users/_mget'.format(self.project_id)
+
+        async def fetch(chunk):
+            users = [{'channel': channel, 'user_id': user_id} for channel, user_id in chunk]
+            data = ((await self.transport.post(url, {'users': users})) or {}).get('data') or []
+            if len(data) != len(chunk):
+                raise TransportError('{} returned {} users for {}'.format(url, len(data), len(chunk)))
+            return [TrackedDict(d or {}) for d in data]
+
+        results = []
+        for data in await self._run_chunks(fetch, keys, batch_size, concurrency):
+            results.extend(data)
+        return results
+
+    async def set_many_user_data(self, items, batch_size=None, concurrency=None):
+        '''Set user data of many users
+
+        Same as ``StorageClient.set_many_user_data()``, with up to
+        ``concurrency`` requests awaited at once.'''
+        url = '/projects/{}/users/_mset'.format(self.project_id)
+
+        async def store(chunk):
+            users = [{'channel': channel, 'user_id': user_id, 'data': data}
+                     for channel, user_id, data in chunk]
+            await self.transport.post(url, {'users': users})
+
+        await self._run_chunks(store, items, batch_size, concurrency)
+
+    async def _run_chunks(self, func, items, batch_size=None, concurrency=None):
+        semaphore = asyncio.Semaphore(concurrency or self.batch_concurrency)
+
+        async def run(chunk):
+            async with semaphore:
+                return await func(chunk)
+
+        return await asyncio.gather(*[run(chunk) for chunk in chunked(items, batch_size or self.batch_size)])
+
+    async def _fetch_user_data(self, channel, user_id, key=None):
+        url = self._user_url(channel, user_id)
+        if key:
+            return (await self.transport.get(url + '/{}'.format(key))).get('data') or {}
+        return TrackedDict((await self.transport.get(url)).get('data') or {})
+
+    async def set_current_user_data(self, data):
+        channel, user_id = self.current_user
+        await self.set_user_data(channel, user_id, data)
+
+    async def patch_current_user_data(self, data):
+        channel, user_id = self.current_user
+        await self.patch_user_data(channel, user_id, data)
+
+    async def get_current_user_data(self, key=None):
+        channel, user_id = self.current_user
+        return await self.get_user_data(channel, user_id, key)
+
+
+async def _resolve(result):
+    '''Await a result of a handler if it is awaitable'''
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class AsyncIntentState(IntentState):
+    '''An IntentState which awaits user data of an ``AsyncBaseBot``'''
+
+    async def open(self, intent_id):
+        data = await self.bot.get_user_data()
+        data[self.intent_id_field] = intent_id
+        data[self.intent_answers_field] = {}
+        data[self.remaining_slots_field] = [
+            d._asdict()
+            for d in self.intent_id_to_intent_definition[intent_id].slots
+        ]
+        await self.bot.set_user_data(data)
+
+    async def is_opened(self):
+        data = await self.bot.get_user_data()
+        return self.intent_id_field in data and data[self.intent_id_field] is not None
+
+    async def next(self, event=None):
+        data = await self.bot.get_user_data()
+        if event:
+            self._store_answer(event, data)
+        if not self._has_remainig_slots(data):
+            await self.bot.set_user_data(data)
+            raise NoSlotRemainsException()
+        result = self._make_result_obj(data)
+        if result.completed:
+            self._clear_state(data)
+        await self.bot.set_user_data(data)
+        return result
+
+    async def close(self):
+        data = await self.bot.get_user_data()
+        self._clear_state(data)
+        await self.bot.set_user_data(data)
+
+
+class AsyncDispatcher(DefaultDispatcher):
+    '''A DefaultDispatcher for ``AsyncBaseBot``
+
+    Routing is the same. Handlers may be coroutine functions or plain
+    functions, and replies and intent state are awaited.'''
+
+    async def dispatch(self, event, context):
+        content = event.get('payload') or event.get('content')
+
+        if self._is_intent_command(content):
+            await self.open_intent(event, content)
+            return
+
+        if self._is_command(content):
+            await self.execute_command(event, context, content)
+            return
+
+        if await self.state.is_opened():
+            await self.proceed_intent(event, context)
+            return
+
+        current_channel = event.get('channel')
+        if current_channel is None:
+            return
+
+        handler_func = self._channel_handler(current_channel)
+        if handler_func:
+            await _resolve(handler_func(event, context))
+
+    async def open_intent(self, event, content):
+        intent_id = self._get_intent_id(content)
+        await self.state.open(intent_id)
+        result = await self.state.next()
+        await self.bot.send_message(self._intent_message(event, result))
+
+    async def execute_command(self, event, context, content):
+        command, args = self._get_command_args(content)
+        handler_func, style = self._command_handler(command)
+
+        if handler_func is not None and style == NEW_STYLE:
+            await _resolve(handler_func(event, context, args))
+        elif handler_func is not None:
+            await _resolve(handler_func(event, context, *args))
+        elif self._is_kakao_init_keyboard_command(content):
+            message = Message(event)
+            message.add_keyboard_button('__init_keyboard__')
+            await self.bot.send_message(message)
+        else:
+            await self.bot.send_message('No such command: {}'.format(command))
+
+    async def proceed_intent(self, event, context):
+        result = await self.state.next(event)
+        if result.completed:
+            await _resolve(self._intent_complete_handler(event, context, result)())
+        else:
+            await self.bot.send_message(self._intent_message(event, result))
+
+
+class AsyncBaseBot(BaseBot):
+    '''A base Bot class for asyncio
+
+    Messaging and storage methods are coroutines, so a bot can await storage
+    and NLU concurrently::
+
+        class Bot(AsyncBaseBot):
+            async def handle_message_async(self, event, context):
+                data, response = await asyncio.gather(
+                    self.get_user_data(), self.ask('apiai', event=event))
+                await self.send_message(response.next_message)
+
+    Without ``handle_message_async()``, handlers declared with ``@command``,
+    ``@intent`` and ``@channel`` are dispatched by ``AsyncDispatcher``. They
+    may be coroutine functions.'''
+    intent_state_class = AsyncIntentState
+    default_dispatcher_class = AsyncDispatcher
+
+    def handle_message(self, event, context):
+        '''Not supported. messaging methods are coroutines which the synchronous
+        dispatcher would never await. use ``handle_message_async()``'''
+        raise NotImplementedError('AsyncBaseBot handles messages with handle_message_async()')
+
+    async def handle_message_async(self, event, context):
+        '''Handle a message which messenger platform sent
+
+        :param event: an event which messenger platform sent
+        :type event: dict
+        :param context: a context Bot runs
+        :type context: dict'''
+        await self.dispatcher.dispatch(event, context)
+
+    async def send_message(self, message, chat_id=None, channel=None, extra=None, event=None):
+        _event = event
+        if _event is None and isinstance(message, Message):
+            _event = message.event
+        else:
+            _event = self.event
+        await self.channel_client.send_message(chat_id, message, channel, event=_event, extra=extra)
+
+    async def send_photo(self, photo_url, chat_id=None, channel=None, event=None):
+        await self.channel_client.send_photo(chat_id, photo_url, channel, event=self.event)
+
+    async def set_project_data(self, data):
+        await self.storage_client.set_project_data(data)
+
+    async def patch_project_data(self, data):
+        await self.storage_client.patch_project_data(data)
+
+    async def get_project_data(self, key=None):
+        return await self.storage_client.get_project_data(key)
+
+    async def set_user_data(self, data, user_id=None, channel=None, event=None):
+        _user_id, _channel = self._get_channel_user(user_id, channel, event)
+        await self.storage_client.set_user_data(_channel, _user_id, data)
+
+    async def patch_user_data(self, data, user_id=None, channel=None, event=None):
+        _user_id, _channel = self._get_channel_user(user_id, channel, event)
+        await self.storage_client.patch_user_data(_channel, _user_id, data)
+
+    async def get_user_data(self, user_id=None, channel=None, event=None, key=None):
+        _user_id, _channel = self._get_channel_user(user_id, channel, event)
+        return await self.storage_client.get_user_data(_channel, user_id=_user_id, key=key)
+
+    async def ask(self, vendor, **kwargs):
+        '''Query a NLU service without blocking the event loop
+
+        NLU clients are synchronous, so the query runs in the default executor.
+
+        :param vendor: a NLU vendor name
+        :type vendor: str
+        :return: an NluResponse object'''
+        loop = asyncio.get_event_loop()
+        client = self.nlu(vendor)
+        return await loop.run_in_executor(None, functools.partial(client.ask, **kwargs))
+
+    async def close(self):
+        await self.channel_client.close()
+
+
+async def handle_message_async(event, context, bot_class):
+    '''Handle a message with an ``AsyncBaseBot`` class
+
+    :param event: an event which messenger platform sent
+    :type event: dict
+    :param context: a context Bot runs
+    :type context: dict
+    :param bot_class: a Bot class user wrote
+    :type bot_class: bothub_client.aio.AsyncBaseBot
+    :return: a dict contains response'''
+    channel = get_async_channel_client(context)
+    storage = AsyncStorageClient.init_client(context, event=event)
+    nlu_client_factory = NluClientFactory(context)
+
+    bot = bot_class(channel_client=channel, storage_client=storage,
+                    nlu_client_factory=nlu_client_factory, event=event)
+    storage.begin()
+    try:
+        response = await bot.handle_message_async(event, context)
+    finally:
+        try:
+            await storage.commit()
+        finally:
+            try:
+                await bot.close()
+            finally:
+                await storage.transport.close()
+    return {'response': response}
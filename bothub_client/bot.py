@@ -2,7 +2,6 @@
 
 from __future__ import (absolute_import, division, print_function)
 
-import os
 from bothub_client.intent import IntentState
 from bothub_client.dispatcher import DefaultDispatcher
 from bothub_client.messages import Message
@@ -10,6 +9,8 @@ from bothub_client.messages import Message
 
 class BaseBot(object):
     '''A base Bot class'''
+    intent_state_class = IntentState
+    default_dispatcher_class = DefaultDispatcher
 
     def __init__(self, channel_client=None, storage_client=None, nlu_client_factory=None, event=None, dispatcher_class=None):
         '''Initialize an object
@@ -26,15 +27,10 @@ class BaseBot(object):
         self.storage_client = storage_client
         self.nlu_client_factory = nlu_client_factory
         self.event = event
-        bot_dir_path = os.path.realpath('.')
-        yml_path = os.path.join(bot_dir_path, 'bothub.yml')
-        if os.path.isfile(yml_path):
-            self.intent_slots = IntentState.load_intent_slots_from_yml(yml_path)
-        else:
-            self.intent_slots = []
+        self.intent_slots = IntentState.get_intent_slots()
 
-        self.state = IntentState(self, self.intent_slots)
-        _dispatcher_class = dispatcher_class or DefaultDispatcher
+        self.state = self.intent_state_class(self, self.intent_slots)
+        _dispatcher_class = dispatcher_class or self.default_dispatcher_class
         self.dispatcher = _dispatcher_class(self, self.state)
 
     def handle_message(self, event, context):
@@ -66,6 +62,22 @@ class BaseBot(object):
             _event = self.event
         self.channel_client.send_message(chat_id, message, channel, event=_event, extra=extra)
 
+    def broadcast(self, message, recipients, channel=None, chunk_size=1000, max_in_flight=8):
+        '''Send a message to many users or chatrooms.
+
+        The message is serialized once, recipients are read in chunks of
+        ``chunk_size`` and sent with bounded concurrency.
+
+        :param message: a message to send. it can be a str text or Message class object
+        :type message: str, bothub_client.messages.Message
+        :param recipients: an iterable of receiver chat ids
+        :param channel: receiver channel name
+        :type channel: str
+        :return: a result with a number of sent messages and ``(recipient, error)`` failures
+        :rtype: bothub_client.clients.BroadcastResult'''
+        return self.channel_client.broadcast(message, recipients, channel, event=self.event,
+                                             chunk_size=chunk_size, max_in_flight=max_in_flight)
+
     def send_photo(self, photo_url, chat_id=None, channel=None, event=None):
         '''Send a photo to an user or chatroom.
 
@@ -87,6 +99,15 @@ class BaseBot(object):
         :return: None'''
         self.storage_client.set_project_data(data)
 
+    def patch_project_data(self, data):
+        '''Set only changed project properties
+
+        :param data: a dict to store. for a dict ``get_project_data()`` returned,
+                     only changed and deleted keys are sent
+        :type data: dict
+        :return: None'''
+        self.storage_client.patch_project_data(data)
+
     def get_project_data(self, key=None):
         '''Returns project properties
 
@@ -107,6 +128,20 @@ class BaseBot(object):
         _user_id, _channel = self._get_channel_user(user_id, channel, event)
         self.storage_client.set_user_data(_channel, _user_id, data)
 
+    def patch_user_data(self, data, user_id=None, channel=None, event=None):
+        '''Set only changed user properties
+
+        :param data: a dict to store. for a dict ``get_user_data()`` returned,
+                     only changed and deleted keys are sent
+        :type data: dict
+        :param user_id: an user id to store data
+        :type user_id: str, int
+        :param channel: a name of messaging platform
+        :type channel: str
+        :return: None'''
+        _user_id, _channel = self._get_channel_user(user_id, channel, event)
+        self.storage_client.patch_user_data(_channel, _user_id, data)
+
     def get_user_data(self, user_id=None, channel=None, event=None, key=None):
         '''Returns user properties
 
@@ -2,19 +2,58 @@
 
 from __future__ import (absolute_import, division, print_function)
 
+import copy
+import importlib
+import itertools
 import json
-
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import zmq
+
+from bothub_client import codec
+from bothub_client.intent import IntentState
 from bothub_client.messages import Message
+from bothub_client.ratelimit import RateLimiter
 from bothub_client.transports import HttpTransport
+from bothub_client.transports import TransportError
 from bothub_client.transports import ZmqTransport
+from bothub_client.utils import LRUCache
+from bothub_client.utils import chunked
+from bothub_client.utils import normalize
+from bothub_client.utils import traceback_to_string
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
 
 
-def get_channel_client(context):
+def get_channel_client(context, transport=None, rate_limiter=None, payload_session=None):
     '''Returns proper channel client according to channel URL scheme
 
     :param context: a context Bot runs
     :type context: dict
+    :param transport: an optional transport to reuse
+    :param rate_limiter: an optional RateLimiter to share
+    :param payload_session: an optional PayloadSession to share
     :return: a ChannelClient instance'''
+    client_class = get_channel_client_class(context)
+    return client_class.init_client(context, transport=transport, rate_limiter=rate_limiter,
+                                    payload_session=payload_session)
+
+
+def get_channel_client_class(context):
+    '''Returns a channel client class according to channel URL scheme
+
+    :param context: a context Bot runs
+    :type context: dict
+    :return: a ChannelClient class'''
     scheme_to_channel_client = {
         'http': ChannelClient,
         'https': ChannelClient,
@@ -23,8 +62,7 @@ def get_channel_client(context):
 
     endpoint = context.get('channel', {}).get('endpoint', 'http:')
     scheme = endpoint.split(':')[0]
-    client_class = scheme_to_channel_client.get(scheme, ZmqChannelClient)
-    return client_class.init_client(context)
+    return scheme_to_channel_client.get(scheme, ZmqChannelClient)
 
 
 def handle_message(event, context, bot_class):
@@ -43,12 +81,274 @@ def handle_message(event, context, bot_class):
 
     bot = bot_class(channel_client=channel, storage_client=storage,
                     nlu_client_factory=nlu_client_factory, event=event)
-    response = bot.handle_message(event, context)
+    storage.begin()
+    try:
+        response = bot.handle_message(event, context)
+    finally:
+        try:
+            storage.commit()
+        finally:
+            channel.flush()
     bot.close()
     channel.close()
     return {'response': response}
 
 
+def conversation_key(event):
+    '''Returns a key identifying the conversation an event belongs to
+
+    :param event: an event which messenger platform sent
+    :type event: dict
+    :return: a ``(channel, sender id)`` tuple, or None if the event has no sender'''
+    sender_id = (event.get('sender') or {}).get('id')
+    if sender_id is None:
+        return None
+    return (event.get('channel'), sender_id)
+
+
+def handle_messages(events, context, bot_class, workers=4):
+    '''Handle many messages in parallel
+
+    Events of the same conversation are handled one by one in the given order,
+    since intent state is read-modify-write on user data. Other events are
+    handled concurrently by a pool of ``workers`` threads sharing one runtime.
+
+    :param events: events which messenger platform sent
+    :type events: list
+    :param context: a context Bot runs
+    :type context: dict
+    :param bot_class: a Bot class user wrote
+    :type bot_class: bothub_client.bot.BaseBot
+    :param workers: a number of worker threads
+    :type workers: int
+    :return: a list of dicts in the order of events. each dict contains
+             ``response``, or ``error`` and ``traceback`` if handling failed
+    :rtype: list'''
+    events = list(events)
+    results = [None] * len(events)
+    conversations = OrderedDict()
+    for index, event in enumerate(events):
+        key = conversation_key(event)
+        conversations.setdefault(index if key is None else key, []).append(index)
+
+    runtime = BotRuntime(context, bot_class)
+
+    def handle_conversation(indexes):
+        for index in indexes:
+            results[index] = runtime.handle_safely(events[index])
+
+    pool = ThreadPool(workers)
+    try:
+        pool.map(handle_conversation, list(conversations.values()), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        runtime.close()
+    return results
+
+
+class BotRuntime(object):
+    '''A long-lived runtime which handles many events with one bot class
+
+    Transports (HTTP sessions, ZeroMQ sockets) and the NLU client factory are
+    created once and reused. Only per-event state like the bot object and
+    clients bound to the event is rebuilt on each ``handle()`` call. A context
+    passed to ``handle()`` may point at other channel and storage endpoints.
+    Transports of each endpoint are created on first use and kept.
+
+    ex) runtime = BotRuntime(context, Bot)
+        runtime.handle(event)'''
+    def __init__(self, context, bot_class):
+        '''Initialize a runtime
+
+        :param context: a context Bot runs
+        :type context: dict
+        :param bot_class: a Bot class user wrote
+        :type bot_class: bothub_client.bot.BaseBot'''
+        self.context = context
+        self.bot_class = bot_class
+        IntentState.get_intent_slots()
+        self.rate_limiter = RateLimiter.from_context(context)
+        self.nlu_client_factory = NluClientFactory(context)
+        self._transports_lock = threading.Lock()
+        self._channel_transports = {}
+        self._storage_transports = {}
+        self.channel_transport, self.payload_session = self._get_channel_transport(context)
+        self.storage_transport = self._get_storage_transport(context)
+
+    def _get_channel_transport(self, context):
+        '''Returns a transport and a payload session of the channel endpoint of a context'''
+        client_class = get_channel_client_class(context)
+        key = (client_class, (context.get('channel') or {}).get('endpoint'))
+        entry = self._channel_transports.get(key)
+        if entry is None:
+            with self._transports_lock:
+                entry = self._channel_transports.get(key)
+                if entry is None:
+                    entry = self._channel_transports[key] = (client_class.create_transport(context),
+                                                             PayloadSession.from_context(context))
+        return entry
+
+    def _get_storage_transport(self, context):
+        '''Returns a transport of the storage endpoint of a context'''
+        config = context.get('storage') or {}
+        key = config.get('endpoint')
+        transport = self._storage_transports.get(key)
+        if transport is None:
+            with self._transports_lock:
+                transport = self._storage_transports.get(key)
+                if transport is None:
+                    transport = self._storage_transports[key] = HttpTransport.from_config(config)
+        return transport
+
+    def handle(self, event, context=None):
+        '''Handle a message which messenger platform sent
+
+        The bot is closed after handling, but transports of the runtime stay
+        open. Call ``close()`` when the runtime is no longer used.
+
+        :param event: an event which messenger platform sent
+        :type event: dict
+        :param context: an optional context for this event. runtime context is used if omitted
+        :type context: dict
+        :return: a dict contains response'''
+        if context is None:
+            _context = self.context
+            channel_transport, payload_session = self.channel_transport, self.payload_session
+            storage_transport = self.storage_transport
+            nlu_client_factory = self.nlu_client_factory
+        else:
+            _context = context
+            channel_transport, payload_session = self._get_channel_transport(context)
+            storage_transport = self._get_storage_transport(context)
+            nlu_client_factory = NluClientFactory(context)
+        rate_limiter = self.rate_limiter if context is None else RateLimiter.from_context(context)
+        channel = get_channel_client(_context, transport=channel_transport,
+                                     rate_limiter=rate_limiter,
+                                     payload_session=payload_session)
+        storage = StorageClient.init_client(_context, event=event, transport=storage_transport)
+        bot = self.bot_class(channel_client=channel, storage_client=storage,
+                             nlu_client_factory=nlu_client_factory, event=event)
+        storage.begin()
+        try:
+            response = bot.handle_message(event, _context)
+        finally:
+            try:
+                storage.commit()
+            finally:
+                try:
+                    channel.flush()
+                finally:
+                    bot.close()
+        return {'response': response}
+
+    def handle_safely(self, event, context=None):
+        '''Same as ``handle()``, but returns an error instead of raising it
+
+        :return: a dict contains ``response``, or ``error`` and ``traceback``'''
+        try:
+            return self.handle(event, context)
+        except Exception as e:
+            return {'error': e, 'traceback': traceback_to_string(e, sys.exc_info()[2])}
+
+    def close(self):
+        '''Close transports the runtime holds'''
+        with self._transports_lock:
+            channel_transports = [t for t, _ in self._channel_transports.values()]
+            storage_transports = list(self._storage_transports.values())
+            self._channel_transports.clear()
+            self._storage_transports.clear()
+        for transport in channel_transports + storage_transports:
+            transport.close()
+
+
+class BroadcastResult(object):
+    '''A result of a broadcast'''
+    def __init__(self):
+        self.sent = 0
+        self.failures = []
+
+    def __repr__(self):
+        return "<BroadcastResult sent: {}, failures: {}>".format(self.sent, len(self.failures))
+
+
+class PayloadSession(object):
+    '''Send the context of compact payloads once per session
+
+    In compact mode (``payload: compact`` in the channel context) a message
+    carries a receiver, a channel type, a request id and only ``event_fields``
+    of the event. Credentials and channel objects go in a ``session`` item
+    with an ``id`` on the first message of a session, and later messages carry
+    the ``id`` only. A receiver keeps the items of a session by its id.
+
+    A session is kept per thread, since messages of different threads may go
+    over different connections and arrive out of order. A new session starts
+    when the items change or after ``ttl`` seconds, so a restarted receiver
+    catches up.'''
+    DEFAULT_EVENT_FIELDS = ('channel', 'chat_id', 'sender')
+
+    def __init__(self, event_fields=DEFAULT_EVENT_FIELDS, ttl=300, clock=time.time):
+        '''Initialize a session
+
+        :param event_fields: event keys to send with each message
+        :type event_fields: tuple
+        :param ttl: seconds until the session items are sent again
+        :type ttl: float'''
+        self.event_fields = tuple(event_fields)
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+
+    @staticmethod
+    def from_context(context):
+        '''Returns a PayloadSession if the channel context asks for compact payloads, or None'''
+        channel = (context or {}).get('channel', {})
+        if channel.get('payload') != 'compact':
+            return None
+        return PayloadSession(event_fields=channel.get('event_fields', PayloadSession.DEFAULT_EVENT_FIELDS),
+                              ttl=channel.get('session_ttl', 300))
+
+    def stamp(self, items):
+        '''Returns a ``session`` item for a message
+
+        :param items: items to send once per session
+        :type items: dict
+        :return: ``items`` with ``id`` on a new session, otherwise ``id`` only
+        :rtype: dict'''
+        local = self._local
+        now = self.clock()
+        if getattr(local, 'id', None) is None or local.items != items or now - local.started >= self.ttl:
+            local.id = uuid.uuid4().hex
+            local.items = items
+            local.started = now
+            return dict(items, id=local.id)
+        return {'id': local.id}
+
+    def reset(self):
+        '''Start a new session on the next message of this thread
+
+        Call it when a message may not have been delivered, since a receiver
+        which missed the session items could not resolve later messages.'''
+        self._local.id = None
+
+    def compact_event(self, event):
+        return dict((k, event[k]) for k in self.event_fields if k in event)
+
+
+def encode_json_with(encoded, **items):
+    '''Returns JSON bytes of an encoded object with items added in front
+
+    The encoded object is not parsed again, so a payload shared by many
+    messages is serialized once.
+
+    :param encoded: JSON bytes of a dict which does not contain the items
+    :type encoded: bytes'''
+    head = codec.dumps(items)[1:-1]
+    if encoded.strip() == b'{}':
+        return b'{' + head + b'}'
+    return b'{' + head + b', ' + encoded.lstrip()[1:]
+
+
 class Client(object):
     '''A base client class'''
     def __init__(self, project_id, api_key, base_url, transport=None):
@@ -62,10 +362,54 @@ class BaseChannelClient(Client):
     '''A ChannelClient class
 
     Send a message to  a messenger platform'''
-    def __init__(self, project_id, api_key, base_url, transport=None, context=None):
+    def __init__(self, project_id, api_key, base_url, transport=None, context=None, rate_limiter=None,
+                 payload_session=None):
         self.context = context
+        self.rate_limiter = rate_limiter
+        self.payload_session = payload_session
         super(BaseChannelClient, self).__init__(project_id, api_key, base_url, transport)
 
+    def flush(self):
+        '''Send messages buffered while handling an event'''
+        pass
+
+    def _reset_payload_session(self):
+        if self.payload_session is not None:
+            self.payload_session.reset()
+
+    def _throttle(self, chat_id, channel, event):
+        '''Wait until the rate limiter allows a message to the receiver'''
+        if self.rate_limiter is None:
+            return
+        self.rate_limiter.acquire(*self._throttle_key(chat_id, channel, event))
+
+    def _throttle_key(self, chat_id, channel, event):
+        '''Returns a channel type and a receiver which a message is rate limited by'''
+        _event = event or {}
+        return channel or _event.get('channel'), chat_id or _event.get('chat_id')
+
+    def _throttled_groups(self, items):
+        '''Yield lists of values which may be sent at once
+
+        Items are ``(throttle key, value)`` tuples. Without a rate limiter all
+        values are one group. Otherwise a group ends before a value which has
+        to wait, and the wait is over when the next group is taken.'''
+        if self.rate_limiter is None:
+            if items:
+                yield [value for _, value in items]
+            return
+        group = []
+        for key, value in items:
+            wait = self.rate_limiter.reserve(*key)
+            if wait > 0:
+                if group:
+                    yield group
+                    group = []
+                self.rate_limiter.wait(key[0], wait)
+            group.append(value)
+        if group:
+            yield group
+
     def _get_channel_obj(self, channel_type):
         channels = self.context['channel'].get('channels', [])
         for channel in channels:
@@ -77,6 +421,8 @@ class BaseChannelClient(Client):
         origin_channel = event.get('channel')
         _chat_id = chat_id or from_chat_id
         channel_type = channel or origin_channel
+        if self.payload_session is not None:
+            return self._compact_payload(_chat_id, channel_type, event)
         _channel = self._get_channel_obj(channel_type)
 
         data = {
@@ -92,11 +438,30 @@ class BaseChannelClient(Client):
         }
         return data
 
+    def _compact_payload(self, chat_id, channel_type, event):
+        session = self.payload_session.stamp({
+            'context': {
+                'project_id': self.project_id,
+                'api_key': self.api_key,
+                'rabbitmq': self.context.get('rabbitmq', {}).get('endpoint', 'localhost')
+            },
+            'channels': self.context['channel'].get('channels', [])
+        })
+        return {
+            'channel': channel_type,
+            'receiver': chat_id,
+            'request_id': self.context.get('request_id'),
+            'event': self.payload_session.compact_event(event),
+            'session': session
+        }
+
     def _prepare_payload(self, chat_id, message, channel=None, event=None, extra=None):
         data = self._default_prepare_payload(chat_id, channel, event)
         data['extra'] = extra
 
-        if isinstance(message, Message):
+        if isinstance(message, Message) and self.payload_session is not None:
+            data['message'] = {'model': message.model}
+        elif isinstance(message, Message):
             data['message'] = {
                 'model': message.model,
                 'event': message.event
@@ -110,26 +475,85 @@ class BaseChannelClient(Client):
         data['photo'] = photo_url
         return data
 
+    def _prepare_broadcast_data(self, message, channel=None, event=None, extra=None):
+        '''Returns a payload without a receiver'''
+        data = self._prepare_payload(None, message, channel, event or {}, extra)
+        del data['receiver']
+        return data
+
+    def _prepare_broadcast_payload(self, message, channel=None, event=None, extra=None):
+        '''Returns JSON bytes of a payload without a receiver'''
+        return codec.dumps(self._prepare_broadcast_data(message, channel, event, extra))
+
 
 class ChannelClient(BaseChannelClient):
     '''A ChannelClient class using HTTP transport
 
     Send a message to  a messenger platform'''
     @staticmethod
-    def init_client(context):
+    def init_client(context, transport=None, rate_limiter=None, payload_session=None):
         project_id = context.get('project_id')
         api_key = context.get('api_key', '')
         channel_endpoint = context.get('channel', {}).get('endpoint')
+        _transport = transport or ChannelClient.create_transport(context)
         return ChannelClient(project_id, api_key, channel_endpoint,
-                             transport=HttpTransport(channel_endpoint), context=context)
+                             transport=_transport, context=context,
+                             rate_limiter=rate_limiter or RateLimiter.from_context(context),
+                             payload_session=payload_session or PayloadSession.from_context(context))
+
+    @staticmethod
+    def create_transport(context):
+        return HttpTransport.from_config(context.get('channel'))
 
     def send_message(self, chat_id, message, channel=None, event=None, extra=None):
         data = self._prepare_payload(chat_id, message, channel, event, extra)
-        self.transport.post('/messages', data)
+        self._throttle(chat_id, channel, event)
+        try:
+            self.transport.post('/messages', data)
+        except Exception:
+            self._reset_payload_session()
+            raise
 
     def send_photo(self, chat_id, photo_url, channel=None, event=None):
         pass
 
+    def broadcast(self, message, recipients, channel=None, event=None, extra=None,
+                  chunk_size=1000, max_in_flight=8):
+        '''Send a message to many recipients
+
+        The message is serialized once. Recipients are read in chunks and
+        sent with up to ``max_in_flight`` concurrent requests.
+
+        :param recipients: an iterable of receiver chat ids
+        :return: a BroadcastResult object
+        :rtype: BroadcastResult'''
+        payload = self._prepare_broadcast_payload(message, channel, event, extra)
+        result = BroadcastResult()
+
+        def send(recipient):
+            try:
+                self._throttle(recipient, channel, event)
+                response = self.transport.post_raw('/messages', encode_json_with(payload, receiver=recipient))
+                response.raise_for_status()
+                return recipient, None
+            except Exception as e:
+                return recipient, e
+
+        pool = ThreadPool(max_in_flight)
+        try:
+            for chunk in chunked(recipients, chunk_size):
+                for recipient, error in pool.map(send, chunk):
+                    if error is None:
+                        result.sent += 1
+                    else:
+                        result.failures.append((recipient, error))
+        finally:
+            pool.close()
+            pool.join()
+        if result.failures:
+            self._reset_payload_session()
+        return result
+
     def close(self):
         pass
 
@@ -137,69 +561,457 @@ class ChannelClient(BaseChannelClient):
 class ZmqChannelClient(BaseChannelClient):
     '''A ChannelClient class using ZeroMQ
 
-    Send a message to  a messenger platform'''
+    Send a message to  a messenger platform
+
+    Each message is sent as a single JSON frame. In batch mode (``batch`` set
+    in the channel context), messages are buffered until ``flush()`` and sent
+    as one multipart message:
+
+    * frame 0: a JSON header. ``{"batch": <number of messages>, ...}`` with
+      items which every buffered message has in common, like ``event`` and ``context``
+    * frame 1..N: a JSON body per message with the remaining items
+
+    A receiver rebuilds each message by updating a copy of the header, without
+    ``batch``, with a body. A single buffered message is sent as a single frame.
+
+    With ``format`` set in the channel context to ``json`` or ``msgpack``,
+    passed as ``wire_format``, frames are encoded in the format and a content
+    type frame like ``application/msgpack`` comes first. Without it, JSON frames are sent
+    without a content type frame as before.'''
+    def __init__(self, project_id, api_key, base_url, transport=None, context=None, rate_limiter=None,
+                 payload_session=None, batch=False, wire_format=None):
+        super(ZmqChannelClient, self).__init__(project_id, api_key, base_url, transport, context,
+                                               rate_limiter, payload_session)
+        self.batch = batch
+        self.buffer = []
+        self.wire_format = wire_format
+        self.encode = codec.get_encoder(wire_format or 'json')
+        self.content_type = codec.CONTENT_TYPES[wire_format] if wire_format else None
+
     @staticmethod
-    def init_client(context, transport=None):
+    def init_client(context, transport=None, rate_limiter=None, payload_session=None):
         project_id = context.get('project_id')
         api_key = context.get('api_key', '')
         channel_endpoint = context.get('channel', {}).get('endpoint')
-        _transport = transport or ZmqTransport(channel_endpoint)
+        _transport = transport or ZmqChannelClient.create_transport(context)
         return ZmqChannelClient(project_id, api_key, channel_endpoint,
-                                transport=_transport, context=context)
+                                transport=_transport, context=context,
+                                rate_limiter=rate_limiter or RateLimiter.from_context(context),
+                                payload_session=payload_session or PayloadSession.from_context(context),
+                                batch=context.get('channel', {}).get('batch', False),
+                                wire_format=context.get('channel', {}).get('format'))
+
+    @staticmethod
+    def create_transport(context):
+        return ZmqTransport(context.get('channel', {}).get('endpoint'))
 
     def send_message(self, chat_id, message, channel=None, event=None, extra=None):
         data = self._prepare_payload(chat_id, message, channel, event, extra)
-        self.transport.send_multipart([json.dumps(data).encode('utf8')])
+        self._send(data, self._throttle_key(chat_id, channel, event))
 
     def send_photo(self, chat_id, photo_url, channel=None, event=None):
         data = self._prepare_payload_to_photo(chat_id, photo_url, channel, event)
-        self.transport.send_multipart([json.dumps(data).encode('utf8')])
+        self._send(data, self._throttle_key(chat_id, channel, event))
+
+    def _send(self, data, throttle_key):
+        if self.batch:
+            self.buffer.append((throttle_key, data))
+            return
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(*throttle_key)
+        self._send_frames([self.encode(data)])
+
+    def _send_frames(self, frames):
+        if self.content_type is not None:
+            frames = [self.content_type] + frames
+        try:
+            self.transport.send_multipart(frames)
+        except Exception:
+            self._reset_payload_session()
+            raise
+
+    def broadcast(self, message, recipients, channel=None, event=None, extra=None,
+                  chunk_size=1000, max_in_flight=None):
+        '''Send a message to many recipients
+
+        The message is serialized once and each chunk of recipients is sent as
+        one batch multipart message whose bodies only contain ``receiver``.
+        A chunk of one recipient is sent as a single message frame.
+        With a rate limiter, a chunk is split where a recipient has to wait.
+        ZeroMQ queues messages without waiting, so ``max_in_flight`` is unused.
+
+        :param recipients: an iterable of receiver chat ids
+        :return: a BroadcastResult object
+        :rtype: BroadcastResult'''
+        if self.wire_format in (None, 'json'):
+            payload = self._prepare_broadcast_payload(message, channel, event, extra)
+            encode_header = lambda size: encode_json_with(payload, batch=size)
+            encode_single = lambda recipient: encode_json_with(payload, receiver=recipient)
+        else:
+            data = self._prepare_broadcast_data(message, channel, event, extra)
+            encode_header = lambda size: self.encode(dict(data, batch=size))
+            encode_single = lambda recipient: self.encode(dict(data, receiver=recipient))
+        result = BroadcastResult()
+        for chunk in chunked(recipients, chunk_size):
+            items = [(self._throttle_key(recipient, channel, event), recipient) for recipient in chunk]
+            for group in self._throttled_groups(items):
+                if len(group) == 1:
+                    frames = [encode_single(group[0])]
+                else:
+                    frames = [encode_header(len(group))]
+                    frames.extend(self.encode({'receiver': recipient}) for recipient in group)
+                try:
+                    self._send_frames(frames)
+                    result.sent += len(group)
+                except zmq.ZMQError as e:
+                    result.failures.extend((recipient, e) for recipient in group)
+        return result
+
+    def flush(self):
+        '''Send buffered messages
+
+        With a rate limiter, messages which have to wait go in later multipart
+        messages, sent when the limiter allows them.'''
+        buffer, self.buffer = self.buffer, []
+        for group in self._throttled_groups(buffer):
+            self._send_batch(group)
+
+    def _send_batch(self, buffer):
+        if len(buffer) == 1:
+            self._send_frames([self.encode(buffer[0])])
+            return
+        header = dict((k, v) for k, v in buffer[0].items()
+                      if all(k in data and data[k] == v for data in buffer[1:]))
+        bodies = [dict((k, v) for k, v in data.items() if k not in header) for data in buffer]
+        header['batch'] = len(bodies)
+        self._send_frames([self.encode(d) for d in [header] + bodies])
 
     def close(self):
+        self.flush()
         self.transport.close()
 
 
+class TrackedDict(dict):
+    '''A dict which remembers its clean state to tell changed keys
+
+    Marking clean copies top-level items only. A nested dict, list or set is
+    copied when it is first read through this dict, so changes inside it are
+    detected while reads which never touch nested values copy nothing. Nested
+    values reached around it, like through ``dict(data)``, are not tracked.'''
+    def __init__(self, *args, **kwargs):
+        super(TrackedDict, self).__init__(*args, **kwargs)
+        self.mark_clean()
+
+    def mark_clean(self):
+        '''Regard current items as stored'''
+        self._clean = dict(self)
+        self._snapshots = {}
+
+    def _track(self, key, value):
+        if isinstance(value, (dict, list, set)) and key not in self._snapshots and \
+                self._clean.get(key) is value:
+            self._snapshots[key] = copy.deepcopy(value)
+        return value
+
+    def _track_all(self):
+        for key, value in dict.items(self):
+            self._track(key, value)
+
+    def __getitem__(self, key):
+        return self._track(key, super(TrackedDict, self).__getitem__(key))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if key in self:
+            self._track(key, dict.__getitem__(self, key))
+        return super(TrackedDict, self).pop(key, *args)
+
+    def popitem(self):
+        key, value = super(TrackedDict, self).popitem()
+        return key, self._track(key, value)
+
+    def values(self):
+        self._track_all()
+        return super(TrackedDict, self).values()
+
+    def items(self):
+        self._track_all()
+        return super(TrackedDict, self).items()
+
+    if hasattr(dict, 'iteritems'):
+        def itervalues(self):
+            self._track_all()
+            return dict.itervalues(self)
+
+        def iteritems(self):
+            self._track_all()
+            return dict.iteritems(self)
+
+        def viewvalues(self):
+            self._track_all()
+            return dict.viewvalues(self)
+
+        def viewitems(self):
+            self._track_all()
+            return dict.viewitems(self)
+
+    def copy(self):
+        self._track_all()
+        return super(TrackedDict, self).copy()
+
+    def __copy__(self):
+        self._track_all()
+        other = type(self).__new__(type(self))
+        dict.update(other, self)
+        other._clean = self._clean
+        other._snapshots = dict(self._snapshots)
+        return other
+
+    def changes(self):
+        '''Returns items changed since the clean state
+
+        Changes inside nested values are detected too.
+
+        :return: a tuple of a dict of set items and a list of deleted keys
+        :rtype: tuple'''
+        updated = {}
+        for key, value in dict.items(self):
+            if key not in self._clean:
+                updated[key] = value
+            elif key in self._snapshots:
+                if self._snapshots[key] != value:
+                    updated[key] = value
+            elif self._clean[key] is not value and self._clean[key] != value:
+                updated[key] = value
+        deleted = [k for k in self._clean if k not in self]
+        return updated, deleted
+
+
 class StorageClient(Client):
-    def __init__(self, project_id, api_key, base_url, transport=None, user=None):
+    def __init__(self, project_id, api_key, base_url, transport=None, user=None, partial_updates=False,
+                 batch_size=100, batch_concurrency=4):
         super(StorageClient, self).__init__(project_id, api_key, base_url, transport)
         self.current_user = user
+        self.partial_updates = partial_updates
+        self.batch_size = batch_size
+        self.batch_concurrency = batch_concurrency
+        self.user_data_map = None
+        self.loaded_users = set()
+        self.dirty_users = []
+        self.patched_users = set()
 
     @staticmethod
     def init_client(context, event=None, transport=None):
         project_id = context.get('project_id')
         api_key = context.get('api_key', '')
-        storage_endpoint = context.get('storage', {}).get('endpoint')
+        storage = context.get('storage', {})
+        storage_endpoint = storage.get('endpoint')
         user = None if not event else (event['channel'], event.get('sender', {}).get('id'))
-        return StorageClient(project_id, api_key, storage_endpoint, transport=transport, user=user)
+        _transport = transport or HttpTransport.from_config(storage)
+        return StorageClient(project_id, api_key, storage_endpoint, transport=_transport, user=user,
+                             partial_updates=storage.get('partial_updates', False),
+                             batch_size=storage.get('batch_size', 100),
+                             batch_concurrency=storage.get('batch_concurrency', 4))
+
+    def begin(self):
+        '''Start a unit of work.
+
+        Until ``commit()``, user data is fetched at most once per user and kept
+        in memory, and writes are deferred and merged into one request per user.
+        With ``partial_updates``, only changed keys are sent on commit.'''
+        self.user_data_map = {}
+        self.loaded_users = set()
+        self.dirty_users = []
+        self.patched_users = set()
+
+    def commit(self):
+        '''Write user data changed in the unit of work and end it.'''
+        for channel, user_id, data, patch in self._end_unit():
+            if patch:
+                self.patch_user_data(channel, user_id, data)
+            else:
+                self.set_user_data(channel, user_id, data)
+
+    def _end_unit(self):
+        if self.user_data_map is None:
+            return []
+        user_data_map, dirty_users, patched_users = self.user_data_map, self.dirty_users, self.patched_users
+        self.user_data_map = None
+        self.loaded_users = set()
+        self.dirty_users = []
+        self.patched_users = set()
+        return [(channel, user_id, user_data_map[(channel, user_id)],
+                 self.partial_updates or (channel, user_id) in patched_users)
+                for channel, user_id in dirty_users]
+
+    def _project_url(self):
+        return '/projects/{}'.format(self.project_id)
+
+    def _user_url(self, channel, user_id):
+        return '/projects/{}/channels/{}/users/{}'.format(self.project_id, channel, user_id)
 
     def set_project_data(self, data):
-        self.transport.put(
-            '/projects/{}'.format(self.project_id),
-            {'data': data},
-        )
+        self.transport.put(self._project_url(), {'data': data})
+
+    def patch_project_data(self, data):
+        '''Send only keys changed in project data
+
+        :param data: a dict to store. for a dict ``get_project_data()`` returned,
+                     only changed and deleted keys are sent
+        :type data: dict'''
+        self._patch(self._project_url(), data)
 
     def get_project_data(self, key=None):
-        url = '/projects/{}'.format(self.project_id)
+        url = self._project_url()
         if key:
-            url += '/{}'.format(key)
-        return self.transport.get(url).get('data') or {}
+            return self.transport.get(url + '/{}'.format(key)).get('data') or {}
+        return TrackedDict(self.transport.get(url).get('data') or {})
 
     def set_user_data(self, channel, user_id, data):
-        self.transport.put(
-            '/projects/{}/channels/{}/users/{}'.format(self.project_id, channel, user_id),
-            {'data': data},
-        )
+        if self.user_data_map is not None:
+            self._defer_user_data(channel, user_id, data)
+            return
+        self.transport.put(self._user_url(channel, user_id), {'data': data})
+
+    def patch_user_data(self, channel, user_id, data):
+        '''Send only keys changed in user data
+
+        :param data: a dict to store. for a dict ``get_user_data()`` returned,
+                     only changed and deleted keys are sent
+        :type data: dict'''
+        if self.user_data_map is not None:
+            self._defer_user_data(channel, user_id, data)
+            self.patched_users.add((channel, user_id))
+            return
+        self._patch(self._user_url(channel, user_id), data)
+
+    def _patch(self, url, data):
+        body = self._patch_body(data)
+        if body is None:
+            return
+        self.transport.patch(url, body)
+        if isinstance(data, TrackedDict):
+            data.mark_clean()
+
+    def _patch_body(self, data):
+        if isinstance(data, TrackedDict):
+            updated, deleted = data.changes()
+        else:
+            updated, deleted = data, []
+        if not updated and not deleted:
+            return None
+        return {'set': updated, 'delete': deleted}
+
+    def _defer_user_data(self, channel, user_id, data):
+        user = (channel, user_id)
+        cached = self.user_data_map.get(user)
+        if cached is None:
+            # a copy, so a dict passed for many users or changed later is not shared
+            self.user_data_map[user] = copy.copy(data)
+        elif cached is not data:
+            cached.update(data)
+        if user not in self.dirty_users:
+            self.dirty_users.append(user)
 
     def get_user_data(self, channel, user_id, key=None):
-        url = '/projects/{}/channels/{}/users/{}'.format(self.project_id, channel, user_id)
+        if self.user_data_map is None:
+            return self._fetch_user_data(channel, user_id, key)
+        user = (channel, user_id)
+        if user not in self.loaded_users:
+            self._load_user_data(user, self._fetch_user_data(channel, user_id))
+        return self._cached_user_data(user, key)
+
+    def _load_user_data(self, user, data):
+        data.update(self.user_data_map.get(user) or {})
+        self.user_data_map[user] = data
+        self.loaded_users.add(user)
+
+    def _cached_user_data(self, user, key=None):
+        data = self.user_data_map[user]
+        return data if not key else data.get(key) or {}
+
+    def get_many_user_data(self, keys, batch_size=None, concurrency=None):
+        '''Returns user data of many users
+
+        Users are requested in chunks of ``batch_size`` and chunks are
+        requested concurrently. The unit of work is bypassed.
+
+        :param keys: an iterable of ``(channel, user_id)`` tuples
+        :param batch_size: users per request. ``self.batch_size`` is used if omitted
+        :param concurrency: requests in flight. ``self.batch_concurrency`` is used if omitted
+        :return: a list of user data dicts in the order of keys
+        :rtype: list
+        :raises requests.HTTPError: if a chunk request failed
+        :raises TransportError: if a chunk response has another number of users'''
+        url = '/projects/{}/users/_mget'.format(self.project_id)
+
+        def fetch(chunk):
+            users = [{'channel': channel, 'user_id': user_id} for channel, user_id in chunk]
+            response = self.transport.post(url, {'users': users})
+            response.raise_for_status()
+            data = codec.loads(response.content).get('data') or []
+            if len(data) != len(chunk):
+                raise TransportError('{} returned {} users for {}'.format(url, len(data), len(chunk)))
+            return [TrackedDict(d or {}) for d in data]
+
+        results = []
+        for data in self._run_chunks(fetch, keys, batch_size, concurrency):
+            results.extend(data)
+        return results
+
+    def set_many_user_data(self, items, batch_size=None, concurrency=None):
+        '''Set user data of many users
+
+        Users are sent in chunks of ``batch_size`` and chunks are sent
+        concurrently. The unit of work is bypassed.
+
+        :param items: an iterable of ``(channel, user_id, data)`` tuples
+        :param batch_size: users per request. ``self.batch_size`` is used if omitted
+        :param concurrency: requests in flight. ``self.batch_concurrency`` is used if omitted
+        :raises requests.HTTPError: if a chunk request failed'''
+        url = '/projects/{}/users/_mset'.format(self.project_id)
+
+        def store(chunk):
+            users = [{'channel': channel, 'user_id': user_id, 'data': data}
+                     for channel, user_id, data in chunk]
+            self.transport.post(url, {'users': users}).raise_for_status()
+
+        for _ in self._run_chunks(store, items, batch_size, concurrency):
+            pass
+
+    def _run_chunks(self, func, items, batch_size=None, concurrency=None):
+        chunks = chunked(items, batch_size or self.batch_size)
+        _concurrency = concurrency or self.batch_concurrency
+        if _concurrency <= 1:
+            return [func(chunk) for chunk in chunks]
+        pool = ThreadPool(_concurrency)
+        try:
+            return pool.map(func, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _fetch_user_data(self, channel, user_id, key=None):
+        url = self._user_url(channel, user_id)
         if key:
-            url += '/{}'.format(key)
-        return self.transport.get(url).get('data') or {}
+            return self.transport.get(url + '/{}'.format(key)).get('data') or {}
+        return TrackedDict(self.transport.get(url).get('data') or {})
 
     def set_current_user_data(self, data):
         channel, user_id = self.current_user
         self.set_user_data(channel, user_id, data)
 
+    def patch_current_user_data(self, data):
+        channel, user_id = self.current_user
+        self.patch_user_data(channel, user_id, data)
+
     def get_current_user_data(self, key=None):
         channel, user_id = self.current_user
         return self.get_user_data(channel, user_id, key)
@@ -217,12 +1029,91 @@ class NluClient(object):
         '''
         raise NotImplementedError()
 
+    def ask_many(self, messages, session_ids, concurrency=4, lang=None):
+        '''Query many messages concurrently
+
+        Up to ``concurrency`` queries run at once, and responses are yielded in
+        the order of messages as they arrive. Messages are read lazily, so
+        memory use does not grow with the number of messages. An error of a
+        query is raised when its response is due.
+
+        ex) for response in client.ask_many(texts, 'backfill', concurrency=16):
+                ...
+
+        :param messages: an iterable of texts
+        :param session_ids: a session id for all messages, or an iterable of session ids per message
+        :param concurrency: a maximum number of queries in flight
+        :type concurrency: int
+        :param lang: an optional language of messages
+        :type lang: str
+        :return: a generator of NluResponse objects'''
+        if isinstance(session_ids, string_types):
+            session_ids = itertools.repeat(session_ids)
+        sessions = iter(session_ids)
+        kwargs = {} if lang is None else {'lang': lang}
+        pool = ThreadPool(concurrency)
+        pending = deque()
+        try:
+            for message in messages:
+                session_id = next(sessions, None)
+                if session_id is None:
+                    raise ValueError('fewer session ids than messages')
+                if len(pending) >= concurrency:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(
+                    self.ask, kwds=dict(kwargs, message=message, session_id=session_id)))
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
 class DialogflowNluClient(NluClient):
-    '''An NLU client for Dialogflow'''
-    def __init__(self, agent_id):
+    '''An NLU client for Dialogflow
+
+    A session client is created on the first query and reused. The default
+    language of an agent is fetched on first use and shared by clients of the
+    agent for ``lang_refresh_interval`` seconds. If a refresh fails, the
+    stale language is used for ``lang_retry_interval`` seconds before trying
+    again.'''
+    agent_langs = {}
+    _agent_langs_lock = threading.Lock()
+
+    def __init__(self, agent_id, lang_refresh_interval=3600, lang_retry_interval=60, clock=time.time):
         self.agent_id = agent_id
+        self.lang_refresh_interval = lang_refresh_interval
+        self.lang_retry_interval = lang_retry_interval
+        self.clock = clock
         self.dialogflow = __import__('dialogflow')
-        self.lang = self._get_lang()
+        self._session_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def lang(self):
+        '''The default language of the agent'''
+        entry = self.agent_langs.get(self.agent_id)
+        now = self.clock()
+        if entry is not None and now < entry[1]:
+            return entry[0]
+        try:
+            lang, expires = self._get_lang(), now + self.lang_refresh_interval
+        except Exception:
+            if entry is None:
+                raise
+            lang, expires = entry[0], now + self.lang_retry_interval
+        with self._agent_langs_lock:
+            self.agent_langs[self.agent_id] = (lang, expires)
+        return lang
+
+    @property
+    def session_client(self):
+        '''A SessionsClient shared by queries of this client'''
+        if self._session_client is None:
+            with self._lock:
+                if self._session_client is None:
+                    self._session_client = self.dialogflow.SessionsClient()
+        return self._session_client
 
     def _get_lang(self):
         client = self.dialogflow.AgentsClient()
@@ -261,20 +1152,13 @@ class DialogflowNluClient(NluClient):
             return self._ask_with_message(message, session_id, lang)
 
     def _ask_with_event(self, event, lang=None):
-        lang = lang or self.lang
         text = event.get('content')
         session_id = '{}-{}'.format(event.get('channel'), event.get('sender').get('id'))
-        session_client = self.dialogflow.SessionsClient()
-        session = session_client.session_path(self.agent_id, session_id)
-        text_input = self.dialogflow.types.TextInput(text=text, language_code=lang)
-        query_input = self.dialogflow.types.QueryInput(text=text_input)
-        response = session_client.detect_intent(session, query_input=query_input)
-
-        return DialogflowNluClient.parse_response(response.query_result)
+        return self._ask_with_message(text, session_id, lang)
 
     def _ask_with_message(self, message, session_id, lang=None):
         lang = lang or self.lang
-        session_client = self.dialogflow.SessionsClient()
+        session_client = self.session_client
         session = session_client.session_path(self.agent_id, session_id)
         text_input = self.dialogflow.types.TextInput(text=message, language_code=lang)
         query_input = self.dialogflow.types.QueryInput(text=text_input)
@@ -337,19 +1221,129 @@ class ApiAiNluClient(NluClient):
         return ApiAiNluClient.parse_response(response)
 
 
+class CachedNluClient(NluClient):
+    '''An NluClient which serves repeated queries from a cache
+
+    Responses are cached by vendor, normalized text and language, and by
+    session too with ``include_session``. Cached NluResponse objects are
+    shared, so do not modify them. Pass ``use_cache=False`` to ``ask()`` for
+    queries which depend on a session context.'''
+    def __init__(self, client, vendor, cache, include_session=False):
+        '''Initialize a client
+
+        :param client: an NluClient to query on a cache miss
+        :type client: NluClient
+        :param vendor: a NLU vendor name
+        :type vendor: str
+        :param cache: a cache shared by clients of the vendor
+        :type cache: bothub_client.utils.LRUCache
+        :param include_session: cache responses per session
+        :type include_session: bool'''
+        self.client = client
+        self.vendor = vendor
+        self.cache = cache
+        self.include_session = include_session
+
+    def cache_key(self, event=None, message=None, session_id=None, lang=None):
+        text = event.get('content') if event else message
+        if not text:
+            return None
+        session = None
+        if self.include_session:
+            session = session_id if not event else '{}-{}'.format(
+                event.get('channel'), event.get('sender', {}).get('id'))
+        return (self.vendor, normalize(text), lang, session)
+
+    def ask(self, event=None, message=None, session_id=None, lang=None, use_cache=True):
+        '''Query a message, returning a cached response if there is
+
+        :param use_cache: set ``False`` to query the NLU service always
+        :type use_cache: bool'''
+        kwargs = {'event': event, 'message': message, 'session_id': session_id}
+        if lang is not None:
+            kwargs['lang'] = lang
+        key = self.cache_key(event, message, session_id, lang) if use_cache else None
+        if key is None:
+            return self.client.ask(**kwargs)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.client.ask(**kwargs)
+            if response is not None:
+                self.cache.set(key, response)
+        return response
+
+
 class NluClientFactory(object):
-    '''An NluClientFactory which returns NluClient according to vendor name'''
+    '''An NluClientFactory which returns NluClient according to vendor name
+
+    Clients are created once per vendor and parameters in the process and
+    shared by factories, so they must be thread-safe. A vendor name given as
+    ``fallback`` is resolved to the client of the vendor. A chain of fallbacks
+    leading back to a vendor raises ValueError.
+
+    Add ``cache`` to the parameters of a vendor to cache its responses in the
+    process::
+
+        {'nlu': {'apiai': {'api_key': '...',
+                           'cache': {'maxsize': 1024, 'ttl': 3600, 'include_session': False}}}}'''
     NAME_TO_CLIENT = {
         'apiai': ApiAiNluClient,
-        'dialogflow': DialogflowNluClient
+        'dialogflow': DialogflowNluClient,
+        'local': 'bothub_client.local_nlu:LocalNluClient',
+        'tfidf': 'bothub_client.tfidf_nlu:TfidfNluClient'
     }
+    clients = {}
+    _clients_lock = threading.RLock()
+    _creating = []
 
     def __init__(self, context):
-        self.integrations_params = context.get('nlu')
+        self.integrations_params = context.get('nlu') or {}
 
     def get(self, vendor):
         '''Returns a proper NluClient object'''
-        return self.NAME_TO_CLIENT.get(vendor)(**self.integrations_params.get(vendor))
+        params = self.integrations_params.get(vendor) or {}
+        key = NluClientFactory.params_key(vendor, params)
+        client = self.clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self.clients.get(key)
+                if client is None:
+                    if key in self._creating:
+                        raise ValueError('fallback of {} falls back to itself'.format(vendor))
+                    self._creating.append(key)
+                    try:
+                        client = self.clients[key] = self._create(vendor, params)
+                    finally:
+                        self._creating.remove(key)
+        return client
+
+    @classmethod
+    def clear(cls):
+        '''Forget clients created so far'''
+        with cls._clients_lock:
+            cls.clients.clear()
+
+    def _create(self, vendor, params):
+        params = dict(params)
+        cache_options = params.pop('cache', None)
+        if isinstance(params.get('fallback'), string_types):
+            params['fallback'] = self.get(params['fallback'])
+        client_class = self.NAME_TO_CLIENT.get(vendor)
+        if isinstance(client_class, string_types):
+            module_name, _, class_name = client_class.partition(':')
+            client_class = getattr(importlib.import_module(module_name), class_name)
+        client = client_class(**params)
+        if not cache_options:
+            return client
+        cache_options = {} if cache_options is True else dict(cache_options)
+        include_session = cache_options.pop('include_session', False)
+        cache = LRUCache(cache_options.get('maxsize', 1024), cache_options.get('ttl', 3600))
+        return CachedNluClient(client, vendor, cache, include_session=include_session)
+
+    @staticmethod
+    def params_key(vendor, params):
+        '''Returns a hashable key of a vendor and its parameters'''
+        return (vendor, tuple(sorted((k, repr(v)) for k, v in params.items())))
 
 
 class NluAction(object):
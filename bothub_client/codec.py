@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+'''JSON encoding for transports
+
+``orjson`` or ``ujson`` is used when installed, and the standard ``json``
+module otherwise. ``dumps()`` always returns UTF-8 bytes ready to be sent.
+Objects a fast library cannot encode, like integers beyond 64 bits, are
+encoded with the standard ``json`` module instead.
+
+MessagePack is available as an alternative wire format of the ZeroMQ channel
+protocol with ``get_encoder('msgpack')``. It needs the ``msgpack`` package.'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import functools
+import json
+
+BACKENDS = ('orjson', 'ujson', 'json')
+CONTENT_TYPES = {'json': b'application/json', 'msgpack': b'application/msgpack'}
+
+name = None
+dumps = None
+loads = None
+
+
+def _orjson_codec(orjson):
+    option = orjson.OPT_NON_STR_KEYS
+    errors = (TypeError, getattr(orjson, 'JSONEncodeError', TypeError))
+    fallback, _ = _json_codec(json)
+
+    def _dumps(obj):
+        try:
+            return orjson.dumps(obj, option=option)
+        except errors:
+            return fallback(obj)
+    return _dumps, orjson.loads
+
+
+def _ujson_codec(ujson):
+    fallback, _ = _json_codec(json)
+
+    def _dumps(obj):
+        try:
+            return ujson.dumps(obj, ensure_ascii=False).encode('utf8')
+        except (OverflowError, TypeError):
+            return fallback(obj)
+
+    def _loads(data):
+        return ujson.loads(data.decode('utf8') if isinstance(data, bytes) else data)
+    return _dumps, _loads
+
+
+def _json_codec(_json):
+    def _dumps(obj):
+        return _json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+    def _loads(data):
+        return _json.loads(data.decode('utf8') if isinstance(data, bytes) else data)
+    return _dumps, _loads
+
+
+_CODECS = {'orjson': _orjson_codec, 'ujson': _ujson_codec, 'json': _json_codec}
+
+
+def use(backend=None):
+    '''Select a JSON library
+
+    :param backend: one of 'orjson', 'ujson' and 'json'. the fastest installed one if omitted
+    :type backend: str
+    :return: a name of the selected library
+    :rtype: str'''
+    global name, dumps, loads
+    candidates = [backend] if backend else BACKENDS
+    for candidate in candidates:
+        try:
+            module = json if candidate == 'json' else __import__(candidate)
+        except ImportError:
+            if backend:
+                raise
+            continue
+        dumps, loads = _CODECS[candidate](module)
+        name = candidate
+        return name
+
+
+use()
+
+
+def get_encoder(wire_format):
+    '''Returns a function which encodes an object to bytes in a wire format
+
+    :param wire_format: 'json' or 'msgpack'
+    :type wire_format: str'''
+    if wire_format == 'json':
+        return lambda obj: dumps(obj)
+    if wire_format == 'msgpack':
+        msgpack = __import__('msgpack')
+        return functools.partial(msgpack.packb, use_bin_type=True)
+    raise ValueError('unknown format: {}'.format(wire_format))
+
+
+def get_decoder(wire_format):
+    '''Returns a function which decodes bytes in a wire format
+
+    :param wire_format: 'json' or 'msgpack'
+    :type wire_format: str'''
+    if wire_format == 'json':
+        return lambda data: loads(data)
+    if wire_format == 'msgpack':
+        msgpack = __import__('msgpack')
+        return functools.partial(msgpack.unpackb, raw=False)
+    raise ValueError('unknown format: {}'.format(wire_format))
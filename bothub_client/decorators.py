@@ -2,13 +2,37 @@
 
 from functools import wraps
 
+HANDLERS_ATTR = '_bothub_handlers'
 
-def command(name):
+
+def _mark_handler(func, wrapper, dec_type, args):
+    '''Record a handler declaration on a wrapper function.
+
+    Declarations of stacked decorators are accumulated in order.'''
+    handlers = list(getattr(func, HANDLERS_ATTR, []))
+    handlers.append((dec_type, list(args)))
+    setattr(wrapper, HANDLERS_ATTR, handlers)
+    return wrapper
+
+
+def get_handler_declarations(func):
+    '''Returns handler declarations recorded on a function
+
+    :return: a list of ``(decorator type, args)`` tuples
+    :rtype: list'''
+    return getattr(func, HANDLERS_ATTR, [])
+
+
+def command(name, *aliases):
+    '''Declare a command handler
+
+    :param name: a command name to handle ``/<name>``
+    :param aliases: other command names the handler handles'''
     def dec(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
-        return wrapper
+        return _mark_handler(func, wrapper, 'command', [name] + list(aliases))
     return dec
 
 
@@ -17,7 +41,7 @@ def intent(name):
         @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
-        return wrapper
+        return _mark_handler(func, wrapper, 'intent', [name])
     return dec
 
 
@@ -26,5 +50,5 @@ def channel(*names):
         @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
-        return wrapper
+        return _mark_handler(func, wrapper, 'channel', names)
     return dec
@@ -1,14 +1,142 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import inspect
 import logging
-from bothub_client.utils import get_decorators
+from bothub_client.decorators import get_handler_declarations
 from bothub_client.messages import Message
 
+try:
+    from types import MappingProxyType
+except ImportError:
+    MappingProxyType = dict
+
 logger = logging.getLogger('bothub.dispatcher')
 
+_handler_tables = {}
+_command_routes = {}
+_class_attributes = {}
+_missing = object()
+
+NEW_STYLE = 'new'
+OLD_STYLE = 'old'
+
+
+def get_handler_table(cls):
+    '''Returns a routing table of handlers declared with decorators.
+
+    The table is built once per class from metadata the decorators recorded,
+    walking base classes first so subclasses can override handlers. A method
+    overridden with decorators replaces the handlers of the base method, and
+    one overridden without decorators keeps them. A command name or alias
+    declared twice in a class raises ValueError.
+
+    :param cls: a Bot class or object
+    :return: a read-only dict of decorator type to ``{handler name: method name}`` dict
+    :rtype: dict'''
+    _cls = cls if inspect.isclass(cls) else cls.__class__
+    table = _handler_tables.get(_cls)
+    if table is not None:
+        return table
+
+    table = {'command': {}, 'intent': {}, 'channel': {}}
+    for klass in reversed(inspect.getmro(_cls)):
+        commands = {}
+        for method_name, attr in vars(klass).items():
+            declarations = get_handler_declarations(attr)
+            if not declarations:
+                continue
+            for handler_dict in table.values():
+                for handler_name in [k for k, v in handler_dict.items() if v == method_name]:
+                    del handler_dict[handler_name]
+            for dec_type, args in declarations:
+                handler_dict = table.get(dec_type)
+                if handler_dict is None:
+                    continue
+                for handler_name in args or ['default']:
+                    if dec_type == 'command':
+                        if handler_name in commands:
+                            raise ValueError('command {} of {} is declared by both {} and {}'.format(
+                                handler_name, klass.__name__, commands[handler_name], method_name))
+                        commands[handler_name] = method_name
+                    handler_dict[handler_name] = method_name
+    table = _handler_tables[_cls] = MappingProxyType(
+        dict((dec_type, MappingProxyType(handlers)) for dec_type, handlers in table.items()))
+    return table
+
+
+def get_command_routes(cls, pattern='on_{command}'):
+    '''Returns command routes of a class
+
+    Commands declared with ``@command`` and its aliases take precedence over
+    old style ``on_<command>`` methods. Routes are built once per class, and
+    duplicate command names raise ValueError like ``get_handler_table()``.
+
+    :param cls: a Bot class or object
+    :param pattern: a method name pattern of old style command handlers
+    :type pattern: str
+    :return: a read-only dict of command name to a tuple of a method name and a handler style
+    :rtype: dict'''
+    _cls = cls if inspect.isclass(cls) else cls.__class__
+    routes = _command_routes.get((_cls, pattern))
+    if routes is not None:
+        return routes
+
+    prefix, _, suffix = pattern.partition('{command}')
+    routes = {}
+    for method_name in dir(_cls):
+        if method_name.startswith(prefix) and method_name.endswith(suffix) and \
+                len(method_name) > len(prefix) + len(suffix) and callable(getattr(_cls, method_name, None)):
+            routes[method_name[len(prefix):len(method_name) - len(suffix)]] = (method_name, OLD_STYLE)
+    for command, method_name in get_handler_table(_cls)['command'].items():
+        routes[command] = (method_name, NEW_STYLE)
+    routes = _command_routes[(_cls, pattern)] = MappingProxyType(routes)
+    return routes
+
+
+def _get_class_attribute(cls, name):
+    '''Returns a raw attribute of a class looked up along its MRO, once per class
+
+    :return: the attribute, or ``_missing`` if no class defines it'''
+    key = (cls, name)
+    attr = _class_attributes.get(key, None)
+    if attr is None:
+        attr = next((vars(klass)[name] for klass in inspect.getmro(cls) if name in vars(klass)), _missing)
+        _class_attributes[key] = attr
+    return attr
+
+
+class PrefixTrie(object):
+    '''A trie which finds the longest registered prefix of a text'''
+    def __init__(self, prefixes):
+        '''Initialize a trie
+
+        :param prefixes: a dict of prefix to a value
+        :type prefixes: dict'''
+        self.root = {}
+        for prefix, value in prefixes.items():
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = value
+
+    def longest(self, text):
+        '''Returns a value of the longest prefix of the text, or None'''
+        node = self.root
+        value = node.get(None)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            value = node.get(None, value)
+        return value
+
+
 class DefaultDispatcher(object):
     default_handler_name = 'on_default'
     command_handler_pattern = 'on_{command}'
+    prefix_routes = PrefixTrie({'/': 'command', '/intent ': 'intent'})
+    kakao_init_keyboard_command = '/kakao_init_keyboard'
 
     def __init__(self, bot, state):
         '''Initializer
@@ -20,24 +148,26 @@ class DefaultDispatcher(object):
         '''
         self.bot = bot
         self.state = state
-        self.command_handlers = {}
-        self.intent_handlers = {}
-        self.channel_handlers = {}
-        self._read_handlers()
-
-    def _read_handlers(self):
-        dec_type_to_handler_dict = {'command': self.command_handlers,
-                                    'intent': self.intent_handlers,
-                                    'channel': self.channel_handlers}
-        method_to_decorators = get_decorators(self.bot)
-        logger.debug('dispatch: method_to_decorators - %s', method_to_decorators)
-        for method_name, decorators in method_to_decorators.items():
-            for dec_type, args in decorators:
-                handler_dict = dec_type_to_handler_dict.get(dec_type)
-                if handler_dict is None:
-                    continue
-                handler_name = args[0] if args else 'default'
-                handler_dict[handler_name] = method_name
+        handler_table = get_handler_table(bot)
+        self.command_handlers = handler_table['command']
+        self.intent_handlers = handler_table['intent']
+        self.channel_handlers = handler_table['channel']
+        self.command_routes = get_command_routes(bot, self.command_handler_pattern)
+
+    def _handler(self, method_name):
+        '''Returns a bound handler method, or None
+
+        Handlers are looked up once per bot class and bound to the bot here,
+        since a dispatcher is created for each event.'''
+        attrs = getattr(self.bot, '__dict__', None)
+        if attrs and method_name in attrs:
+            return attrs[method_name]
+        bot_class = type(self.bot)
+        attr = _get_class_attribute(bot_class, method_name)
+        if attr is _missing:
+            return getattr(self.bot, method_name, None)
+        get = getattr(attr, '__get__', None)
+        return attr if get is None else get(self.bot, bot_class)
 
     def dispatch(self, event, context):
         '''Dispatch incoming message event.
@@ -67,82 +197,81 @@ class DefaultDispatcher(object):
         if current_channel is None:
             return
 
-        channel_handler = self.channel_handlers.get(current_channel)
-        if channel_handler is None:
-            channel_handler = self.channel_handlers.get('default', None)
-        if channel_handler:
-            handler_func = getattr(self.bot, channel_handler)
+        handler_func = self._channel_handler(current_channel)
+        if handler_func:
             handler_func(event, context)
-        else:
-            handler_func = getattr(self.bot, self.default_handler_name, None)
-            if handler_func:
-                handler_func(event, context)
 
     def open_intent(self, event, content):
         intent_id = self._get_intent_id(content)
         logger.debug('dispatch: intent %s started', intent_id)
         self.state.open(intent_id)
         result = self.state.next()
-        message = Message(event)
-        message.set_text(result.next_message)
-        if result.options:
-            for option in result.options:
-                message.add_postback_button(option, option)
-        self.bot.send_message(message)
+        self.bot.send_message(self._intent_message(event, result))
 
     def execute_command(self, event, context, content):
         command, args = self._get_command_args(content)
         logger.debug('dispatch: start command %s', command)
-        try:
-            new_style_handler_name = self.command_handlers.get(command)
-            old_style_handler_name = self.command_handler_pattern.format(command=command)
-
-            if new_style_handler_name:
-                handler_func = getattr(self.bot, new_style_handler_name)
-                handler_func(event, context, args)
-            elif old_style_handler_name:
-                handler_func = getattr(self.bot, old_style_handler_name)
-                handler_func(event, context, *args)
-
-        except (KeyError, AttributeError):
-            if self._is_kakao_init_keyboard_command(content):
-                message = Message(event)
-                message.add_keyboard_button('__init_keyboard__')
-                self.bot.send_message(message)
-            else:
-                self.bot.send_message('No such command: {}'.format(command))
+        handler_func, style = self._command_handler(command)
+
+        if handler_func is not None and style == NEW_STYLE:
+            handler_func(event, context, args)
+        elif handler_func is not None:
+            handler_func(event, context, *args)
+        elif self._is_kakao_init_keyboard_command(content):
+            message = Message(event)
+            message.add_keyboard_button('__init_keyboard__')
+            self.bot.send_message(message)
+        else:
+            self.bot.send_message('No such command: {}'.format(command))
 
     def proceed_intent(self, event, context):
         logger.debug('dispatch: continue to process intent')
         result = self.state.next(event)
         if result.completed:
             logger.debug('dispatch: intent completed')
+            self._intent_complete_handler(event, context, result)()
+        else:
+            self.bot.send_message(self._intent_message(event, result))
 
-            new_sytle_handler_name = self.intent_handlers.get(result.intent_id)
-            old_style_handler_name = result.complete_handler_name or 'set_{}'.format(result.intent_id)
+    def _channel_handler(self, channel):
+        channel_handler = self.channel_handlers.get(channel)
+        if channel_handler is None:
+            channel_handler = self.channel_handlers.get('default', None)
+        return self._handler(channel_handler or self.default_handler_name)
 
-            if new_sytle_handler_name:
-                handler_func = getattr(self.bot, new_sytle_handler_name)
-                handler_func(event, context, result.answers)
-            elif old_style_handler_name:
-                handler_func = getattr(self.bot, old_style_handler_name)
-                handler_func(event, context, **result.answers)
-        else:
-            message = Message(event)
-            message.set_text(result.next_message)
-            if result.options:
-                for option in result.options:
-                    message.add_postback_button(option, option)
-            self.bot.send_message(message)
+    def _command_handler(self, command):
+        '''Returns a handler of a command and its style, or ``(None, OLD_STYLE)``'''
+        method_name, style = self.command_routes.get(command, (None, None))
+        handler_func = self._handler(method_name) if method_name else None
+        if handler_func is None:
+            style = OLD_STYLE
+            handler_func = self._handler(self.command_handler_pattern.format(command=command))
+        return handler_func, style
+
+    def _intent_complete_handler(self, event, context, result):
+        '''Returns a function which calls the handler of a completed intent'''
+        new_sytle_handler_name = self.intent_handlers.get(result.intent_id)
+        if new_sytle_handler_name:
+            return functools.partial(getattr(self.bot, new_sytle_handler_name), event, context, result.answers)
+        old_style_handler_name = result.complete_handler_name or 'set_{}'.format(result.intent_id)
+        return functools.partial(getattr(self.bot, old_style_handler_name), event, context, **result.answers)
+
+    def _intent_message(self, event, result):
+        message = Message(event)
+        message.set_text(result.next_message)
+        if result.options:
+            for option in result.options:
+                message.add_postback_button(option, option)
+        return message
 
     def _is_command(self, content):
-        return content is not None and content.startswith('/')
+        return bool(content) and self.prefix_routes.longest(content) is not None
 
     def _is_intent_command(self, content):
-        return content is not None and content.startswith('/intent ')
+        return bool(content) and self.prefix_routes.longest(content) == 'intent'
 
     def _is_kakao_init_keyboard_command(self, content):
-        return content is not None and content == '/kakao_init_keyboard'
+        return content == self.kakao_init_keyboard_command
 
     def _get_intent_id(self, content):
         _, intent_id = content.split()
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
 import yaml
 from collections import namedtuple
+from bothub_client.utils import FileCache
 
 logger = logging.getLogger('bothub.intent')
 
@@ -60,6 +62,20 @@ class IntentState(object):
             intent_slots.append(intent)
         return intent_slots
 
+    @staticmethod
+    def get_intent_slots(path=None):
+        '''Returns intent definitions in a yml file, using a process-wide cache.
+
+        The file is parsed again only when its mtime or size changes.
+        Call this at startup to preload definitions before handling events.
+
+        :param path: a bothub.yml path. ``./bothub.yml`` is used if omitted
+        :type path: str
+        :return: a list of Intent objects. empty if the file does not exist
+        :rtype: list'''
+        _path = path or os.path.join(os.path.realpath('.'), 'bothub.yml')
+        return intent_slots_cache.get(_path, default=[])
+
     def open(self, intent_id):
         '''Open and start an intent.
         Should execute a `next()` method after open an intent.
@@ -152,3 +168,6 @@ class IntentState(object):
             return slot['question'], slot['options']
         except IndexError:
             return None, None
+
+
+intent_slots_cache = FileCache(IntentState.load_intent_slots_from_yml)
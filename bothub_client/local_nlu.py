@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+r'''An offline NLU vendor matching example phrases and patterns
+
+Intents are read from ``bothub.yml``::
+
+    intents:
+      greeting:
+        examples:
+          - hi
+          - good morning
+      order:
+        patterns:
+          - 'i want (?P<count>\d+) (?P<item>\w+)'
+
+Use it with ``self.nlu('local').ask(event=event)``. Set ``fallback`` to another
+vendor name to ask it when no intent matches::
+
+    {'nlu': {'local': {'fallback': 'apiai'}, 'apiai': {'api_key': '...'}}}'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+import re
+from collections import deque
+
+from bothub_client.clients import NluAction
+from bothub_client.clients import NluClient
+from bothub_client.clients import NluResponse
+from bothub_client.intent import IntentState
+from bothub_client.utils import FileCache
+from bothub_client.utils import normalize
+
+# numbered group references, which are renumbered in a combined pattern
+GROUP_REFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(\d')
+
+
+class KeywordIndex(object):
+    '''An Aho-Corasick automaton finding many keywords in one pass over a text'''
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, keyword, value):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((len(keyword), value))
+
+    def build(self):
+        '''Link failure transitions. Call after adding all keywords'''
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+        return self
+
+    def search(self, text):
+        '''Yield ``(start, end, value)`` of every keyword found in the text'''
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.output[state]:
+                yield index + 1 - length, index + 1, value
+
+
+class LocalModel(object):
+    '''Compiled example phrases and patterns of intents'''
+    pattern_confidence = 0.9
+
+    def __init__(self, intents):
+        '''Initialize a model
+
+        :param intents: a dict of intent ids to dicts with ``examples`` and ``patterns`` lists
+        :type intents: dict'''
+        self.examples = {}
+        self.index = KeywordIndex()
+        patterns = []
+        for intent_id, definition in intents.items():
+            definition = definition or {}
+            for example in definition.get('examples', []):
+                phrase = normalize(example)
+                self.examples.setdefault(phrase, intent_id)
+                self.index.add(phrase, intent_id)
+            for pattern in definition.get('patterns', []):
+                patterns.append((intent_id, pattern))
+        self.index.build()
+        self.pattern_intents = [intent_id for intent_id, _ in patterns]
+        self.patterns = [re.compile(p, re.IGNORECASE | re.UNICODE) for _, p in patterns]
+        self.combined = None
+        if patterns and not any(GROUP_REFERENCE.search(p) for _, p in patterns):
+            try:
+                self.combined = re.compile('|'.join('(?:{})'.format(p) for _, p in patterns),
+                                           re.IGNORECASE | re.UNICODE)
+            except re.error:
+                pass
+
+    @staticmethod
+    def from_yml(path):
+        config = IntentState.load_yml(path) or {}
+        return LocalModel(config.get('intents') or {})
+
+    def match(self, text):
+        '''Returns the best matching intent of a text
+
+        An example equal to the text scores 1.0, a pattern found in it 0.9, and
+        an example found in it the ratio of its length to the text.
+
+        :return: a tuple of an intent id, a confidence and parameters, or None'''
+        _text = normalize(text)
+        if not _text:
+            return None
+        intent_id = self.examples.get(_text)
+        if intent_id is not None:
+            return intent_id, 1.0, {}
+        best = self._match_pattern(text)
+        for start, end, intent_id in self.index.search(_text):
+            if not self._is_word(_text, start, end):
+                continue
+            confidence = (end - start) / len(_text)
+            if best is None or confidence > best[1]:
+                best = (intent_id, confidence, {})
+        return best
+
+    def _match_pattern(self, text):
+        '''Returns a match of the first pattern matching at the earliest position
+
+        The combined pattern finds the position in one pass. Then the pattern
+        which matched there is looked up. Patterns which cannot be combined,
+        like ones sharing group names or referring to groups by number, are
+        searched one by one.'''
+        located = None
+        if self.combined is not None:
+            found = self.combined.search(text)
+            if found is None:
+                return None
+            located = next(((i, m) for i, m in ((i, p.match(text, found.start()))
+                                                for i, p in enumerate(self.patterns))
+                            if m is not None), None)
+        if located is None:
+            found = [(m.start(), i, m) for i, m in ((i, p.search(text)) for i, p in enumerate(self.patterns))
+                     if m is not None]
+            if not found:
+                return None
+            _, index, match = min(found, key=lambda f: f[:2])
+        else:
+            index, match = located
+        parameters = dict((k, v) for k, v in match.groupdict().items() if v is not None)
+        return self.pattern_intents[index], self.pattern_confidence, parameters
+
+    @staticmethod
+    def _is_word(text, start, end):
+        return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+local_model_cache = FileCache(LocalModel.from_yml)
+
+
+class LocalNluClient(NluClient):
+    '''An NLU client matching intents in ``bothub.yml`` without a network
+
+    The file is compiled once and compiled again when it changes.'''
+    def __init__(self, path=None, fallback=None, threshold=0.5, model=None):
+        '''Initialize a client
+
+        :param path: a bothub.yml path. ``./bothub.yml`` is used if omitted
+        :type path: str
+        :param fallback: an NluClient to ask when no intent matches well enough
+        :type fallback: NluClient
+        :param threshold: a minimum confidence of a match
+        :type threshold: float
+        :param model: a LocalModel to use instead of the file
+        :type model: LocalModel'''
+        self.path = path or os.path.join(os.path.realpath('.'), 'bothub.yml')
+        self.fallback = fallback
+        self.threshold = threshold
+        self._model = model
+
+    @property
+    def model(self):
+        if self._model is not None:
+            return self._model
+        return local_model_cache.get(self.path, default=LocalModel({}))
+
+    def ask(self, event=None, message=None, session_id=None, lang=None):
+        '''Match a message to an intent
+
+        use ``ask(event=event)``
+        form either ``ask(message='a text', session_id=<session_id>)``
+
+        :return: an NluResponse object. its action has no intent if nothing matched'''
+        text = event.get('content') if event else message
+        result = self.model.match(text or '')
+        if result is not None and result[1] >= self.threshold:
+            intent_id, confidence, parameters = result
+            raw = {'source': 'local', 'intent': intent_id, 'confidence': confidence,
+                   'parameters': parameters}
+            return NluResponse(raw, None, NluAction(intent_id, parameters, action_incomplete=False))
+        if self.fallback is not None:
+            kwargs = {} if lang is None else {'lang': lang}
+            return self.fallback.ask(event=event, message=message, session_id=session_id, **kwargs)
+        raw = {'source': 'local', 'intent': None, 'confidence': result[1] if result else 0.0,
+               'parameters': {}}
+        return NluResponse(raw, None, NluAction(None, {}, action_incomplete=True))
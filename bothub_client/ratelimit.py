@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket(object):
+    '''A token bucket which lets callers reserve tokens ahead of time
+
+    Tokens may go negative. A caller which takes a token from an empty bucket
+    is told how long to wait, so callers queue up in the order they arrive.'''
+    def __init__(self, rate, burst=None, now=None):
+        '''Initialize a bucket
+
+        :param rate: tokens added per second
+        :type rate: float
+        :param burst: a maximum number of tokens. ``rate`` is used if omitted
+        :type burst: float'''
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.tokens = self.burst
+        self.updated = time.time() if now is None else now
+
+    def reserve(self, now):
+        '''Take a token and return seconds to wait until it is available'''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter(object):
+    '''Smooth outbound messages per channel type and per receiver
+
+    Callers over the limit are delayed rather than rejected. An object can be
+    shared by threads.
+
+    Limits are read from channels in the context like::
+
+        {'channel': {'channels': [{'type': 'telegram',
+                                   'rate_limit': {'rate': 30, 'burst': 30,
+                                                  'receiver_rate': 1, 'receiver_burst': 3}}]}}'''
+    def __init__(self, limits, max_receivers=10000, clock=time.time, sleep=time.sleep):
+        '''Initialize a rate limiter
+
+        :param limits: a dict of channel type to a dict of ``rate``, ``burst``,
+                       ``receiver_rate`` and ``receiver_burst``. rates are per second
+        :type limits: dict
+        :param max_receivers: a number of receiver buckets to keep. the least recently used one is dropped
+        :type max_receivers: int'''
+        self.limits = limits
+        self.max_receivers = max_receivers
+        self.clock = clock
+        self.sleep = sleep
+        self.channel_buckets = {}
+        self.receiver_buckets = OrderedDict()
+        self.waiting = {}
+        self.delayed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_context(context):
+        '''Returns a RateLimiter for limits in the context, or None if there are no limits
+
+        The limiter is shared in the process by contexts with the same channel
+        endpoint and limits, so limits apply across events.'''
+        channel_context = (context or {}).get('channel', {})
+        limits = dict((channel['type'], channel['rate_limit'])
+                      for channel in channel_context.get('channels', []) if channel.get('rate_limit'))
+        return get_rate_limiter(channel_context.get('endpoint'), limits) if limits else None
+
+    @property
+    def queue_depth(self):
+        '''A number of callers waiting for all channels'''
+        with self._lock:
+            return sum(self.waiting.values())
+
+    def queue_depths(self):
+        '''Returns a dict of channel type to a number of waiting callers'''
+        with self._lock:
+            return dict((k, v) for k, v in self.waiting.items() if v)
+
+    def acquire(self, channel_type, receiver=None):
+        '''Wait until a message to the receiver may be sent
+
+        :param channel_type: a channel type like 'telegram'
+        :type channel_type: str
+        :param receiver: a receiver chat id
+        :return: seconds waited
+        :rtype: float'''
+        wait = self.reserve(channel_type, receiver)
+        if wait > 0:
+            self.wait(channel_type, wait)
+        return wait
+
+    def reserve(self, channel_type, receiver=None):
+        '''Take tokens for a message to the receiver without waiting
+
+        A caller must wait the returned seconds, like with ``wait()``, before
+        sending the message.
+
+        :return: seconds to wait
+        :rtype: float'''
+        limit = self.limits.get(channel_type)
+        if limit is None:
+            return 0
+        with self._lock:
+            now = self.clock()
+            wait = 0
+            if limit.get('rate'):
+                bucket = self.channel_buckets.get(channel_type)
+                if bucket is None:
+                    bucket = self.channel_buckets[channel_type] = TokenBucket(limit['rate'], limit.get('burst'),
+                                                                              now=now)
+                wait = bucket.reserve(now)
+            if receiver is not None and limit.get('receiver_rate'):
+                bucket = self._receiver_bucket((channel_type, receiver), limit['receiver_rate'],
+                                               limit.get('receiver_burst'), now)
+                wait = max(wait, bucket.reserve(now))
+            if wait > 0:
+                self.delayed += 1
+        return wait
+
+    def wait(self, channel_type, seconds):
+        '''Sleep for a reservation, counted in the queue depth of the channel type'''
+        with self._lock:
+            self.waiting[channel_type] = self.waiting.get(channel_type, 0) + 1
+        try:
+            self.sleep(seconds)
+        finally:
+            with self._lock:
+                self.waiting[channel_type] -= 1
+
+    def _receiver_bucket(self, key, rate, burst, now):
+        # receiver buckets are kept in the order of use to drop the least recently used one
+        bucket = self.receiver_buckets.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst, now=now)
+            while len(self.receiver_buckets) >= self.max_receivers:
+                self.receiver_buckets.popitem(last=False)
+        self.receiver_buckets[key] = bucket
+        return bucket
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint, limits):
+    '''Returns a rate limiter shared in the process for a channel endpoint and limits
+
+    :param endpoint: a channel endpoint
+    :type endpoint: str
+    :param limits: a dict of channel type to a dict of limits, like ``RateLimiter``
+    :type limits: dict
+    :return: a RateLimiter object'''
+    key = (endpoint, tuple(sorted((channel_type, tuple(sorted(limit.items())))
+                                  for channel_type, limit in limits.items())))
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = RateLimiter(limits)
+        return limiter
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+'''A TF-IDF intent classifier running on CPU without a network
+
+This module requires the ``numpy`` package. Intents are trained from the
+``examples`` of intents in ``bothub.yml``, same as the ``local`` vendor::
+
+    {'nlu': {'tfidf': {'model_path': 'model/intents', 'threshold': 0.3}}}
+
+Utterances are hashed into character n-gram TF-IDF vectors, and each intent
+is the normalized centroid of its examples. A trained model is saved to
+``<model_path>.weights.npy``, ``<model_path>.idf.npy`` and
+``<model_path>.json``, and loaded memory-mapped on startup.'''
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from bothub_client.clients import NluAction
+from bothub_client.clients import NluClient
+from bothub_client.clients import NluResponse
+from bothub_client.clients import string_types
+from bothub_client.intent import IntentState
+from bothub_client.utils import chunked
+from bothub_client.utils import normalize
+
+replace = getattr(os, 'replace', os.rename)
+
+
+def hash_ngrams(texts, n_features, ngram_range=(2, 4)):
+    '''Count hashed character n-grams of texts
+
+    N-grams of all texts are hashed at once with a polynomial hash of their
+    code points, mixed by the MurmurHash3 finalizer.
+
+    :param texts: a list of texts
+    :type texts: list
+    :param n_features: a number of hash buckets
+    :type n_features: int
+    :param ngram_range: minimum and maximum n-gram lengths
+    :type ngram_range: tuple
+    :return: a tuple of arrays of text indices, hash buckets and counts, sorted by text'''
+    padded = [' {} '.format(normalize(text)) for text in texts]
+    lengths = np.array([len(p) for p in padded], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    owners = np.repeat(np.arange(len(padded)), lengths)
+    codes = np.frombuffer(''.join(padded).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    rows, features = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        count = len(codes) - n + 1
+        if count <= 0:
+            continue
+        hashes = np.full(count, n, dtype=np.uint64)
+        for k in range(n):
+            hashes = hashes * np.uint64(1000003) + codes[k:k + count]
+        hashes ^= hashes >> np.uint64(33)
+        hashes *= np.uint64(0xff51afd7ed558ccd)
+        hashes ^= hashes >> np.uint64(33)
+        _owners = owners[:count]
+        valid = np.arange(count) + n <= ends[_owners]
+        rows.append(_owners[valid])
+        features.append((hashes[valid] % np.uint64(n_features)).astype(np.int64))
+    keys, counts = np.unique(np.concatenate(rows) * n_features + np.concatenate(features), return_counts=True)
+    return keys // n_features, keys % n_features, counts
+
+
+def write_atomic(path, write):
+    '''Write a file by renaming a temporary file written by ``write(file object)``'''
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                     dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            write(fout)
+        replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+class TfidfModel(object):
+    '''Intent centroids of TF-IDF vectors'''
+    def __init__(self, intents, weights, idf, ngram_range=(2, 4)):
+        '''Initialize a model
+
+        :param intents: intent ids of columns of ``weights``
+        :type intents: list
+        :param weights: a ``(n_features, n_intents)`` matrix of intent centroids
+        :param idf: a ``(n_features,)`` vector of inverse document frequencies'''
+        self.intents = list(intents)
+        self.weights = weights
+        self.idf = idf
+        self.ngram_range = tuple(ngram_range)
+
+    @property
+    def n_features(self):
+        return self.weights.shape[0]
+
+    @staticmethod
+    def train(examples, n_features=2 ** 15, ngram_range=(2, 4)):
+        '''Train a model
+
+        :param examples: a dict of intent ids to lists of example phrases
+        :type examples: dict
+        :return: a TfidfModel object'''
+        intents = sorted(intent_id for intent_id, phrases in examples.items() if phrases)
+        phrases = [phrase for intent_id in intents for phrase in examples[intent_id]]
+        columns = np.repeat(np.arange(len(intents)), [len(examples[i]) for i in intents])
+        rows, features, counts = hash_ngrams(phrases, n_features, ngram_range)
+        df = np.bincount(features, minlength=n_features)
+        idf = (np.log((1 + len(phrases)) / (1 + df)) + 1).astype(np.float32)
+        model = TfidfModel(intents, np.zeros((n_features, len(intents)), dtype=np.float32), idf, ngram_range)
+        values = model._weigh(rows, features, counts, len(phrases))
+        np.add.at(model.weights, (features, columns[rows]), values)
+        norms = np.linalg.norm(model.weights, axis=0)
+        model.weights /= np.where(norms == 0, 1, norms)
+        return model
+
+    def _weigh(self, rows, features, counts, size):
+        '''Returns L2 normalized TF-IDF values of hashed n-gram counts'''
+        values = (1 + np.log(counts.astype(np.float32))) * self.idf[features]
+        norms = np.sqrt(np.bincount(rows, values * values, minlength=size)).astype(np.float32)
+        return values / np.where(norms == 0, 1, norms)[rows]
+
+    def classify(self, text):
+        '''Returns cosine similarities of a text to intents
+
+        :return: a ``(n_intents,)`` vector'''
+        return self.classify_many([text])[0]
+
+    def classify_many(self, texts):
+        '''Returns cosine similarities of texts to intents at once
+
+        Query vectors are packed into a dense matrix over the n-grams they
+        contain, and multiplied by the matching rows of ``weights``.
+
+        :return: a ``(len(texts), n_intents)`` matrix'''
+        rows, features, counts = hash_ngrams(texts, self.n_features, self.ngram_range)
+        values = self._weigh(rows, features, counts, len(texts))
+        used, columns = np.unique(features, return_inverse=True)
+        queries = np.zeros((len(texts), len(used)), dtype=np.float32)
+        queries[rows, columns] = values
+        return np.dot(queries, self.weights[used])
+
+    def save(self, path):
+        '''Save a model to ``<path>.weights.npy``, ``<path>.idf.npy`` and ``<path>.json``
+
+        Each file is written to a temporary file and renamed over the old one,
+        so a process loading the model never sees a partial file. Training is
+        deterministic, so processes saving a model of the same ``bothub.yml``
+        at once write the same files.'''
+        meta = {'intents': self.intents, 'ngram_range': list(self.ngram_range)}
+        write_atomic(path + '.weights.npy', lambda fout: np.save(fout, np.ascontiguousarray(self.weights)))
+        write_atomic(path + '.idf.npy', lambda fout: np.save(fout, self.idf))
+        write_atomic(path + '.json', lambda fout: fout.write(json.dumps(meta).encode('utf8')))
+
+    @staticmethod
+    def load(path, mmap_mode='r'):
+        '''Load a saved model. Arrays are memory-mapped unless ``mmap_mode`` is None'''
+        with io.open(path + '.json', encoding='utf8') as fin:
+            meta = json.loads(fin.read())
+        return TfidfModel(meta['intents'],
+                          np.load(path + '.weights.npy', mmap_mode=mmap_mode),
+                          np.load(path + '.idf.npy', mmap_mode=mmap_mode),
+                          meta['ngram_range'])
+
+
+class TfidfNluClient(NluClient):
+    '''An NLU client classifying intents with a TF-IDF model
+
+    A model is loaded from ``model_path`` if it is newer than ``bothub.yml``.
+    Otherwise it is trained on first use and saved to ``model_path`` if given.
+    The model is loaded again when ``bothub.yml`` changes.'''
+    def __init__(self, model_path=None, path=None, threshold=0.3, fallback=None, n_features=2 ** 15,
+                 ngram_range=(2, 4), model=None):
+        '''Initialize a client
+
+        :param model_path: a path prefix of saved model files
+        :type model_path: str
+        :param path: a bothub.yml path. ``./bothub.yml`` is used if omitted
+        :type path: str
+        :param threshold: a minimum confidence of a match
+        :type threshold: float
+        :param fallback: an NluClient to ask when no intent matches well enough
+        :type fallback: NluClient
+        :param model: a TfidfModel to use instead of files
+        :type model: TfidfModel'''
+        self.model_path = model_path
+        self.path = path or os.path.join(os.path.realpath('.'), 'bothub.yml')
+        self.threshold = threshold
+        self.fallback = fallback
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self._model = model
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is not None:
+            return self._model
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime, stat.st_size)
+        except OSError:
+            signature = None
+        loaded = self._loaded
+        if loaded is None or loaded[0] != signature:
+            with self._lock:
+                loaded = self._loaded
+                if loaded is None or loaded[0] != signature:
+                    loaded = self._loaded = (signature, self._load_model())
+        return loaded[1]
+
+    def _load_model(self):
+        if self.model_path and os.path.exists(self.model_path + '.json'):
+            if not os.path.exists(self.path) or \
+                    os.path.getmtime(self.model_path + '.json') > os.path.getmtime(self.path):
+                return TfidfModel.load(self.model_path)
+        config = IntentState.load_yml(self.path) if os.path.exists(self.path) else {}
+        intents = (config or {}).get('intents') or {}
+        examples = dict((intent_id, (definition or {}).get('examples', []))
+                        for intent_id, definition in intents.items())
+        model = TfidfModel.train(examples, self.n_features, self.ngram_range)
+        if self.model_path:
+            model.save(self.model_path)
+        return model
+
+    def ask(self, event=None, message=None, session_id=None, lang=None):
+        '''Classify a message to an intent
+
+        use ``ask(event=event)``
+        form either ``ask(message='a text', session_id=<session_id>)``
+
+        :return: an NluResponse object. ``raw_response`` contains ``confidence``'''
+        text = (event.get('content') if event else message) or ''
+        response = self._respond(self.model.classify(text))
+        if response is None:
+            kwargs = {} if lang is None else {'lang': lang}
+            return self.fallback.ask(event=event, message=message, session_id=session_id, **kwargs)
+        return response
+
+    def ask_many(self, messages, session_ids, concurrency=4, lang=None, batch_size=256):
+        '''Classify many messages in batches
+
+        Messages are classified ``batch_size`` at a time with one matrix
+        operation. Messages which no intent matches well enough are asked to
+        the fallback with its ``ask_many()``, up to ``concurrency`` at once.
+
+        :return: a generator of NluResponse objects'''
+        if isinstance(session_ids, string_types):
+            session_ids = itertools.repeat(session_ids)
+        sessions = iter(session_ids)
+        for batch in chunked(messages, batch_size):
+            batch_sessions = list(itertools.islice(sessions, len(batch)))
+            if len(batch_sessions) < len(batch):
+                raise ValueError('fewer session ids than messages')
+            responses = [self._respond(scores) for scores in self.model.classify_many(batch)]
+            misses = [index for index, response in enumerate(responses) if response is None]
+            if misses:
+                answers = self.fallback.ask_many([batch[i] for i in misses], [batch_sessions[i] for i in misses],
+                                                 concurrency, lang)
+                for index, response in zip(misses, answers):
+                    responses[index] = response
+            for response in responses:
+                yield response
+
+    def _respond(self, scores):
+        '''Returns an NluResponse of scores, or None if the fallback should be asked'''
+        intents = self.model.intents
+        best = int(np.argmax(scores)) if len(intents) else None
+        confidence = float(scores[best]) if best is not None else 0.0
+        intent_id = intents[best] if best is not None and confidence >= self.threshold else None
+        if intent_id is None and self.fallback is not None:
+            return None
+        top = sorted(zip(intents, (float(s) for s in scores)), key=lambda item: -item[1])[:3]
+        raw = {'source': 'tfidf', 'intent': intent_id, 'confidence': confidence, 'scores': dict(top)}
+        return NluResponse(raw, None, NluAction(intent_id, {}, action_incomplete=intent_id is None))
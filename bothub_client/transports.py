@@ -2,30 +2,419 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+import atexit
+import os
+import random
+import threading
+import time
+import weakref
+
 import requests
+import requests.adapters
 import zmq
 
+from bothub_client import codec
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+_zmq_context = None
+_zmq_context_pid = None
+_zmq_lock = threading.Lock()
+
+
+def get_zmq_context():
+    '''Returns a ZeroMQ context shared in the process
+
+    A new context is created in a forked child process.'''
+    global _zmq_context, _zmq_context_pid
+    with _zmq_lock:
+        if _zmq_context is None or _zmq_context.closed or _zmq_context_pid != os.getpid():
+            _zmq_context = zmq.Context()
+            _zmq_context_pid = os.getpid()
+        return _zmq_context
+
+
+class TransportError(Exception):
+    '''Raised when a service failed to respond after retries'''
+
+
+class CircuitOpenError(TransportError):
+    '''Raised without sending a request while a circuit is open'''
+
+
+class CircuitBreaker(object):
+    '''Fail fast while an endpoint keeps failing
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    requests are rejected for ``reset_timeout`` seconds. Then one trial request
+    is let through; the circuit closes if it succeeds and opens again if not.'''
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        '''Returns True if a request may be sent now'''
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.trial = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url, failure_threshold=5, reset_timeout=30):
+    '''Returns a circuit breaker shared in the process for the URL's host and options
+
+    :param url: a URL of an endpoint
+    :type url: str
+    :param failure_threshold: a number of consecutive failures which opens the circuit
+    :type failure_threshold: int
+    :param reset_timeout: seconds to reject requests before a trial request
+    :type reset_timeout: float
+    :return: a CircuitBreaker object'''
+    parsed = urlparse(url or '')
+    key = (parsed.scheme, parsed.netloc or parsed.path, failure_threshold, reset_timeout)
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(key)
+        if breaker is None:
+            breaker = _circuit_breakers[key] = CircuitBreaker(failure_threshold, reset_timeout)
+        return breaker
+
+
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(url, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+    '''Returns a session shared in the process for the URL's host and pool options
+
+    Sessions are thread-safe for sending requests, so transports to a host
+    share one connection pool instead of opening their own.
+
+    :param url: a URL of an endpoint
+    :type url: str
+    :param pool_connections: a number of hosts to keep pools for
+    :type pool_connections: int
+    :param pool_maxsize: a maximum number of connections kept per host
+    :type pool_maxsize: int
+    :param pool_block: wait for a free connection instead of opening a throwaway one
+    :type pool_block: bool
+    :param keep_alive: reuse connections between requests
+    :type keep_alive: bool
+    :return: a requests.Session object'''
+    parsed = urlparse(url or '')
+    key = (parsed.scheme, parsed.netloc or parsed.path, pool_connections, pool_maxsize,
+           pool_block, keep_alive)
+    with _http_sessions_lock:
+        session = _http_sessions.get(key)
+        if session is None:
+            session = _http_sessions[key] = create_http_session(pool_connections, pool_maxsize,
+                                                                pool_block, keep_alive)
+        return session
+
+
+def create_http_session(pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+    '''Returns a new session with the pool options'''
+    session = requests.Session()
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                            pool_maxsize=pool_maxsize,
+                                                            pool_block=pool_block))
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def close_http_sessions():
+    '''Close sessions shared by ``get_http_session()``
+
+    This is registered to run at interpreter exit. Sessions asked for later
+    are created again.'''
+    with _http_sessions_lock:
+        sessions = list(_http_sessions.values())
+        _http_sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_http_sessions)
+
 
 class HttpTransport(object):
-    def __init__(self, base_url=''):
-        self.session = requests.Session()
+    '''A HTTP transport with timeouts, retries and an optional circuit breaker
+
+    Idempotent requests (GET, PUT, DELETE) are retried on connection errors,
+    timeouts and 502, 503 and 504 responses with exponential backoff and full
+    jitter. POST and PATCH are sent once. A 5xx response which is left after
+    retries raises ``TransportError``; 4xx responses are returned as is.'''
+    DEFAULT_TIMEOUT = (3.05, 30)
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    RETRY_STATUSES = frozenset([502, 503, 504])
+
+    def __init__(self, base_url='', timeout=DEFAULT_TIMEOUT, max_retries=2, backoff_factor=0.1,
+                 backoff_max=2, circuit_breaker=None, sleep=time.sleep, session=None):
+        '''Initialize a transport
+
+        :param base_url: a URL prepended to request paths
+        :type base_url: str
+        :param timeout: seconds to wait, or a tuple of connect and read timeouts
+        :type timeout: float or tuple
+        :param max_retries: a number of retries of an idempotent request
+        :type max_retries: int
+        :param backoff_factor: seconds to wait before the first retry at most
+        :type backoff_factor: float
+        :param backoff_max: a maximum of seconds to wait between retries
+        :type backoff_max: float
+        :param circuit_breaker: a CircuitBreaker object. no breaker is used if omitted
+        :type circuit_breaker: CircuitBreaker
+        :param session: a requests.Session object to share. the transport owns a new one if omitted
+        :type session: requests.Session'''
+        self.owns_session = session is None
+        self.session = session or requests.Session()
         self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.circuit_breaker = circuit_breaker
+        self.sleep = sleep
+
+    @staticmethod
+    def from_config(config):
+        '''Returns a transport for a ``storage`` or ``channel`` block of a context
+
+        Options are read like::
+
+            {'endpoint': 'https://storage', 'timeout': [3.05, 30], 'max_retries': 2,
+             'backoff_factor': 0.1, 'circuit_breaker': {'failure_threshold': 5, 'reset_timeout': 30},
+             'pool': {'pool_connections': 10, 'pool_maxsize': 10, 'pool_block': False,
+                      'keep_alive': True}}
+
+        A circuit breaker and a session are shared by transports of a host. Set
+        ``circuit_breaker`` to ``False`` to disable it.'''
+        config = config or {}
+        endpoint = config.get('endpoint')
+        timeout = config.get('timeout', HttpTransport.DEFAULT_TIMEOUT)
+        if isinstance(timeout, list):
+            timeout = tuple(timeout)
+        breaker_config = config.get('circuit_breaker', {})
+        breaker = None
+        if breaker_config is not False:
+            breaker = get_circuit_breaker(endpoint, **(breaker_config or {}))
+        return HttpTransport(endpoint, timeout=timeout,
+                             max_retries=config.get('max_retries', 2),
+                             backoff_factor=config.get('backoff_factor', 0.1),
+                             circuit_breaker=breaker,
+                             session=get_http_session(endpoint, **config.get('pool', {})))
 
     def get(self, path):
-        return self.session.get('{}{}'.format(self.base_url, path)).json()
+        return codec.loads(self.request('GET', path).content)
 
     def post(self, path, data=None):
-        return self.session.post('{}{}'.format(self.base_url, path), json=data)
+        return self._send_json('POST', path, data)
+
+    def post_raw(self, path, body, content_type='application/json'):
+        return self.request('POST', path, data=body, headers={'Content-Type': content_type})
 
     def put(self, path, data=None):
-        return self.session.put('{}{}'.format(self.base_url, path), json=data)
+        return self._send_json('PUT', path, data)
+
+    def patch(self, path, data=None):
+        return self._send_json('PATCH', path, data)
+
+    def _send_json(self, method, path, data):
+        if data is None:
+            return self.request(method, path)
+        return self.request(method, path, data=codec.dumps(data),
+                            headers={'Content-Type': 'application/json'})
+
+    def request(self, method, path, **kwargs):
+        '''Send a request with retries
+
+        :return: a requests.Response object'''
+        url = '{}{}'.format(self.base_url, path)
+        attempts = 1 + (self.max_retries if method in self.IDEMPOTENT_METHODS else 0)
+        for attempt in range(attempts):
+            if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+                raise CircuitOpenError('circuit is open: {} {}'.format(method, url))
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = TransportError('{} {} failed: {}'.format(method, url, e))
+                retryable = True
+            except Exception:
+                # a failed trial must not leave the circuit half-open for good
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record_failure()
+                raise
+            else:
+                if response.status_code < 500:
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record_success()
+                    return response
+                error = TransportError('{} {} returned {}'.format(method, url, response.status_code))
+                retryable = response.status_code in self.RETRY_STATUSES
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_failure()
+            if not retryable or attempt + 1 == attempts:
+                break
+            self.sleep(random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt)))
+        raise error
+
+    def close(self):
+        '''Close the session unless it is shared'''
+        if self.owns_session:
+            self.session.close()
+
+
+class _ThreadSockets(object):
+    '''Sockets of a thread by address'''
+    def __init__(self):
+        self.by_address = {}
+
+
+class ZmqSocketPool(object):
+    '''A pool of connected sockets keyed by endpoint address
+
+    ZeroMQ sockets are not thread-safe, so each thread gets its own socket
+    for an address. Sockets of a thread are closed when the thread exits, and
+    the others when the pool is closed.'''
+    def __init__(self, context=None, socket_type=zmq.PUSH, linger=1000):
+        '''Initialize a pool
+
+        :param linger: milliseconds to wait for pending messages of sockets
+                       closed when their thread exits
+        :type linger: int'''
+        self._context = context
+        self.socket_type = socket_type
+        self.linger = linger
+        self._local = threading.local()
+        self._sockets = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def context(self):
+        return self._context or get_zmq_context()
+
+    @property
+    def size(self):
+        '''A number of open sockets in the pool'''
+        with self._lock:
+            return sum(len(sockets) for sockets in self._sockets.values())
+
+    def get(self, address):
+        '''Returns a socket connected to the address for the current thread'''
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        sockets = getattr(self._local, 'sockets', None)
+        if sockets is None:
+            sockets = self._local.sockets = _ThreadSockets()
+            with self._lock:
+                # thread-local values are released when their thread exits
+                self._sockets[weakref.ref(sockets, self._release)] = sockets.by_address
+        socket = sockets.by_address.get(address)
+        if socket is None:
+            socket = self.context.socket(self.socket_type)
+            socket.connect(address)
+            with self._lock:
+                sockets.by_address[address] = socket
+        return socket
+
+    def _release(self, ref):
+        with self._lock:
+            sockets = self._sockets.pop(ref, {})
+        for socket in sockets.values():
+            socket.close(linger=self.linger)
+
+    def close(self, linger=None):
+        '''Close all sockets the pool created
+
+        :param linger: milliseconds to wait for pending messages to be sent
+        :type linger: int'''
+        with self._lock:
+            sockets, self._sockets = self._sockets, {}
+            local, self._local = self._local, threading.local()
+        del local
+        for by_address in sockets.values():
+            for socket in by_address.values():
+                socket.close(linger=linger)
+
+    def _reset_after_fork(self):
+        # sockets inherited from the parent process must not be used or closed
+        self._local = threading.local()
+        self._sockets = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+
+socket_pool = ZmqSocketPool()
+
+
+def shutdown_zmq(linger=1000):
+    '''Close pooled sockets and terminate the shared ZeroMQ context
+
+    This is registered to run at interpreter exit.
+
+    :param linger: milliseconds to wait for pending messages to be sent
+    :type linger: int'''
+    global _zmq_context
+    if socket_pool._pid == os.getpid():
+        socket_pool.close(linger=linger)
+    with _zmq_lock:
+        if _zmq_context is not None and _zmq_context_pid == os.getpid():
+            _zmq_context.term()
+        _zmq_context = None
+
+
+atexit.register(shutdown_zmq)
 
 
 class ZmqTransport(object):
+    '''A ZeroMQ PUSH transport
+
+    Without an explicit context, sockets come from the process-wide pool and
+    are shared by transports which point to the same address. ``close()`` then
+    leaves the pooled socket open; use ``shutdown_zmq()`` to release it.'''
     def __init__(self, address, context=None):
-        self.context = context or zmq.Context()
-        self.socket = self.context.socket(zmq.PUSH)
-        self.socket.connect(address)
+        self.address = address
+        self.owns_pool = context is not None
+        self.pool = ZmqSocketPool(context) if self.owns_pool else socket_pool
+        self.pool.get(address)
+
+    @property
+    def socket(self):
+        return self.pool.get(self.address)
 
     def send_json(self, data):
         return self.socket.send_json(data)
@@ -34,4 +423,5 @@ class ZmqTransport(object):
         return self.socket.send_multipart(data)
 
     def close(self):
-        self.socket.close()
+        if self.owns_pool:
+            self.pool.close()
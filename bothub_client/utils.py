@@ -2,10 +2,13 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
-import ast
-import inspect
+import itertools
+import os
 import sys
+import threading
+import time
 import traceback
+from collections import OrderedDict
 
 
 def traceback_to_string(exc, tb=None):
@@ -15,23 +18,105 @@ def traceback_to_string(exc, tb=None):
     return ''.join(l) + '\\n  {} {}'.format(exc.__class__, exc)
 
 
-def get_decorators(cls):
-    decorators = {}
+def chunked(iterable, size):
+    '''Yield lists of up to ``size`` items from an iterable'''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
-    def visit_FunctionDef(node):
-        decorators[node.name] = []
-        for n in node.decorator_list:
-            name = ''
-            if isinstance(n, ast.Call):
-                name = n.func.attr if isinstance(n.func, ast.Attribute) else n.func.id
-            else:
-                name = n.attr if isinstance(n, ast.Attribute) else n.id
 
-            args = [a.s for a in n.args] if hasattr(n, 'args') else []
-            decorators[node.name].append((name, args))
+def normalize(text):
+    '''Returns a lower-cased text with runs of whitespace collapsed'''
+    return ' '.join(text.lower().split())
 
-    node_iter = ast.NodeVisitor()
-    node_iter.visit_FunctionDef = visit_FunctionDef
-    _cls = cls if inspect.isclass(cls) else cls.__class__
-    node_iter.visit(ast.parse(inspect.getsource(_cls)))
-    return decorators
+
+class FileCache(object):
+    '''Cache values loaded from files
+
+    A cached value is reloaded when the file's mtime or size changes.'''
+    def __init__(self, loader):
+        '''Initialize a cache
+
+        :param loader: a function which takes a file path and returns a value to cache
+        :type loader: callable'''
+        self.loader = loader
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, default=None):
+        '''Returns a cached value of the file, loading it if needed
+
+        :param path: a file path
+        :type path: str
+        :param default: a value to return if the file does not exist
+        :return: a value the loader returned'''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return default
+        signature = (stat.st_mtime, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        value = self.loader(path)
+        with self._lock:
+            self._entries[path] = (signature, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LRUCache(object):
+    '''A thread-safe LRU cache whose entries expire
+
+    The least recently used entry is dropped when ``maxsize`` is exceeded.
+    ``hits`` and ``misses`` count lookups.'''
+    def __init__(self, maxsize=1024, ttl=None, clock=time.time):
+        '''Initialize a cache
+
+        :param maxsize: a maximum number of entries
+        :type maxsize: int
+        :param ttl: seconds an entry lives. entries never expire if omitted
+        :type ttl: float'''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        '''Returns a cached value, or ``default`` if it is missing or expired'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or (entry[0] is not None and entry[0] <= self.clock()):
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        '''Returns a dict of ``hits``, ``misses`` and ``size``'''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
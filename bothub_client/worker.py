@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+'''A long-running worker which consumes events from a ZeroMQ PULL socket
+
+Each inbound message ends with a JSON frame like ``{"event": {...}, "context": {...}}``.
+``context`` is optional and defaults to the context the worker started with.
+It may point at other channel and storage endpoints than the worker context.
+An optional frame before it is a routing key used instead of the event's
+conversation to pick a worker process.
+
+    $ bothub-worker bot:Bot --bind tcp://*:5555 --context context.json --threads 8
+    $ bothub-worker bot:Bot --bind tcp://*:5555 --processes 4'''
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import zmq
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from bothub_client import codec
+from bothub_client.clients import BotRuntime
+from bothub_client.clients import conversation_key
+from bothub_client.intent import IntentState
+from bothub_client.transports import get_zmq_context
+
+logger = logging.getLogger('bothub.worker')
+
+
+def load_bot_class(spec):
+    '''Import a bot class from a ``module:ClassName`` spec
+
+    :param spec: a bot class spec
+    :type spec: str
+    :return: a Bot class'''
+    module_name, _, class_name = spec.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name or 'Bot')
+
+
+def conversation_slot(event, size):
+    '''Returns a stable slot number in ``range(size)`` for the event's conversation
+
+    :return: a slot number, or None if the event has no conversation'''
+    key = conversation_key(event)
+    if key is None:
+        return None
+    return zlib.crc32('{}:{}'.format(*key).encode('utf8')) % size
+
+
+class Worker(object):
+    '''Receive events from a PULL socket and handle them with a BotRuntime
+
+    Events are handed to a fixed number of threads. Events of a conversation
+    always go to the same thread, so they are handled in arrival order.'''
+    poll_timeout = 100
+
+    def __init__(self, address, context, bot_class, threads=4, queue_size=1000, zmq_context=None):
+        '''Initialize a worker
+
+        :param address: a ZeroMQ address to bind
+        :type address: str
+        :param context: a context Bot runs
+        :type context: dict
+        :param bot_class: a Bot class user wrote
+        :type bot_class: bothub_client.bot.BaseBot
+        :param threads: a number of threads which handle events
+        :type threads: int
+        :param queue_size: a maximum number of events waiting per thread
+        :type queue_size: int'''
+        self.address = address
+        self.runtime = BotRuntime(context, bot_class)
+        self.zmq_context = zmq_context
+        self.queues = [queue.Queue(queue_size) for _ in range(threads)]
+        self._next_queue = itertools.cycle(range(threads))
+        self._stopped = threading.Event()
+
+    def run(self):
+        '''Bind the socket and handle events until ``stop()`` is called'''
+        socket = (self.zmq_context or get_zmq_context()).socket(zmq.PULL)
+        socket.bind(self.address)
+        threads = [threading.Thread(target=self._work, args=(q,)) for q in self.queues]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        logger.info('worker: listening on %s with %d threads', self.address, len(threads))
+        try:
+            while not self._stopped.is_set():
+                if socket.poll(self.poll_timeout):
+                    self.dispatch(socket.recv_multipart())
+        finally:
+            for q in self.queues:
+                q.put(None)
+            for thread in threads:
+                thread.join()
+            socket.close(linger=0)
+            self.runtime.close()
+
+    def stop(self):
+        self._stopped.set()
+
+    def dispatch(self, frames):
+        '''Decode a message and queue its event to a thread'''
+        try:
+            message = codec.loads(frames[-1])
+            event = message['event']
+            slot = conversation_slot(event, len(self.queues))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning('worker: dropped a malformed message')
+            return
+        if slot is None:
+            slot = next(self._next_queue)
+        self.queues[slot].put((event, message.get('context')))
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            event, context = item
+            result = self.runtime.handle_safely(event, context)
+            if 'error' in result:
+                logger.error('worker: failed to handle an event\n%s', result['traceback'])
+
+
+class Supervisor(object):
+    '''Fork worker processes and route events to them
+
+    The supervisor binds the inbound PULL socket and forwards each message to
+    a worker process chosen by its conversation, so a user always lands on the
+    same process and its caches stay hot. ``bothub.yml`` and the bot class are
+    loaded before forking to be shared copy-on-write. Crashed workers are
+    forked again after a delay doubling from ``respawn_delay`` up to
+    ``max_respawn_delay`` seconds for each crash in a row. Messages to a
+    worker whose ``backend_hwm`` queue is full are dropped instead of
+    blocking the other workers. Requires ``os.fork()``.'''
+    poll_timeout = 100
+    respawn_delay = 0.5
+    max_respawn_delay = 30
+    backend_hwm = 10000
+
+    def __init__(self, address, context, bot_class, processes=None, threads=4, clock=time.time):
+        '''Initialize a supervisor
+
+        :param address: a ZeroMQ address to bind
+        :type address: str
+        :param context: a context Bot runs
+        :type context: dict
+        :param bot_class: a Bot class user wrote
+        :type bot_class: bothub_client.bot.BaseBot
+        :param processes: a number of worker processes. a number of CPUs if omitted
+        :type processes: int
+        :param threads: a number of threads per worker process
+        :type threads: int
+        :param clock: a function returning the current time in seconds
+        :type clock: callable'''
+        self.address = address
+        self.context = context
+        self.bot_class = bot_class
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threads = threads
+        self.socket_dir = None
+        self.worker_addresses = []
+        self.backends = []
+        self.pids = {}
+        self.clock = clock
+        self._spawned_at = {}
+        self._respawn_delays = {}
+        self._respawns = {}
+        self._next_backend = itertools.cycle(range(self.processes))
+        self._stopped = threading.Event()
+
+    def run(self):
+        '''Fork workers and route events until ``stop()`` is called'''
+        IntentState.get_intent_slots()
+        self.socket_dir = tempfile.mkdtemp(prefix='bothub-')
+        self.worker_addresses = ['ipc://{}/worker-{}.ipc'.format(self.socket_dir, i)
+                                 for i in range(self.processes)]
+        for index in range(self.processes):
+            self._spawn(index)
+
+        zmq_context = zmq.Context()
+        frontend = zmq_context.socket(zmq.PULL)
+        frontend.bind(self.address)
+        self.backends = []
+        for address in self.worker_addresses:
+            backend = zmq_context.socket(zmq.PUSH)
+            backend.setsockopt(zmq.SNDHWM, self.backend_hwm)
+            backend.connect(address)
+            self.backends.append(backend)
+        logger.info('supervisor: listening on %s with %d processes', self.address, self.processes)
+        try:
+            while not self._stopped.is_set():
+                if frontend.poll(self.poll_timeout):
+                    self.route(frontend.recv_multipart())
+                self._respawn_exited()
+        finally:
+            self._terminate()
+            for socket in [frontend] + self.backends:
+                socket.close(linger=0)
+            zmq_context.term()
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    def stop(self):
+        self._stopped.set()
+
+    def route(self, frames):
+        '''Forward a message to the worker process of its conversation'''
+        if len(frames) > 1:
+            slot = zlib.crc32(frames[0]) % len(self.backends)
+        else:
+            try:
+                event = codec.loads(frames[-1])['event']
+                slot = conversation_slot(event, len(self.backends))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.warning('supervisor: dropped a malformed message')
+                return
+        if slot is None:
+            slot = next(self._next_backend)
+        try:
+            self.backends[slot].send_multipart(frames, zmq.NOBLOCK)
+        except zmq.Again:
+            logger.warning('supervisor: worker %d is not keeping up, dropped a message', slot)
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = index
+            self._spawned_at[index] = self.clock()
+            return
+        exit_code = 0
+        try:
+            worker = Worker(self.worker_addresses[index], self.context, self.bot_class,
+                            threads=self.threads)
+            signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            worker.run()
+        except Exception:
+            logger.exception('supervisor: worker %d failed', index)
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _respawn_exited(self):
+        now = self.clock()
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                break
+            index = self.pids.pop(pid, None)
+            if index is None or self._stopped.is_set():
+                continue
+            delay = self._respawn_delays.get(index, 0)
+            if now - self._spawned_at.get(index, now) >= self.max_respawn_delay:
+                delay = 0
+            delay = min(delay * 2 or self.respawn_delay, self.max_respawn_delay)
+            self._respawn_delays[index] = delay
+            self._respawns[index] = now + delay
+            logger.warning('supervisor: worker %d exited with %d, restarting in %.1f seconds',
+                           index, status, delay)
+        for index, due in list(self._respawns.items()):
+            if due <= now and not self._stopped.is_set():
+                del self._respawns[index]
+                self._spawn(index)
+
+    def _terminate(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in list(self.pids):
+            os.waitpid(pid, 0)
+        self.pids = {}
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Run a bot consuming events from a ZeroMQ socket')
+    parser.add_argument('bot', nargs='?', default='bot:Bot',
+                        help='a bot class as module:ClassName (default: bot:Bot)')
+    parser.add_argument('--bind', default='tcp://*:5555', help='an address to bind the PULL socket')
+    parser.add_argument('--context', help='a JSON file which contains the bot context')
+    parser.add_argument('--threads', type=int, default=4, help='a number of threads which handle events')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='a number of worker processes to fork. 0 means a number of CPUs')
+    return parser.parse_args(args)
+
+
+def load_context(path):
+    if not path:
+        return {}
+    with open(path) as fin:
+        return json.load(fin)
+
+
+def main(args=None):
+    options = parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+    sys.path.insert(0, os.path.realpath('.'))
+    context = load_context(options.context)
+    bot_class = load_bot_class(options.bot)
+    if options.processes == 1:
+        worker = Worker(options.bind, context, bot_class, threads=options.threads)
+    else:
+        worker = Supervisor(options.bind, context, bot_class,
+                            processes=options.processes, threads=options.threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,17 @@ setup(
         'zmq',
         'pyaml',
     ],
+    entry_points={
+        'console_scripts': [
+            'bothub-worker = bothub_client.worker:main',
+        ],
+    },
+    extras_require={
+        'aio': ['aiohttp'],
+        'fast': ['orjson'],
+        'msgpack': ['msgpack'],
+        'tfidf': ['numpy'],
+    },
     setup_requires=[
         'pytest-runner',
     ],
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+import pytest
+from bothub_client.aio import AsyncBaseBot
+from bothub_client.aio import AsyncHttpTransport
+from bothub_client.aio import AsyncIntentState
+from bothub_client.aio import AsyncStorageClient
+from bothub_client.aio import AsyncZmqChannelClient
+from bothub_client.aio import AsyncZmqTransport
+from bothub_client.decorators import channel
+from bothub_client.decorators import command
+from bothub_client.decorators import intent
+from bothub_client.intent import Intent
+from bothub_client.intent import Slot
+from bothub_client.transports import TransportError
+
+
+class MockAsyncTransport(object):
+    def __init__(self):
+        self.recorded = []
+        self.executed = []
+        self.closed = False
+
+    def record(self, data):
+        self.recorded.append(data)
+
+    async def get(self, url):
+        self.executed.append(('get', {'url': url}))
+        return self.recorded.pop(0) if self.recorded else {}
+
+    async def post(self, url, data):
+        self.executed.append(('post', {'url': url, 'data': data}))
+        return self.recorded.pop(0) if self.recorded else {}
+
+    async def put(self, url, data):
+        self.executed.append(('put', {'url': url, 'data': data}))
+
+    async def patch(self, url, data):
+        self.executed.append(('patch', {'url': url, 'data': data}))
+
+    async def send_multipart(self, data):
+        self.executed.append(('send_multipart', data))
+
+    async def close(self):
+        self.closed = True
+
+
+class Bot(AsyncBaseBot):
+    async def handle_message_async(self, event, context):
+        data, project = await asyncio.gather(self.get_user_data(), self.get_project_data())
+        data['count'] = data.get('count', 0) + 1
+        await self.set_user_data(data)
+        await self.send_message('count: {}'.format(data['count']))
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def fixture_context():
+    return {'project_id': 1,
+            'api_key': 'mykey',
+            'channel': {'endpoint': 'tcp://localhost:1010',
+                        'channels': [{'type': 'mychannel'}]}}
+
+
+def test_async_storage_client_unit_of_work_should_coalesce_writes():
+    transport = MockAsyncTransport()
+    transport.record({'data': {'count': 1}})
+    client = AsyncStorageClient(1, 'mykey', 'http://localhost', transport=transport)
+
+    async def step():
+        client.begin()
+        data = await client.get_user_data('mychannel', 'myid')
+        data['count'] = 2
+        await client.set_user_data('mychannel', 'myid', data)
+        assert await client.get_user_data('mychannel', 'myid', key='count') == 2
+        await client.commit()
+
+    run(step())
+    assert transport.executed == [
+        ('get', {'url': '/projects/1/channels/mychannel/users/myid'}),
+        ('put', {'url': '/projects/1/channels/mychannel/users/myid',
+                 'data': {'data': {'count': 2}}})]
+
+
+def test_async_bot_should_await_storage_and_channel():
+    storage_transport = MockAsyncTransport()
+    storage_transport.record({'data': {'count': 1}})
+    channel_transport = MockAsyncTransport()
+    event = {'content': 'hi', 'channel': 'mychannel', 'sender': {'id': 'myid'}}
+    context = fixture_context()
+    bot = Bot(channel_client=AsyncZmqChannelClient.init_client(context, transport=channel_transport),
+              storage_client=AsyncStorageClient(1, 'mykey', None, transport=storage_transport,
+                                                user=('mychannel', 'myid')),
+              event=event)
+
+    run(bot.handle_message_async(event, context))
+    command, frames = channel_transport.executed.pop(0)
+    assert json.loads(frames[0].decode('utf8'))['message'] == 'count: 2'
+    assert storage_transport.executed[-1] == ('put', {'url': '/projects/1/channels/mychannel/users/myid',
+                                                      'data': {'data': {'count': 2}}})
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def read(self):
+        return self.content
+
+
+class FakeSession(object):
+    def __init__(self, content):
+        self.content = content
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return FakeResponse(self.content)
+
+
+def test_async_http_transport_should_send_json():
+    session = FakeSession(b'{"data": {"a": 1}}')
+    transport = AsyncHttpTransport('http://localhost', session=session)
+    assert run(transport.get('/path')) == {'data': {'a': 1}}
+    run(transport.put('/path', {'data': {'b': 2}}))
+    method, url, kwargs = session.requests[1]
+    assert (method, url) == ('PUT', 'http://localhost/path')
+    assert json.loads(kwargs['data'].decode('utf8')) == {'data': {'b': 2}}
+    assert kwargs['headers'] == {'Content-Type': 'application/json'}
+    session.content = b''
+    assert run(transport.post('/path')) is None
+
+
+def test_async_storage_client_should_get_and_set_many_user_data():
+    transport = MockAsyncTransport()
+    transport.record({'data': [{'a': 1}, None]})
+    transport.record({'data': [{'c': 3}]})
+    client = AsyncStorageClient(1, 'mykey', 'http://localhost', transport=transport, batch_size=2)
+    keys = [('mychannel', 'u1'), ('mychannel', 'u2'), ('mychannel', 'u3')]
+    assert run(client.get_many_user_data(keys)) == [{'a': 1}, {}, {'c': 3}]
+    run(client.set_many_user_data([('mychannel', 'u1', {'a': 2})]))
+    assert transport.executed[-1] == ('post', {'url': '/projects/1/users/_mset',
+                                               'data': {'users': [{'channel': 'mychannel', 'user_id': 'u1',
+                                                                   'data': {'a': 2}}]}})
+
+    transport.record({'data': [{'a': 1}]})
+    with pytest.raises(TransportError):
+        run(client.get_many_user_data(keys[:2]))
+
+
+class DecoratedBot(AsyncBaseBot):
+    @command('hello', 'hi')
+    async def hello(self, event, context, args):
+        await self.send_message('hello {}'.format(' '.join(args)))
+
+    @intent('credentials')
+    async def set_credentials(self, event, context, answers):
+        await self.send_message('app id: {}'.format(answers['app_id']))
+
+    @channel()
+    def default(self, event, context):
+        self.channel_client.transport.executed.append(('default', event['content']))
+
+
+def test_async_bot_should_dispatch_decorated_handlers():
+    storage_transport = MockAsyncTransport()
+    storage_transport.record({'data': {}})
+    channel_transport = MockAsyncTransport()
+    context = fixture_context()
+    storage = AsyncStorageClient(1, 'mykey', None, transport=storage_transport, user=('mychannel', 'myid'))
+    bot = DecoratedBot(channel_client=AsyncZmqChannelClient.init_client(context, transport=channel_transport),
+                       storage_client=storage, event={'channel': 'mychannel', 'sender': {'id': 'myid'}})
+    assert isinstance(bot.state, AsyncIntentState)
+    bot.state.intent_id_to_intent_definition = {
+        'credentials': Intent('credentials', None, [Slot('app_id', 'Your app ID?', None, 'string')])}
+
+    async def talk():
+        storage.begin()
+        for content in ['/intent credentials', 'abc', '/hi there', 'bye']:
+            await bot.handle_message_async({'content': content, 'channel': 'mychannel',
+                                            'sender': {'id': 'myid'}}, context)
+        await storage.commit()
+
+    run(talk())
+    sent = [json.loads(frames[0].decode('utf8'))['message'] if command == 'send_multipart' else frames
+            for command, frames in channel_transport.executed]
+    assert sent[0]['model'][0]['args']['text'] == 'Your app ID?'
+    assert sent[1:] == ['app id: abc', 'hello there', 'bye']
+    assert storage_transport.executed[-1][1]['data']['data']['_intent_id'] is None
+
+
+def test_async_bot_should_not_dispatch_synchronously():
+    with pytest.raises(NotImplementedError):
+        Bot().handle_message({'content': 'hi'}, {})
+
+
+def test_async_zmq_transport_should_share_socket_per_loop():
+    async def open_transports():
+        first = AsyncZmqTransport('tcp://127.0.0.1:5995')
+        second = AsyncZmqTransport('tcp://127.0.0.1:5995')
+        await first.close()
+        return first.socket, second.socket
+
+    first, second = run(open_transports())
+    assert first is second and not first.closed
+    other, _ = run(open_transports())
+    assert other is not first
@@ -19,6 +19,9 @@ class DummyStorageClient(object):
     def set_project_data(self, data):
         self.executed.append(('set_project_data', {'data': data}))
 
+    def patch_project_data(self, data):
+        self.executed.append(('patch_project_data', {'data': data}))
+
     def get_project_data(self, key=None):
         self.executed.append(('get_project_data', {'key': key}))
         return {}
@@ -27,6 +30,10 @@ class DummyStorageClient(object):
         self.executed.append(('set_user_data',
                               {'data': data, 'channel': channel, 'user_id': user_id}))
 
+    def patch_user_data(self, channel, user_id, data):
+        self.executed.append(('patch_user_data',
+                              {'data': data, 'channel': channel, 'user_id': user_id}))
+
     def get_user_data(self, channel, user_id, key=None):
         self.executed.append(('get_user_data',
                               {'channel': channel, 'user_id': user_id, 'key': key}))
@@ -71,6 +78,15 @@ def test_set_user_data_should_invoke_client():
                                               {'data': {}, 'user_id': None, 'channel': None})
 
 
+def test_patch_user_data_should_invoke_client():
+    storage_client = DummyStorageClient()
+    bot = BaseBot(storage_client=storage_client, event={'channel': 'mychannel',
+                                                        'sender': {'id': 'myid'}})
+    bot.patch_user_data({'a': 1})
+    assert storage_client.executed.pop(0) == ('patch_user_data',
+                                              {'data': {'a': 1}, 'user_id': 'myid', 'channel': 'mychannel'})
+
+
 def test_get_user_data_should_invoke_client():
     storage_client = DummyStorageClient()
     bot = BaseBot(storage_client=storage_client, event={})
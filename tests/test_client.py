@@ -3,14 +3,27 @@
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
 import json
+import threading
+
+import pytest
 import requests_mock
+import zmq
 
 from six import u
 from bothub_client.bot import BaseBot
 from bothub_client.clients import handle_message
+from bothub_client.clients import BotRuntime
+from bothub_client.clients import handle_messages
 from bothub_client.clients import BaseChannelClient
+from bothub_client.clients import ChannelClient
+from bothub_client.clients import encode_json_with
+from bothub_client.clients import PayloadSession
 from bothub_client.clients import ZmqChannelClient
 from bothub_client.messages import Message
+from bothub_client.ratelimit import RateLimiter
+from bothub_client.transports import TransportError
+from bothub_client.transports import ZmqTransport
+from bothub_client.transports import socket_pool
 
 
 class Bot(BaseBot):
@@ -50,6 +63,149 @@ def test_handle_message_should_add_channel_cmd_buff():
         }
 
 
+def test_handle_message_should_share_rate_limits_across_events():
+    context = {'channel': {'endpoint': 'http://limited.test',
+                           'channels': [{'type': 'mychannel', 'rate_limit': {'rate': 10, 'burst': 1}}]}}
+    limiter = RateLimiter.from_context(context)
+    delayed = limiter.delayed
+
+    with requests_mock.mock() as m:
+        m.post('http://limited.test/messages')
+        for i in range(5):
+            handle_message({'content': str(i), 'channel': 'mychannel', 'sender': {'id': 'u'}}, context, Bot)
+        assert m.call_count == 5
+    assert limiter.delayed - delayed >= 4
+
+
+def test_bot_runtime_should_reuse_transports():
+    context = {'channel': {'endpoint': 'http://localhost'},
+               'storage': {'endpoint': 'http://localhost/storage'}}
+    runtime = BotRuntime(context, Bot)
+    channel_transport = runtime.channel_transport
+
+    with requests_mock.mock() as m:
+        m.post('http://localhost/messages')
+        for content in ('hi!', 'bye!'):
+            response = runtime.handle({'content': content,
+                                       'channel': 'mychannel',
+                                       'sender': {'id': 'abcd1234'}})
+            assert response['response'] is None
+        assert [r.json()['message'] for r in m.request_history] == ['hello, you said: hi!',
+                                                                     'hello, you said: bye!']
+    assert runtime.channel_transport is channel_transport
+    runtime.close()
+
+
+def test_bot_runtime_should_send_to_endpoints_of_event_context():
+    runtime = BotRuntime({'channel': {'endpoint': 'http://a'}}, Bot)
+    event = {'content': 'hi!', 'channel': 'mychannel', 'sender': {'id': 'abcd1234'}}
+
+    with requests_mock.mock() as m:
+        m.post('http://a/messages')
+        m.post('http://b/messages')
+        runtime.handle(event, {'channel': {'endpoint': 'http://b'}})
+        runtime.handle(event)
+        assert [r.url for r in m.request_history] == ['http://b/messages', 'http://a/messages']
+
+    result = runtime.handle_safely(event, {'channel': {'endpoint': 'tcp://127.0.0.1:5994'}})
+    assert 'error' not in result
+    assert isinstance(runtime._get_channel_transport({'channel': {'endpoint': 'tcp://127.0.0.1:5994'}})[0],
+                      ZmqTransport)
+    runtime.close()
+
+
+class StoringBot(BaseBot):
+    def handle_message(self, event, context):
+        self.send_message('first')
+        self.set_user_data({'seen': True})
+        self.send_message('second')
+
+
+class ClosableZmqTransport(DummyZmqTransport):
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('use_runtime', [False, True])
+def test_batched_replies_should_be_sent_when_commit_fails(monkeypatch, use_runtime):
+    transport = ClosableZmqTransport()
+    monkeypatch.setattr(ZmqChannelClient, 'create_transport', staticmethod(lambda context: transport))
+    context = {'channel': {'endpoint': 'tcp://127.0.0.1:5993', 'batch': True},
+               'storage': {'endpoint': 'http://storage.test', 'max_retries': 0, 'circuit_breaker': False}}
+    event = {'content': 'hi', 'channel': 'mychannel', 'sender': {'id': 'abcd1234'}}
+
+    with requests_mock.mock() as m:
+        m.put('http://storage.test/projects/None/channels/mychannel/users/abcd1234', status_code=503)
+        with pytest.raises(TransportError):
+            if use_runtime:
+                BotRuntime(context, StoringBot).handle(event)
+            else:
+                handle_message(event, context, StoringBot)
+    frames = transport.sent[0]
+    assert [json.loads(f.decode('utf8'))['message'] for f in frames[1:]] == ['first', 'second']
+
+
+class ClosingBot(BaseBot):
+    closed = []
+
+    def handle_message(self, event, context):
+        raise ValueError('boom')
+
+    def close(self):
+        self.closed.append(self.event['content'])
+        super(ClosingBot, self).close()
+
+
+def test_bot_runtime_should_close_bot_after_handling():
+    context = {'channel': {'endpoint': 'tcp://127.0.0.1:5996'}}
+    runtime = BotRuntime(context, ClosingBot)
+    assert isinstance(runtime.channel_transport, ZmqTransport)
+    for content in ('hi!', 'bye!'):
+        assert 'error' in runtime.handle_safely({'content': content, 'channel': 'mychannel'})
+    assert ClosingBot.closed == ['hi!', 'bye!']
+    runtime.close()
+
+
+class RecordingBot(BaseBot):
+    handled = []
+
+    def handle_message(self, event, context):
+        if event['content'] == 'boom':
+            raise ValueError('boom')
+        self.handled.append((event['sender']['id'], event['content']))
+        return event['content']
+
+
+def test_handle_messages_should_keep_conversation_order():
+    events = [{'content': str(i), 'channel': 'mychannel', 'sender': {'id': 'user{}'.format(i % 3)}}
+              for i in range(30)]
+    events[4]['content'] = 'boom'
+    context = {'channel': {'endpoint': 'http://localhost'}}
+
+    results = handle_messages(events, context, RecordingBot, workers=4)
+
+    assert [r.get('response') for r in results] == [e['content'] if i != 4 else None
+                                                    for i, e in enumerate(events)]
+    assert isinstance(results[4]['error'], ValueError)
+    assert 'boom' in results[4]['traceback']
+    for user_id in ('user0', 'user1', 'user2'):
+        handled = [content for _id, content in RecordingBot.handled if _id == user_id]
+        assert handled == [e['content'] for e in events
+                           if e['sender']['id'] == user_id and e['content'] != 'boom']
+
+
+def test_handle_messages_should_not_leak_pooled_sockets():
+    events = [{'content': str(i), 'channel': 'mychannel', 'sender': {'id': 'user{}'.format(i)}}
+              for i in range(8)]
+    context = {'channel': {'endpoint': 'tcp://127.0.0.1:5997'}}
+
+    handle_messages(events, context, Bot, workers=4)
+    size = socket_pool.size
+    for _ in range(5):
+        handle_messages(events, context, Bot, workers=4)
+    assert socket_pool.size == size
+
+
 def test_get_channel_obj_should_returns_channel():
     context = {'channel': {'channels': [{'type': 'mychannel'}]}}
     client = BaseChannelClient(10, 'myapikey', 'myurl', context=context)
@@ -116,3 +272,229 @@ def test_zmq_channel_client_send_message_should_invoke_transport():
                                         'project_id': 1},
                             'channel': {'type': 'mychannel'},
                             'extra': None}
+
+
+def test_zmq_channel_client_batch_should_send_one_multipart_message():
+    context = {'project_id': 1,
+               'channel': {'endpoint': 'tcp://localhost:1010',
+                           'channels': [{'type': 'mychannel'}],
+                           'batch': True},
+               'api_key': 'mykey'}
+    event = {'chat_id': '1124', 'channel': 'mychannel'}
+    transport = DummyZmqTransport()
+    client = ZmqChannelClient.init_client(context, transport=transport)
+    client.send_message('1123', 'Hello', event=event)
+    client.send_message('1123', 'World', event=event)
+    client.send_photo('1125', 'http://photo', event=event)
+    expected = [client._prepare_payload('1123', 'Hello', event=event),
+                client._prepare_payload('1123', 'World', event=event),
+                client._prepare_payload_to_photo('1125', 'http://photo', event=event)]
+    assert transport.sent == []
+
+    client.flush()
+    client.flush()
+    assert len(transport.sent) == 1
+    frames = [json.loads(f.decode('utf8')) for f in transport.sent[0]]
+    header, bodies = frames[0], frames[1:]
+    assert header.pop('batch') == 3
+    assert header['event'] == event
+    assert 'event' not in bodies[0]
+    messages = []
+    for body in bodies:
+        message = dict(header)
+        message.update(body)
+        messages.append(message)
+    assert messages == expected
+
+
+def test_zmq_channel_client_should_send_msgpack_with_content_type():
+    msgpack = pytest.importorskip('msgpack')
+    context = {'project_id': 1,
+               'channel': {'endpoint': 'tcp://localhost:1010',
+                           'channels': [{'type': 'mychannel'}],
+                           'format': 'msgpack'},
+               'api_key': 'mykey'}
+    event = {'chat_id': '1124', 'channel': 'mychannel'}
+    transport = DummyZmqTransport()
+    client = ZmqChannelClient.init_client(context, transport=transport)
+    client.send_message('1123', 'Hello', event=event)
+    content_type, frame = transport.sent[0]
+    assert content_type == b'application/msgpack'
+    assert msgpack.unpackb(frame, raw=False) == client._prepare_payload('1123', 'Hello', event=event)
+
+    result = client.broadcast('Hi', ['a', 'b'], channel='mychannel')
+    frames = transport.sent[1]
+    assert result.sent == 2
+    assert frames[0] == b'application/msgpack'
+    assert msgpack.unpackb(frames[1], raw=False)['batch'] == 2
+    assert msgpack.unpackb(frames[3], raw=False) == {'receiver': 'b'}
+
+
+def test_zmq_channel_client_json_format_should_send_content_type():
+    context = {'channel': {'endpoint': 'tcp://localhost:1010', 'channels': [], 'format': 'json'}}
+    transport = DummyZmqTransport()
+    client = ZmqChannelClient.init_client(context, transport=transport)
+    assert client.wire_format == 'json'
+    client.send_message('1123', 'Hello', event={})
+    assert transport.sent[0][0] == b'application/json'
+    assert json.loads(transport.sent[0][1].decode('utf8'))['message'] == 'Hello'
+
+
+def test_compact_payload_should_send_session_items_once():
+    context = {'project_id': 1,
+               'api_key': 'mykey',
+               'request_id': 'req1',
+               'channel': {'endpoint': 'tcp://localhost:1010',
+                           'channels': [{'type': 'mychannel', 'token': 'secret'}],
+                           'payload': 'compact'}}
+    event = {'chat_id': '1124', 'channel': 'mychannel', 'content': 'hi',
+             'sender': {'id': '1124'}, 'raw_data': {'big': 'x' * 100}}
+    transport = DummyZmqTransport()
+    client = ZmqChannelClient.init_client(context, transport=transport)
+    client.send_message(None, Message(event).set_text('Hello'), event=event)
+    client.send_message(None, 'World', event=event)
+
+    first, second = [json.loads(frames[0].decode('utf8')) for frames in transport.sent]
+    assert first['receiver'] == '1124'
+    assert first['channel'] == 'mychannel'
+    assert first['request_id'] == 'req1'
+    assert first['event'] == {'chat_id': '1124', 'channel': 'mychannel', 'sender': {'id': '1124'}}
+    assert list(first['message']) == ['model']
+    assert first['session']['context'] == {'project_id': 1, 'api_key': 'mykey', 'rabbitmq': 'localhost'}
+    assert first['session']['channels'] == [{'type': 'mychannel', 'token': 'secret'}]
+    assert second['session'] == {'id': first['session']['id']}
+    assert 'context' not in second
+
+
+class FailingZmqTransport(DummyZmqTransport):
+    def __init__(self, failures):
+        super(FailingZmqTransport, self).__init__()
+        self.failures = failures
+
+    def send_multipart(self, data):
+        if self.failures:
+            self.failures -= 1
+            raise zmq.ZMQError(zmq.EAGAIN)
+        super(FailingZmqTransport, self).send_multipart(data)
+
+
+def test_compact_payload_should_send_session_items_again_after_failed_send():
+    context = {'channel': {'endpoint': 'tcp://localhost:1010', 'channels': [{'type': 'mychannel'}],
+                           'payload': 'compact'}}
+    event = {'chat_id': '1124', 'channel': 'mychannel'}
+    transport = FailingZmqTransport(failures=1)
+    client = ZmqChannelClient.init_client(context, transport=transport)
+    with pytest.raises(zmq.ZMQError):
+        client.send_message(None, 'Hello', event=event)
+    client.send_message(None, 'Hello', event=event)
+    client.send_message(None, 'World', event=event)
+
+    first, second = [json.loads(frames[0].decode('utf8')) for frames in transport.sent]
+    assert first['session']['channels'] == [{'type': 'mychannel'}]
+    assert second['session'] == {'id': first['session']['id']}
+
+
+def test_payload_session_should_start_again_on_change_or_expiry():
+    now = [0]
+    session = PayloadSession(ttl=10, clock=lambda: now[0])
+    first = session.stamp({'a': 1})
+    assert session.stamp({'a': 1}) == {'id': first['id']}
+    changed = session.stamp({'a': 2})
+    assert changed['a'] == 2 and changed['id'] != first['id']
+    now[0] = 10
+    assert session.stamp({'a': 2})['a'] == 2
+
+
+def test_payload_session_should_be_kept_per_thread():
+    session = PayloadSession()
+    session.stamp({'a': 1})
+    other = []
+    thread = threading.Thread(target=lambda: other.append(session.stamp({'a': 1})))
+    thread.start()
+    thread.join()
+    assert other[0]['a'] == 1
+
+
+def test_encode_json_with_should_add_items():
+    assert json.loads(encode_json_with(b'{"a": 1}', receiver='me').decode('utf8')) == {'a': 1, 'receiver': 'me'}
+    assert json.loads(encode_json_with(b'{}', receiver='me').decode('utf8')) == {'receiver': 'me'}
+
+
+def test_zmq_channel_client_broadcast_should_send_chunks():
+    context = {'project_id': 1,
+               'channel': {'endpoint': 'tcp://localhost:1010',
+                           'channels': [{'type': 'mychannel'}]},
+               'api_key': 'mykey'}
+    transport = DummyZmqTransport()
+    client = ZmqChannelClient.init_client(context, transport=transport)
+    message = Message({}).set_text('Announcement')
+    result = client.broadcast(message, (str(i) for i in range(5)), channel='mychannel', chunk_size=2)
+
+    assert result.sent == 5 and result.failures == []
+    assert [len(frames) for frames in transport.sent] == [3, 3, 1]
+    header = json.loads(transport.sent[0][0].decode('utf8'))
+    assert header['batch'] == 2
+    assert header['message']['model'] == message.model
+    assert header['channel'] == {'type': 'mychannel'}
+    assert json.loads(transport.sent[0][2].decode('utf8')) == {'receiver': '1'}
+    single = json.loads(transport.sent[2][0].decode('utf8'))
+    assert 'batch' not in single
+    assert single['receiver'] == '4'
+    assert single['message']['model'] == message.model
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TimedZmqTransport(DummyZmqTransport):
+    def __init__(self, clock):
+        super(TimedZmqTransport, self).__init__()
+        self.clock = clock
+
+    def send_multipart(self, data):
+        self.sent.append((self.clock(), len(data)))
+
+
+def test_zmq_channel_client_should_throttle_when_messages_are_sent():
+    clock = FakeClock()
+    limiter = RateLimiter({'mychannel': {'rate': 1, 'burst': 2}}, clock=clock, sleep=clock.sleep)
+    context = {'channel': {'endpoint': 'tcp://localhost:1010', 'channels': [{'type': 'mychannel'}],
+                           'batch': True}}
+    transport = TimedZmqTransport(clock)
+    client = ZmqChannelClient.init_client(context, transport=transport, rate_limiter=limiter)
+    for i in range(4):
+        client.send_message(str(i), 'hi', channel='mychannel', event={})
+    assert transport.sent == [] and clock.now == 1000
+
+    client.flush()
+    assert transport.sent == [(1000, 3), (1001, 1), (1002, 1)]
+
+    result = client.broadcast('hello', ['a', 'b'], channel='mychannel')
+    assert result.sent == 2
+    assert transport.sent[3:] == [(1003, 1), (1004, 1)]
+
+
+def test_channel_client_broadcast_should_report_failures():
+    context = {'channel': {'endpoint': 'http://localhost', 'channels': [{'type': 'mychannel'}]}}
+    client = ChannelClient.init_client(context)
+
+    def reply(request, response):
+        response.status_code = 500 if request.json()['receiver'] == 'bad' else 200
+        return ''
+
+    with requests_mock.mock() as m:
+        m.post('http://localhost/messages', text=reply)
+        result = client.broadcast('hello', ['a', 'bad', 'b'], channel='mychannel', chunk_size=2)
+        receivers = sorted(r.json()['receiver'] for r in m.request_history)
+
+    assert receivers == ['a', 'b', 'bad']
+    assert result.sent == 2
+    assert [recipient for recipient, _ in result.failures] == ['bad']
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import json
+
+import pytest
+from bothub_client import codec
+
+
+@pytest.fixture(params=codec.BACKENDS)
+def backend(request):
+    selected = codec.name
+    try:
+        codec.use(request.param)
+    except ImportError:
+        pytest.skip('{} is not installed'.format(request.param))
+    yield request.param
+    codec.use(selected)
+
+
+def test_dumps_should_return_utf8_bytes(backend):
+    data = {'message': '안녕', 'model': [{'type': 'button', 'payload': 1}], 'extra': None}
+    encoded = codec.dumps(data)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded.decode('utf8')) == data
+
+
+def test_loads_should_accept_bytes_and_text(backend):
+    assert codec.loads(b'{"a": [1, 2]}') == {'a': [1, 2]}
+    assert codec.loads('{"a": "\\uc548"}') == {'a': '안'}
+
+
+def test_dumps_should_convert_non_string_keys(backend):
+    assert codec.loads(codec.dumps({1: 'a'})) == {'1': 'a'}
+
+
+def test_use_should_prefer_fast_backend():
+    selected = codec.name
+    try:
+        assert codec.use() == selected
+        assert codec.use('json') == 'json'
+    finally:
+        codec.use(selected)
+
+
+def test_msgpack_encoder_should_round_trip():
+    pytest.importorskip('msgpack')
+    data = {'message': {'model': [{'type': 'text', 'text': '안녕'}]}, 'receiver': '1'}
+    encoded = codec.get_encoder('msgpack')(data)
+    assert codec.get_decoder('msgpack')(encoded) == data
+    assert len(encoded) < len(codec.get_encoder('json')(data))
+
+
+def test_get_encoder_should_reject_unknown_format():
+    with pytest.raises(ValueError):
+        codec.get_encoder('xml')
+
+
+def test_dumps_should_encode_integers_beyond_64_bits(backend):
+    data = {'id': 2 ** 70, 'negative': -2 ** 64, 1: 'a'}
+    assert json.loads(codec.dumps(data).decode('utf8')) == {'id': 2 ** 70, 'negative': -2 ** 64, '1': 'a'}
@@ -2,7 +2,12 @@
 
 import json
 from collections import namedtuple
+
+import pytest
 from bothub_client.dispatcher import DefaultDispatcher
+from bothub_client.dispatcher import PrefixTrie
+from bothub_client.dispatcher import get_command_routes
+from bothub_client.dispatcher import get_handler_table
 from bothub_client.intent import Intent
 from bothub_client.intent import Slot
 from bothub_client.intent import IntentState
@@ -188,3 +193,141 @@ def test_simple_message_old_style_dispatch_should_call_execute_command_with_args
     executed = bot.executed.pop(0) # type: Executed
     assert executed.command == 'hello'
     assert executed.args == (event, None, 'arg1')
+
+
+class MockInheritedBot(MockNewStyleBot):
+    @command('hello')
+    def greet(self, event, context, args):
+        self.executed.append(Executed('greet', (event, context)))
+
+    @channel('fakechannel', 'otherchannel')
+    def on_fake(self, event, context):
+        self.executed.append(Executed('on_fake', (event, context)))
+
+    def set_credentials(self, event, context, answers):
+        pass
+
+
+def test_get_handler_table_should_merge_base_class_handlers():
+    table = get_handler_table(MockInheritedBot)
+    assert table == {'command': {'hello': 'greet'},
+                     'intent': {'credentials': 'set_credentials'},
+                     'channel': {'default': 'default',
+                                 'fakechannel': 'on_fake',
+                                 'otherchannel': 'on_fake'}}
+    assert get_handler_table(MockInheritedBot()) is table
+    with pytest.raises(TypeError):
+        table['command']['bye'] = 'greet'
+
+
+def test_undecorated_override_should_keep_inherited_handler():
+    class OverridingBot(MockNewStyleBot):
+        def hello(self, event, context, args):
+            self.executed.append(Executed('overridden hello', tuple(args)))
+
+    assert get_handler_table(OverridingBot)['command'] == {'hello': 'hello'}
+    bot = OverridingBot()
+    dispatcher = DefaultDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+    dispatcher.dispatch({'content': '/hello there', 'channel': 'fakechannel'}, None)
+    assert bot.executed == [Executed('overridden hello', ('there',))]
+
+
+def test_get_handler_table_should_not_need_source():
+    namespace = {'hello': command('hello')(lambda self, event, context, args: None)}
+    bot_class = type('GeneratedBot', (object,), namespace)
+    assert get_handler_table(bot_class)['command'] == {'hello': 'hello'}
+
+
+def test_inherited_dispatch_should_call_overridden_command():
+    bot = MockInheritedBot()
+    dispatcher = DefaultDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+
+    event = {'content': '/hello', 'channel': 'otherchannel'}
+    dispatcher.dispatch(event, None)
+
+    executed = bot.executed.pop(0) # type: Executed
+    assert executed.command == 'greet'
+
+
+class MockAliasBot(MockOldStyleBot):
+    @command('start', 'begin', 's')
+    def start(self, event, context, args):
+        self.executed.append(Executed('start', tuple(args)))
+
+    def on_hello(self, event, context, *args):
+        self.executed.append(Executed('old_hello', args))
+
+
+def test_get_command_routes_should_include_aliases_and_old_style_methods():
+    routes = get_command_routes(MockAliasBot)
+    assert routes['start'] == routes['begin'] == routes['s'] == ('start', 'new')
+    assert routes['hello'] == ('on_hello', 'old')
+    assert routes['default'] == ('on_default', 'old')
+    assert get_command_routes(MockAliasBot()) is routes
+
+
+def test_alias_dispatch_should_call_command_handler():
+    bot = MockAliasBot()
+    dispatcher = DefaultDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+    dispatcher.dispatch({'content': '/begin now', 'channel': 'fakechannel'}, None)
+    dispatcher.dispatch({'content': '/hello a b', 'channel': 'fakechannel'}, None)
+    assert bot.executed == [Executed('start', ('now',)), Executed('old_hello', ('a', 'b'))]
+
+
+def test_unknown_command_dispatch_should_reply_without_raising():
+    bot = MockAliasBot()
+    dispatcher = DefaultDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+    dispatcher.dispatch({'content': '/nothing', 'channel': 'fakechannel'}, None)
+    assert bot.sent == ['No such command: nothing']
+
+
+def test_command_handler_errors_should_propagate():
+    class FailingBot(MockOldStyleBot):
+        def on_fail(self, event, context):
+            raise KeyError('inside handler')
+
+    bot = FailingBot()
+    dispatcher = DefaultDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+    with pytest.raises(KeyError):
+        dispatcher.dispatch({'content': '/fail', 'channel': 'fakechannel'}, None)
+
+
+def test_prefix_trie_should_find_longest_prefix():
+    trie = PrefixTrie({'/': 'command', '/intent ': 'intent'})
+    assert trie.longest('/intent credentials') == 'intent'
+    assert trie.longest('/intentional') == 'command'
+    assert trie.longest('hello') is None
+    assert trie.longest('') is None
+
+
+def test_dispatch_should_route_commands_through_overridden_hooks():
+    class BangDispatcher(DefaultDispatcher):
+        def _is_command(self, content):
+            return content is not None and content.startswith('!')
+
+    bot = MockAliasBot()
+    dispatcher = BangDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+    dispatcher.dispatch({'content': '!begin now', 'channel': 'fakechannel'}, None)
+    assert bot.executed == [Executed('start', ('now',))]
+
+
+def test_get_handler_table_should_reject_duplicate_commands():
+    class DuplicateBot(object):
+        @command('start')
+        def start(self, event, context, args):
+            pass
+
+        @command('begin', 'start')
+        def begin(self, event, context, args):
+            pass
+
+    with pytest.raises(ValueError):
+        get_command_routes(DuplicateBot)
+
+
+def test_dispatchers_should_bind_handlers_to_their_own_bot():
+    bots = [MockAliasBot(), MockAliasBot()]
+    for index, bot in enumerate(bots):
+        dispatcher = DefaultDispatcher(bot, IntentState(bot, fixture_intent_slots()))
+        dispatcher.dispatch({'content': '/s {}'.format(index), 'channel': 'fakechannel'}, None)
+    assert [bot.executed for bot in bots] == [[Executed('start', ('0',))], [Executed('start', ('1',))]]
@@ -166,3 +166,19 @@ def test_intent_state_load_intent_slots_should_return_intent_slots():
     intent_slots = IntentState.load_intent_slots_from_yml('tests/fixtures/test_bothub.yml')
     assert intent_slots == [Intent('age', None, [Slot('age', 'How old are you?', [], 'string'),
                                                  Slot('name', 'What is your name?', [], 'string')])]
+
+
+def test_intent_state_get_intent_slots_should_cache_until_file_changes(tmpdir):
+    yml = tmpdir.join('bothub.yml')
+    yml.write('intents:\n  age:\n    slots:\n      - id: age\n        question: How old?\n')
+    intent_slots = IntentState.get_intent_slots(str(yml))
+    assert IntentState.get_intent_slots(str(yml)) is intent_slots
+
+    yml.write('intents:\n  name:\n    slots:\n      - id: name\n        question: Your name?\n')
+    yml.setmtime(yml.mtime() + 10)
+    assert IntentState.get_intent_slots(str(yml)) == [
+        Intent('name', None, [Slot('name', 'Your name?', [], 'string')])]
+
+
+def test_intent_state_get_intent_slots_should_return_empty_without_file(tmpdir):
+    assert IntentState.get_intent_slots(str(tmpdir.join('bothub.yml'))) == []
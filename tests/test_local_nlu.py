@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import pytest
+
+from bothub_client.clients import NluClient
+from bothub_client.clients import NluClientFactory
+from bothub_client.clients import NluResponse
+from bothub_client.local_nlu import KeywordIndex
+from bothub_client.local_nlu import LocalModel
+from bothub_client.local_nlu import LocalNluClient
+
+INTENTS = {
+    'greeting': {'examples': ['hi', 'hello', 'good morning']},
+    'help': {'examples': ['help', 'what can you do']},
+    'order': {'patterns': [r'i want (?P<count>\d+) (?P<item>\w+)']},
+    'weather': {'patterns': [r'weather in (?P<city>\w+)']},
+}
+
+
+def test_keyword_index_should_find_overlapping_keywords():
+    index = KeywordIndex()
+    for keyword in ['he', 'she', 'his', 'hers']:
+        index.add(keyword, keyword)
+    index.build()
+    assert sorted(index.search('ushers')) == [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')]
+
+
+def test_local_model_should_match_examples_and_patterns():
+    model = LocalModel(INTENTS)
+    assert model.match('  Hello ') == ('greeting', 1.0, {})
+    assert model.match('I want 3 apples') == ('order', 0.9, {'count': '3', 'item': 'apples'})
+    assert model.match('weather in Seoul?') == ('weather', 0.9, {'city': 'Seoul'})
+    intent_id, confidence, _ = model.match('hello there')
+    assert intent_id == 'greeting' and confidence == 5 / 11
+    assert model.match('chilly') is None
+    assert model.match('') is None
+
+
+def test_local_model_should_match_patterns_with_colliding_group_names():
+    model = LocalModel({'a': {'patterns': [r'buy (?P<item>\w+)']},
+                        'b': {'patterns': [r'sell (?P<item>\w+)']}})
+    assert model.combined is None
+    assert model.match('sell books, buy pens') == ('b', 0.9, {'item': 'books'})
+
+
+def test_local_nlu_client_should_return_nlu_response():
+    client = LocalNluClient(model=LocalModel(INTENTS))
+    response = client.ask(event={'content': 'good morning', 'channel': 'c', 'sender': {'id': 'u'}})
+    assert response.action.intent == 'greeting'
+    assert response.action.completed is True
+    assert response.raw_response['confidence'] == 1.0
+
+    response = client.ask(message='something else', session_id='s1')
+    assert response.action.intent is None
+    assert response.action.completed is False
+
+
+class RemoteNluClient(NluClient):
+    def __init__(self, token):
+        self.asked = []
+
+    def ask(self, event=None, message=None, session_id=None, lang='en'):
+        self.asked.append(message)
+        return NluResponse({}, 'remote')
+
+
+class RemoteNluClientFactory(NluClientFactory):
+    NAME_TO_CLIENT = dict(NluClientFactory.NAME_TO_CLIENT, remote=RemoteNluClient)
+    clients = {}
+
+
+def test_local_nlu_client_should_fall_back(tmpdir):
+    path = tmpdir.join('bothub.yml')
+    path.write('intents:\n  greeting:\n    examples:\n      - hi\n')
+    factory = RemoteNluClientFactory({'nlu': {'local': {'path': str(path), 'fallback': 'remote'},
+                                              'remote': {'token': 'x'}}})
+    client = factory.get('local')
+    assert isinstance(client, LocalNluClient)
+    assert client.ask(message='hi', session_id='s1').action.intent == 'greeting'
+    assert client.ask(message='tell me a joke', session_id='s1').next_message == 'remote'
+    assert client.fallback.asked == ['tell me a joke']
+
+
+def test_local_model_should_match_patterns_with_numbered_backreferences():
+    model = LocalModel({'a': {'patterns': [r'(x)y']},
+                        'b': {'patterns': [r'(\w+) again \1']}})
+    assert model.combined is None
+    assert model.match('hi again hi') == ('b', 0.9, {})
+    assert model.match('hi again ho') is None
+
+
+def test_nlu_client_factory_should_reject_fallback_cycles():
+    factory = RemoteNluClientFactory({'nlu': {'local': {'fallback': 'tfidf'},
+                                              'tfidf': {'fallback': 'local'}}})
+    factory.clear()
+    with pytest.raises(ValueError):
+        factory.get('local')
+    assert factory.clients == {}
+    assert factory._creating == []
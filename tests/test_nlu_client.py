@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import json
+import sys
+import threading
+import time
+import types
+
 import pytest
 from io import BytesIO
 from bothub_client.clients import NluClient
 from bothub_client.clients import NluAction
 from bothub_client.clients import ApiAiNluClient
+from bothub_client.clients import CachedNluClient
+from bothub_client.clients import DialogflowNluClient
+from bothub_client.clients import NluClientFactory
+from bothub_client.clients import NluResponse
+from bothub_client.utils import LRUCache
 
 
 class MockApiAiRequest(object):
@@ -81,6 +91,205 @@ def test_apiai_nlu_client_ask_message_should_return_response():
     _assert_apiai_response(response)
 
 
+class CountingNluClient(NluClient):
+    def __init__(self, token):
+        self.token = token
+        self.queries = []
+
+    def ask(self, event=None, message=None, session_id=None, lang='en'):
+        self.queries.append((event, message, session_id, lang))
+        return NluResponse({}, 'answer to {}'.format(message or event['content']))
+
+
+class CountingNluClientFactory(NluClientFactory):
+    NAME_TO_CLIENT = {'counting': CountingNluClient}
+    clients = {}
+
+
+def test_nlu_client_factory_should_return_cached_client():
+    factory = CountingNluClientFactory({'nlu': {'counting': {'token': 'x', 'cache': {'maxsize': 10}}}})
+    client = factory.get('counting')
+    assert isinstance(client, CachedNluClient)
+    first = client.ask(message='Hi  there', session_id='s1')
+    assert factory.get('counting').ask(message='hi there', session_id='s2') is first
+    assert client.ask(event={'content': 'HI THERE', 'channel': 'c', 'sender': {'id': 'u'}}) is first
+    assert client.ask(message='hi there', session_id='s1', lang='ko') is not first
+    assert client.cache.stats() == {'hits': 2, 'misses': 2, 'size': 2}
+    assert [q[3] for q in client.client.queries] == ['en', 'ko']
+
+
+def test_cached_nlu_client_should_skip_cache_on_request():
+    factory = CountingNluClientFactory({'nlu': {'counting': {'token': 'y', 'cache': True}}})
+    client = factory.get('counting')
+    client.ask(message='hi', session_id='s1')
+    client.ask(message='hi', session_id='s1', use_cache=False)
+    assert len(client.client.queries) == 2
+
+
+def test_cached_nlu_client_should_key_by_session_if_asked():
+    client = CachedNluClient(CountingNluClient('z'), 'counting', LRUCache(), include_session=True)
+    client.ask(message='hi', session_id='s1')
+    client.ask(message='hi', session_id='s1')
+    client.ask(message='hi', session_id='s2')
+    assert len(client.client.queries) == 2
+
+
+def test_nlu_client_factory_without_cache_should_return_client():
+    factory = CountingNluClientFactory({'nlu': {'counting': {'token': 'x'}}})
+    assert isinstance(factory.get('counting'), CountingNluClient)
+
+
+def test_nlu_client_factory_should_share_clients_per_params():
+    CountingNluClientFactory.clear()
+    factory = CountingNluClientFactory({'nlu': {'counting': {'token': 'a'}}})
+    client = factory.get('counting')
+    assert factory.get('counting') is client
+    assert CountingNluClientFactory({'nlu': {'counting': {'token': 'a'}}}).get('counting') is client
+    assert CountingNluClientFactory({'nlu': {'counting': {'token': 'b'}}}).get('counting') is not client
+
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeDialogflow(object):
+    def __init__(self):
+        self.calls = []
+        fake = self
+
+        class AgentsClient(object):
+            def project_path(self, agent_id):
+                return 'projects/{}'.format(agent_id)
+
+            def get_agent(self, parent):
+                fake.calls.append(('get_agent', parent))
+                return Namespace(default_language_code='ko')
+
+        class SessionsClient(object):
+            def __init__(self):
+                fake.calls.append(('SessionsClient',))
+
+            def session_path(self, agent_id, session_id):
+                return '{}/{}'.format(agent_id, session_id)
+
+            def detect_intent(self, session, query_input):
+                fake.calls.append(('detect_intent', session, query_input.text.language_code))
+                intent = Namespace(display_name='greeting')
+                return Namespace(query_result=Namespace(
+                    action='', intent=intent, parameters={}, all_required_params_present=True,
+                    fulfillment_text='hello'))
+
+        self.module = types.ModuleType(str('dialogflow'))
+        self.module.AgentsClient = AgentsClient
+        self.module.SessionsClient = SessionsClient
+        self.module.types = Namespace(
+            TextInput=lambda text, language_code: Namespace(text=text, language_code=language_code),
+            QueryInput=lambda text: Namespace(text=text))
+
+
+@pytest.fixture
+def fake_dialogflow(monkeypatch):
+    fake = FakeDialogflow()
+    monkeypatch.setitem(sys.modules, 'dialogflow', fake.module)
+    monkeypatch.setattr(DialogflowNluClient, 'agent_langs', {})
+    return fake
+
+
+def test_dialogflow_nlu_client_should_reuse_session_client_and_lang(fake_dialogflow):
+    client = DialogflowNluClient('agent1')
+    assert fake_dialogflow.calls == []
+    response = client.ask(message='hi', session_id='s1')
+    client.ask(event={'content': 'hi', 'channel': 'c', 'sender': {'id': 'u'}})
+    DialogflowNluClient('agent1').ask(message='hi', session_id='s1', lang='en')
+    assert response.action.intent == 'greeting'
+    assert [c[0] for c in fake_dialogflow.calls].count('get_agent') == 1
+    assert [c[0] for c in fake_dialogflow.calls].count('SessionsClient') == 2
+    assert [c for c in fake_dialogflow.calls if c[0] == 'detect_intent'] == [
+        ('detect_intent', 'agent1/s1', 'ko'),
+        ('detect_intent', 'agent1/c-u', 'ko'),
+        ('detect_intent', 'agent1/s1', 'en')]
+
+
+def test_dialogflow_nlu_client_should_refresh_lang(fake_dialogflow):
+    client = DialogflowNluClient('agent1', lang_refresh_interval=0)
+    assert client.lang == 'ko'
+    assert client.lang == 'ko'
+    assert [c[0] for c in fake_dialogflow.calls].count('get_agent') == 2
+
+
+def test_dialogflow_nlu_client_should_retry_lang_after_interval_when_refresh_fails(fake_dialogflow):
+    now = [0]
+    client = DialogflowNluClient('agent1', lang_refresh_interval=10, lang_retry_interval=5,
+                                 clock=lambda: now[0])
+    assert client.lang == 'ko'
+
+    def fail(self, parent):
+        fake_dialogflow.calls.append(('get_agent', parent))
+        raise IOError('unavailable')
+
+    fake_dialogflow.module.AgentsClient.get_agent = fail
+    now[0] = 10
+    assert [client.lang for _ in range(3)] == ['ko', 'ko', 'ko']
+    now[0] = 15
+    assert client.lang == 'ko'
+    assert [c[0] for c in fake_dialogflow.calls].count('get_agent') == 3
+
+
+class SlowNluClient(NluClient):
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def ask(self, event=None, message=None, session_id=None, lang='en'):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.001 * (message % 3))
+        with self.lock:
+            self.in_flight -= 1
+        return (message, session_id, lang)
+
+
+def test_ask_many_should_keep_order_and_bound_concurrency():
+    client = SlowNluClient()
+    consumed = []
+
+    def messages():
+        for i in range(30):
+            consumed.append(i)
+            yield i
+
+    results = client.ask_many(messages(), 'backfill', concurrency=4)
+    assert next(results) == (0, 'backfill', 'en')
+    assert len(consumed) <= 5
+    assert list(results) == [(i, 'backfill', 'en') for i in range(1, 30)]
+    assert client.max_in_flight <= 4
+
+
+def test_ask_many_should_pair_session_ids():
+    client = SlowNluClient()
+    results = list(client.ask_many([1, 2], iter(['s1', 's2']), lang='ko'))
+    assert results == [(1, 's1', 'ko'), (2, 's2', 'ko')]
+    with pytest.raises(ValueError):
+        list(client.ask_many([1, 2], ['s1']))
+
+
+def test_apiai_nlu_client_ask_many_should_return_responses():
+    client = ApiAiNluClient('myapikey')
+    client.apiai = MockApiai()
+    responses = list(client.ask_many(['hello', 'bye'], 'mychannel-myid', concurrency=2))
+    assert [r.raw_response['request']['query'] for r in responses] == ['hello', 'bye']
+
+
+def test_ask_many_should_raise_query_errors():
+    client = ApiAiNluClient('myapikey')
+    client.apiai = None
+    with pytest.raises(AttributeError):
+        list(client.ask_many(['hello'], 's1'))
+
+
 def _assert_apiai_response(response):
     assert response.raw_response['result'] == {'action': 'myaction',
                                                'parameters': [],
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from bothub_client.ratelimit import RateLimiter
+from bothub_client.ratelimit import TokenBucket
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+
+def fixture_limiter(clock, **kwargs):
+    limits = {'mychannel': {'rate': 2, 'burst': 2, 'receiver_rate': 1, 'receiver_burst': 1}}
+    return RateLimiter(limits, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket_should_queue_reservations():
+    bucket = TokenBucket(2, 2, now=0)
+    assert [bucket.reserve(0) for _ in range(4)] == [0, 0, 0.5, 1.0]
+    assert bucket.reserve(10) == 0
+
+
+def test_rate_limiter_should_delay_over_channel_rate():
+    clock = FakeClock()
+    limiter = fixture_limiter(clock)
+    waits = [limiter.acquire('mychannel', 'user{}'.format(i)) for i in range(4)]
+    assert waits == [0, 0, 0.5, 1.0]
+    assert limiter.delayed == 2
+    assert limiter.acquire('otherchannel', 'user1') == 0
+
+
+def test_rate_limiter_should_delay_over_receiver_rate():
+    clock = FakeClock()
+    limiter = fixture_limiter(clock)
+    assert limiter.acquire('mychannel', 'user1') == 0
+    clock.now += 1
+    assert limiter.acquire('mychannel', 'user1') == 0
+    assert limiter.acquire('mychannel', 'user1') == 1.0
+
+
+def test_rate_limiter_should_drop_least_recently_used_receiver_buckets():
+    clock = FakeClock()
+    limiter = fixture_limiter(clock, max_receivers=2)
+    limiter.acquire('mychannel', 'user1')
+    limiter.acquire('mychannel', 'user2')
+    clock.now += 10
+    limiter.acquire('mychannel', 'user1')
+    limiter.acquire('mychannel', 'user3')
+    assert list(limiter.receiver_buckets) == [('mychannel', 'user1'), ('mychannel', 'user3')]
+
+
+def test_rate_limiter_reserve_should_not_wait():
+    clock = FakeClock()
+    limiter = fixture_limiter(clock)
+    assert [limiter.reserve('mychannel', 'user{}'.format(i)) for i in range(3)] == [0, 0, 0.5]
+    assert clock.slept == []
+    assert limiter.delayed == 1
+
+
+def test_rate_limiter_should_report_queue_depth():
+    clock = FakeClock()
+    limiter = fixture_limiter(clock)
+    waiting = threading.Event()
+    release = threading.Event()
+
+    def sleep(seconds):
+        waiting.set()
+        release.wait(5)
+
+    limiter.sleep = sleep
+    limiter.acquire('mychannel', 'user1')
+    thread = threading.Thread(target=limiter.acquire, args=('mychannel', 'user1'))
+    thread.start()
+    waiting.wait(5)
+    assert limiter.queue_depth == 1
+    assert limiter.queue_depths() == {'mychannel': 1}
+    release.set()
+    thread.join()
+    assert limiter.queue_depth == 0
+
+
+def test_from_context_should_read_channel_limits():
+    context = {'channel': {'channels': [{'type': 'a', 'rate_limit': {'rate': 1}}, {'type': 'b'}]}}
+    assert RateLimiter.from_context(context).limits == {'a': {'rate': 1}}
+    assert RateLimiter.from_context({'channel': {'channels': [{'type': 'b'}]}}) is None
+    assert RateLimiter.from_context(context) is RateLimiter.from_context(dict(context))
+    other = {'channel': {'endpoint': 'tcp://other:5555', 'channels': context['channel']['channels']}}
+    assert RateLimiter.from_context(other) is not RateLimiter.from_context(context)
@@ -2,10 +2,17 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+import copy
+
+import pytest
+import requests
 import requests_mock
 
 from bothub_client.clients import StorageClient
+from bothub_client.clients import TrackedDict
+from bothub_client.transports import TransportError
 from .testutils import MockTransport
+from .testutils import StorageServer
 
 
 def fixture_client(transport=None):
@@ -73,3 +80,155 @@ def test_get_user_data():
 
     assert transport.executed.pop(0) == ('get',
                                          {'url': '/projects/1/channels/mychannel/users/yourid'})
+
+
+def test_unit_of_work_should_fetch_once_and_coalesce_writes():
+    transport = MockTransport()
+    transport.record({'data': {'score': 11}})
+
+    client = fixture_client(transport)
+    client.begin()
+    data = client.get_user_data('mychannel', 'yourid')
+    assert client.get_user_data('mychannel', 'yourid') is data
+    data['score'] = 12
+    client.set_user_data('mychannel', 'yourid', data)
+    assert client.get_user_data('mychannel', 'yourid', key='score') == 12
+    client.set_user_data('mychannel', 'yourid', data)
+    assert len(transport.executed) == 1
+
+    client.commit()
+    assert transport.executed == [
+        ('get', {'url': '/projects/1/channels/mychannel/users/yourid'}),
+        ('put', {'url': '/projects/1/channels/mychannel/users/yourid',
+                 'data': {'data': {'score': 12}}})]
+
+
+def test_commit_should_end_unit_of_work():
+    transport = MockTransport()
+
+    client = fixture_client(transport)
+    client.begin()
+    client.commit()
+    client.set_user_data('mychannel', 'yourid', {'score': 11})
+
+    assert transport.executed.pop(0) == ('put',
+                                         {'url': '/projects/1/channels/mychannel/users/yourid',
+                                          'data': {'data': {'score': 11}}})
+
+
+def test_unit_of_work_should_merge_partial_writes():
+    transport = MockTransport()
+    transport.record({'data': {'score': 11, 'name': 'me'}})
+
+    client = fixture_client(transport)
+    client.begin()
+    client.set_user_data('mychannel', 'yourid', {'score': 12})
+    client.set_user_data('mychannel', 'yourid', {'level': 2})
+    assert client.get_user_data('mychannel', 'yourid') == {'score': 12, 'name': 'me', 'level': 2}
+    client.commit()
+
+    assert transport.executed.pop() == ('put',
+                                        {'url': '/projects/1/channels/mychannel/users/yourid',
+                                         'data': {'data': {'score': 12, 'name': 'me', 'level': 2}}})
+
+
+def test_unit_of_work_should_not_share_passed_dicts():
+    transport = MockTransport()
+
+    client = fixture_client(transport)
+    client.begin()
+    data = {'score': 1}
+    client.set_user_data('mychannel', 'user1', data)
+    client.set_user_data('mychannel', 'user2', data)
+    client.set_user_data('mychannel', 'user1', {'level': 2})
+    client.commit()
+
+    assert data == {'score': 1}
+    assert [call[1]['data']['data'] for call in transport.executed] == [{'score': 1, 'level': 2},
+                                                                        {'score': 1}]
+
+
+def test_patch_user_data_should_send_changed_keys_only():
+    transport = MockTransport()
+    transport.record({'data': {'score': 11, 'profile': {'name': 'me'}, 'old': True}})
+
+    client = fixture_client(transport)
+    data = client.get_user_data('mychannel', 'yourid')
+    data['profile']['name'] = 'you'
+    del data['old']
+    client.patch_user_data('mychannel', 'yourid', data)
+    client.patch_user_data('mychannel', 'yourid', data)
+
+    assert transport.executed[1:] == [
+        ('patch', {'url': '/projects/1/channels/mychannel/users/yourid',
+                   'data': {'set': {'profile': {'name': 'you'}}, 'delete': ['old']}})]
+
+
+def test_tracked_dict_should_copy_nested_values_when_read():
+    data = TrackedDict({'score': 1, 'profile': {'name': 'me'}, 'tags': ['a'], 'flags': {'x': 1}})
+    assert data._snapshots == {}
+    assert data.changes() == ({}, [])
+
+    data['profile']['name'] = 'you'
+    tags = data.pop('tags')
+    tags.append('b')
+    data['tags'] = tags
+    for value in data.values():
+        pass
+    other = copy.copy(data)
+    other['flags']['x'] = 2
+
+    assert data.changes() == ({'profile': {'name': 'you'}, 'tags': ['a', 'b'], 'flags': {'x': 2}}, [])
+    assert other.changes() == data.changes()
+
+
+def test_commit_with_partial_updates_should_patch():
+    transport = MockTransport()
+    transport.record({'data': {'score': 11, 'name': 'me'}})
+
+    client = fixture_client(transport)
+    client.partial_updates = True
+    client.begin()
+    data = client.get_user_data('mychannel', 'yourid')
+    data['_slot_id'] = 'age'
+    client.set_user_data('mychannel', 'yourid', data)
+    client.commit()
+
+    assert transport.executed.pop() == ('patch',
+                                        {'url': '/projects/1/channels/mychannel/users/yourid',
+                                         'data': {'set': {'_slot_id': 'age'}, 'delete': []}})
+
+
+def test_set_many_and_get_many_user_data_should_batch_requests():
+    with StorageServer() as server:
+        client = StorageClient(1, 'testkey', server.base_url, batch_size=40, batch_concurrency=3)
+        client.set_many_user_data(('mychannel', 'user{}'.format(i), {'score': i}) for i in range(100))
+        keys = [('mychannel', 'user{}'.format(i)) for i in range(99, -1, -1)] + [('mychannel', 'nobody')]
+        data = client.get_many_user_data(keys)
+
+    assert [d['score'] for d in data[:-1]] == list(range(99, -1, -1))
+    assert data[-1] == {}
+    assert sorted(server.requests) == [('/projects/1/users/_mget', 21),
+                                       ('/projects/1/users/_mget', 40),
+                                       ('/projects/1/users/_mget', 40),
+                                       ('/projects/1/users/_mset', 20),
+                                       ('/projects/1/users/_mset', 40),
+                                       ('/projects/1/users/_mset', 40)]
+
+
+def test_many_user_data_should_raise_on_failed_chunks():
+    client = StorageClient(1, 'testkey', 'http://storage.test', batch_size=2, batch_concurrency=1)
+    keys = [('mychannel', 'user{}'.format(i)) for i in range(4)]
+    with requests_mock.mock() as m:
+        m.post('http://storage.test/projects/1/users/_mget',
+               [{'status_code': 429, 'json': {}}, {'json': {'data': [{'a': 2}, {'a': 3}]}}])
+        with pytest.raises(requests.HTTPError):
+            client.get_many_user_data(keys)
+
+        m.post('http://storage.test/projects/1/users/_mget', json={'data': [{'a': 0}]})
+        with pytest.raises(TransportError):
+            client.get_many_user_data(keys)
+
+        m.post('http://storage.test/projects/1/users/_mset', status_code=400, json={})
+        with pytest.raises(requests.HTTPError):
+            client.set_many_user_data([('mychannel', 'user0', {'a': 1})])
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bothub_client.clients import NluAction  # noqa: E402
+from bothub_client.clients import NluClient  # noqa: E402
+from bothub_client.clients import NluClientFactory  # noqa: E402
+from bothub_client.clients import NluResponse  # noqa: E402
+from bothub_client.tfidf_nlu import TfidfModel  # noqa: E402
+from bothub_client.tfidf_nlu import TfidfNluClient  # noqa: E402
+from bothub_client.tfidf_nlu import hash_ngrams  # noqa: E402
+
+EXAMPLES = {
+    'greeting': ['hello there', 'hi', 'good morning', 'hey'],
+    'weather': ['what is the weather today', 'will it rain tomorrow', 'weather forecast please'],
+    'order': ['i want to order a pizza', 'order two burgers', 'can i buy a coffee'],
+    'empty': [],
+}
+
+BOTHUB_YML = '''intents:
+  greeting:
+    examples: [hello there, hi, good morning]
+  weather:
+    examples: [what is the weather today, will it rain tomorrow]
+'''
+
+
+def test_hash_ngrams_should_count_character_ngrams():
+    rows, features, counts = hash_ngrams(['Hi', 'aaaa', ''], 1024, (2, 3))
+    assert counts[rows == 0].sum() == 5
+    assert counts[rows == 1].sum() == 9 and counts[rows == 1].max() == 3
+    assert counts[rows == 2].sum() == 1
+    assert ((0 <= features) & (features < 1024)).all()
+
+
+def test_tfidf_model_should_classify_utterances():
+    model = TfidfModel.train(EXAMPLES, n_features=4096)
+    assert model.intents == ['greeting', 'order', 'weather']
+    scores = model.classify('Weather forecast for tomorrow?')
+    assert model.intents[int(np.argmax(scores))] == 'weather'
+    assert 0 < scores.max() <= 1.0001
+
+
+def test_tfidf_model_should_classify_many_like_one():
+    model = TfidfModel.train(EXAMPLES, n_features=4096)
+    texts = ['hey hello', 'order a pizza', '', 'rain today?']
+    scores = model.classify_many(texts)
+    assert scores.shape == (4, 3)
+    for row, text in enumerate(texts):
+        assert np.allclose(scores[row], model.classify(text), atol=1e-5)
+    assert model.classify_many([]).shape == (0, 3)
+
+
+def test_tfidf_model_should_save_and_load_memory_mapped(tmpdir):
+    model = TfidfModel.train(EXAMPLES, n_features=4096)
+    path = str(tmpdir.join('model'))
+    model.save(path)
+    loaded = TfidfModel.load(path)
+    assert isinstance(loaded.weights, np.memmap)
+    assert loaded.intents == model.intents
+    assert np.allclose(loaded.classify('good morning'), model.classify('good morning'))
+
+
+def test_tfidf_model_save_should_replace_files_atomically(tmpdir):
+    path = str(tmpdir.join('model'))
+    TfidfModel.train({'a': ['apple']}, n_features=1024).save(path)
+    TfidfModel.train(EXAMPLES, n_features=4096).save(path)
+    assert sorted(f.basename for f in tmpdir.listdir()) == ['model.idf.npy', 'model.json',
+                                                            'model.weights.npy']
+    assert TfidfModel.load(path).intents == ['greeting', 'order', 'weather']
+
+
+def test_tfidf_nlu_client_should_reload_when_bothub_yml_changes(tmpdir):
+    yml = tmpdir.join('bothub.yml')
+    yml.write(BOTHUB_YML)
+    client = TfidfNluClient(model_path=str(tmpdir.join('intents')), path=str(yml), n_features=2048)
+    model = client.model
+    assert client.model is model
+    assert model.intents == ['greeting', 'weather']
+
+    yml.write(BOTHUB_YML + '  order:\n    examples: [order a pizza]\n')
+    assert client.model.intents == ['greeting', 'order', 'weather']
+    assert client.ask(message='order two pizzas', session_id='s1').action.intent == 'order'
+
+
+def test_tfidf_nlu_client_should_return_nlu_response():
+    client = TfidfNluClient(model=TfidfModel.train(EXAMPLES, n_features=4096))
+    response = client.ask(message='i would like to order pizza', session_id='s1')
+    assert response.action.intent == 'order'
+    assert response.action.completed is True
+    assert response.raw_response['confidence'] >= 0.3
+    assert 'order' in response.raw_response['scores']
+
+    response = client.ask(event={'content': 'zzzz', 'channel': 'c', 'sender': {'id': 'u'}})
+    assert response.action.intent is None
+
+
+def test_tfidf_nlu_client_ask_many_should_classify_in_batches():
+    client = TfidfNluClient(model=TfidfModel.train(EXAMPLES, n_features=4096))
+    messages = ['hi', 'order a burger', 'weather today'] * 5
+    responses = list(client.ask_many(iter(messages), 's1', batch_size=4))
+    assert [r.action.intent for r in responses] == ['greeting', 'order', 'weather'] * 5
+
+
+class RecordingNluClient(NluClient):
+    def __init__(self):
+        self.asked = []
+
+    def ask(self, event=None, message=None, session_id=None, lang=None):
+        self.asked.append((message, session_id))
+        return NluResponse({'source': 'fallback'}, None, NluAction('fallback', {}, action_incomplete=False))
+
+
+def test_tfidf_nlu_client_ask_many_should_ask_fallback_for_misses_only():
+    fallback = RecordingNluClient()
+    client = TfidfNluClient(model=TfidfModel.train(EXAMPLES, n_features=4096), fallback=fallback)
+    messages = ['hi', 'zzzz', 'order a burger', 'qqqq', 'weather today']
+    responses = list(client.ask_many(messages, ['s{}'.format(i) for i in range(5)], batch_size=3))
+    assert [r.action.intent for r in responses] == ['greeting', 'fallback', 'order', 'fallback', 'weather']
+    assert sorted(fallback.asked) == [('qqqq', 's3'), ('zzzz', 's1')]
+
+
+def test_nlu_client_factory_should_train_and_save_tfidf_model(tmpdir):
+    yml = tmpdir.join('bothub.yml')
+    yml.write(BOTHUB_YML)
+    model_path = str(tmpdir.join('intents'))
+    factory = NluClientFactory({'nlu': {'tfidf': {'path': str(yml), 'model_path': model_path,
+                                                  'n_features': 2048}}})
+    client = factory.get('tfidf')
+    assert isinstance(client, TfidfNluClient)
+    assert client.ask(message='hello', session_id='s1').action.intent == 'greeting'
+    assert tmpdir.join('intents.weights.npy').check()
+
+    reloaded = TfidfNluClient(model_path=model_path, path=str(yml))
+    assert isinstance(reloaded.model.weights, np.memmap)
+    NluClientFactory.clear()
@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import threading
+
+import pytest
+import requests
 import requests_mock
+from bothub_client.transports import CircuitBreaker
+from bothub_client.transports import CircuitOpenError
 from bothub_client.transports import HttpTransport
+from bothub_client.transports import TransportError
+from bothub_client.transports import ZmqSocketPool
 from bothub_client.transports import ZmqTransport
+from bothub_client.transports import close_http_sessions
+from bothub_client.transports import get_circuit_breaker
+from bothub_client.transports import get_http_session
+from bothub_client.transports import get_zmq_context
 
 
 class DummySocket(object):
@@ -22,6 +34,22 @@ class DummySocket(object):
                               'args': {'data': data}})
 
 
+class DummyClosableSocket(DummySocket):
+    def close(self, linger=None):
+        self.executed.append({'command': 'close',
+                              'args': {'linger': linger}})
+
+
+class DummyPoolContext(object):
+    def __init__(self):
+        self.sockets = []
+
+    def socket(self, sockettype):
+        socket = DummyClosableSocket()
+        self.sockets.append(socket)
+        return socket
+
+
 class DummyContext(object):
     def __init__(self):
         self._socket = None
@@ -58,6 +86,160 @@ def test_http_put_should_invoke_put():
         assert mock.called is True
 
 
+def test_http_get_should_retry_on_gateway_errors():
+    sleeps = []
+    with requests_mock.mock() as mock:
+        mock.get('http://localhost:8000/path', [{'status_code': 502}, {'status_code': 503},
+                                                {'text': '{"ran":true}'}])
+        t = HttpTransport('http://localhost:8000', max_retries=2, sleep=sleeps.append)
+        assert t.get('/path') == {'ran': True}
+        assert mock.call_count == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.1 and 0 <= sleeps[1] <= 0.2
+
+
+def test_http_get_should_raise_transport_error_after_retries():
+    with requests_mock.mock() as mock:
+        mock.get('http://localhost:8000/path', status_code=504)
+        t = HttpTransport('http://localhost:8000', max_retries=2, sleep=lambda s: None)
+        with pytest.raises(TransportError):
+            t.get('/path')
+        assert mock.call_count == 3
+
+
+def test_http_get_should_retry_on_connection_error():
+    with requests_mock.mock() as mock:
+        mock.get('http://localhost:8000/path', [{'exc': requests.ConnectTimeout},
+                                                {'text': '{"ran":true}'}])
+        t = HttpTransport('http://localhost:8000', sleep=lambda s: None)
+        assert t.get('/path') == {'ran': True}
+
+
+def test_http_post_should_not_be_retried():
+    with requests_mock.mock() as mock:
+        mock.post('http://localhost:8000/path', status_code=503)
+        t = HttpTransport('http://localhost:8000', max_retries=2, sleep=lambda s: None)
+        with pytest.raises(TransportError):
+            t.post('/path', data={})
+        assert mock.call_count == 1
+
+
+def test_http_client_errors_should_be_returned():
+    with requests_mock.mock() as mock:
+        mock.put('http://localhost:8000/path', status_code=404)
+        t = HttpTransport('http://localhost:8000', sleep=lambda s: None)
+        assert t.put('/path', data={}).status_code == 404
+        assert mock.call_count == 1
+
+
+def test_http_transport_should_pass_timeout():
+    with requests_mock.mock() as mock:
+        mock.get('http://localhost:8000/path', text='{}')
+        HttpTransport('http://localhost:8000', timeout=(1, 2)).get('/path')
+        assert mock.last_request.timeout == (1, 2)
+
+
+def test_circuit_breaker_should_fail_fast_while_open():
+    now = [0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    with requests_mock.mock() as mock:
+        mock.get('http://localhost:8000/path', status_code=500)
+        t = HttpTransport('http://localhost:8000', circuit_breaker=breaker, sleep=lambda s: None)
+        for _ in range(2):
+            with pytest.raises(TransportError):
+                t.get('/path')
+        assert breaker.is_open
+        with pytest.raises(CircuitOpenError):
+            t.get('/path')
+        assert mock.call_count == 2
+
+        now[0] = 10
+        mock.get('http://localhost:8000/path', text='{}')
+        assert t.get('/path') == {}
+        assert not breaker.is_open
+
+
+def test_circuit_breaker_should_reopen_when_trial_fails():
+    now = [0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_failure()
+    assert breaker.is_open and breaker.opened_at == 10
+
+
+def test_circuit_breaker_should_reopen_when_trial_raises_other_errors():
+    now = [0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10
+    with requests_mock.mock() as mock:
+        mock.get('http://localhost:8000/path', exc=requests.exceptions.ChunkedEncodingError)
+        t = HttpTransport('http://localhost:8000', circuit_breaker=breaker, sleep=lambda s: None)
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            t.get('/path')
+        assert breaker.is_open and not breaker.trial
+
+        now[0] = 1000
+        mock.get('http://localhost:8000/path', text='{}')
+        assert t.get('/path') == {}
+        assert not breaker.is_open
+
+
+def test_circuit_breaker_should_be_shared_per_host_and_options():
+    breaker = get_circuit_breaker('http://breaker.test:9000/a', failure_threshold=3)
+    assert get_circuit_breaker('http://breaker.test:9000/b', failure_threshold=3) is breaker
+    other = get_circuit_breaker('http://breaker.test:9000', failure_threshold=7)
+    assert other is not breaker
+    assert other.failure_threshold == 7
+
+
+def test_http_transport_from_config_should_share_circuit_breaker():
+    config = {'endpoint': 'http://storage.test:9000', 'timeout': [1, 5], 'max_retries': 1}
+    t1 = HttpTransport.from_config(config)
+    t2 = HttpTransport.from_config({'endpoint': 'http://storage.test:9000/v1'})
+    assert t1.timeout == (1, 5)
+    assert t1.max_retries == 1
+    assert t1.circuit_breaker is t2.circuit_breaker
+    assert HttpTransport.from_config({'endpoint': 'http://storage.test:9000',
+                                      'circuit_breaker': False}).circuit_breaker is None
+
+
+def test_http_session_should_be_shared_per_host_and_options():
+    session = get_http_session('http://pool.test:9000/storage', pool_maxsize=32, pool_block=True)
+    assert get_http_session('http://pool.test:9000/channel', pool_maxsize=32,
+                            pool_block=True) is session
+    assert get_http_session('http://pool.test:9000', pool_maxsize=8) is not session
+    adapter = session.get_adapter('http://pool.test:9000/')
+    assert adapter._pool_maxsize == 32
+    assert adapter._pool_block is True
+
+
+def test_close_http_sessions_should_close_shared_sessions():
+    session = get_http_session('http://close.test:9000')
+    closed = []
+    session.close = lambda: closed.append(session)
+    close_http_sessions()
+    assert closed == [session]
+    assert get_http_session('http://close.test:9000') is not session
+
+
+def test_http_session_should_close_connections_without_keep_alive():
+    session = get_http_session('http://pool.test:9000', keep_alive=False)
+    assert session.headers['Connection'] == 'close'
+
+
+def test_http_transports_from_config_should_share_session():
+    storage = HttpTransport.from_config({'endpoint': 'http://pool.test:9001/storage',
+                                         'pool': {'pool_maxsize': 16}})
+    channel = HttpTransport.from_config({'endpoint': 'http://pool.test:9001/channel',
+                                         'pool': {'pool_maxsize': 16}})
+    assert storage.session is channel.session
+    assert not storage.owns_session
+
+
 def test_zmq_send_json_should_invoke_send():
     context = DummyContext()
     t = ZmqTransport('localhost', context=context)
@@ -76,3 +258,51 @@ def test_zmq_send_multipart_should_invoke_send():
                                          'args': {'address': 'localhost'}},
                                         {'command': 'send_multipart',
                                          'args': {'data': 'mydata'}}]
+
+
+def test_zmq_socket_pool_should_reuse_socket_per_thread_and_address():
+    context = DummyPoolContext()
+    pool = ZmqSocketPool(context)
+    socket = pool.get('tcp://localhost:1')
+    assert pool.get('tcp://localhost:1') is socket
+    assert pool.get('tcp://localhost:2') is not socket
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.get('tcp://localhost:1')))
+    thread.start()
+    thread.join()
+    assert other[0] is not socket
+    assert len(context.sockets) == 3
+
+
+def test_zmq_socket_pool_should_close_sockets_of_exited_threads():
+    context = DummyPoolContext()
+    pool = ZmqSocketPool(context)
+    pool.get('tcp://localhost:1')
+    for _ in range(5):
+        threads = [threading.Thread(target=pool.get, args=('tcp://localhost:1',)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(context.sockets) == 21
+    assert pool.size == 1
+    closed = [s for s in context.sockets if s.executed[-1]['command'] == 'close']
+    assert len(closed) == 20
+
+
+def test_zmq_socket_pool_close_should_close_all_sockets():
+    context = DummyPoolContext()
+    pool = ZmqSocketPool(context)
+    socket = pool.get('tcp://localhost:1')
+    pool.close(linger=0)
+    assert socket.executed[-1] == {'command': 'close', 'args': {'linger': 0}}
+    assert pool.get('tcp://localhost:1') is not socket
+
+
+def test_zmq_transport_close_should_keep_pooled_socket():
+    t = ZmqTransport('tcp://127.0.0.1:5999')
+    socket = t.socket
+    t.close()
+    assert ZmqTransport('tcp://127.0.0.1:5999').socket is socket
+    assert t.pool.context is get_zmq_context()
@@ -1,35 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import sys
+from bothub_client.utils import LRUCache
 from bothub_client.utils import traceback_to_string
-from bothub_client.utils import get_decorators
-from bothub_client.decorators import command, intent
-
-
-class TestDecorator(object):
-    @command('start')
-    def iamcommand(self):
-        pass
-
-    @command('reply')
-    def iamcommand_too(self):
-        pass
-
-    @intent('credentials')
-    def iamintent(self):
-        pass
-
-
-def test_get_decorators_should_returns_decorators():
-    assert get_decorators(TestDecorator) == {'iamcommand': [('command', ['start'])],
-                                             'iamcommand_too': [('command', ['reply'])],
-                                             'iamintent': [('intent', ['credentials'])]}
-
-
-def test_get_decorators_with_obj_should_returns_decorators():
-    assert get_decorators(TestDecorator()) == {'iamcommand': [('command', ['start'])],
-                                               'iamcommand_too': [('command', ['reply'])],
-                                               'iamintent': [('intent', ['credentials'])]}
 
 
 def test_traceback_to_string_should_return_string():
@@ -41,3 +14,25 @@ def test_traceback_to_string_should_return_string():
             _, _, tb = sys.exc_info()
         s = traceback_to_string(e, tb=tb)
         assert 'raise KeyError()' in s
+
+
+def test_lru_cache_should_drop_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2}
+
+
+def test_lru_cache_should_expire_entries():
+    now = [0]
+    cache = LRUCache(ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    now[0] = 9
+    assert cache.get('a') == 1
+    now[0] = 10
+    assert cache.get('a', 'expired') == 'expired'
+    assert len(cache) == 0
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+import requests_mock
+import zmq
+from bothub_client.bot import BaseBot
+from bothub_client.transports import get_zmq_context
+from bothub_client.worker import Supervisor
+from bothub_client.worker import Worker
+from bothub_client.worker import conversation_slot
+from bothub_client.worker import load_bot_class
+
+
+class RecordingBot(BaseBot):
+    handled = []
+
+    def handle_message(self, event, context):
+        self.handled.append((event['sender']['id'], event['content'], context.get('request_id')))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_conversation_slot_should_be_stable():
+    event = {'channel': 'mychannel', 'sender': {'id': 'myid'}}
+    assert conversation_slot(event, 8) == conversation_slot(dict(event), 8)
+    assert conversation_slot({'channel': 'mychannel'}, 8) is None
+
+
+def test_load_bot_class_should_import_class():
+    assert load_bot_class('bothub_client.bot:BaseBot') is BaseBot
+
+
+def test_worker_should_handle_events_in_conversation_order():
+    context = {'channel': {'endpoint': 'http://localhost'}}
+    worker = Worker('inproc://test-worker', context, RecordingBot, threads=3,
+                    zmq_context=get_zmq_context())
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+
+    socket = get_zmq_context().socket(zmq.PUSH)
+    socket.connect('inproc://test-worker')
+    for i in range(20):
+        message = {'event': {'content': str(i), 'channel': 'mychannel',
+                             'sender': {'id': 'user{}'.format(i % 4)}},
+                   'context': {'channel': {'endpoint': 'http://localhost'}, 'request_id': i}}
+        socket.send_multipart([json.dumps(message).encode('utf8')])
+    socket.send_multipart([b'not a json'])
+
+    wait_for(lambda: len(RecordingBot.handled) == 20)
+    worker.stop()
+    thread.join()
+    socket.close(linger=0)
+
+    assert len(RecordingBot.handled) == 20
+    for user in range(4):
+        contents = [c for _id, c, _ in RecordingBot.handled if _id == 'user{}'.format(user)]
+        assert contents == [str(i) for i in range(20) if i % 4 == user]
+    assert sorted(r for _, _, r in RecordingBot.handled) == list(range(20))
+
+
+class DummyBackend(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, frames, flags=0):
+        self.sent.append(frames)
+
+
+class ReplyingBot(BaseBot):
+    def handle_message(self, event, context):
+        self.send_message(event['content'])
+
+
+def test_worker_should_reply_to_endpoints_of_message_context():
+    worker = Worker('inproc://unused', {'channel': {'endpoint': 'http://a'}}, ReplyingBot, threads=2)
+    for i, endpoint in enumerate(['http://b', 'http://a', 'http://c']):
+        message = {'event': {'content': endpoint, 'channel': 'mychannel', 'sender': {'id': 'user0'}},
+                   'context': {'channel': {'endpoint': endpoint}}}
+        worker.dispatch([json.dumps(message).encode('utf8')])
+    with requests_mock.mock() as m:
+        for endpoint in ['http://a', 'http://b', 'http://c']:
+            m.post(endpoint + '/messages')
+        for q in worker.queues:
+            q.put(None)
+            worker._work(q)
+        assert [(r.url, r.json()['message']) for r in m.request_history] == [
+            ('http://b/messages', 'http://b'), ('http://a/messages', 'http://a'),
+            ('http://c/messages', 'http://c')]
+    worker.runtime.close()
+
+
+class FullBackend(object):
+    def send_multipart(self, frames, flags=0):
+        assert flags & zmq.NOBLOCK
+        raise zmq.Again()
+
+
+def test_supervisor_route_should_keep_conversation_on_one_worker():
+    supervisor = Supervisor('inproc://unused', {}, RecordingBot, processes=3)
+    supervisor.backends = [DummyBackend() for _ in range(3)]
+    for i in range(30):
+        message = {'event': {'content': str(i), 'channel': 'mychannel',
+                             'sender': {'id': 'user{}'.format(i % 5)}}}
+        supervisor.route([json.dumps(message).encode('utf8')])
+    supervisor.route([b'user0', b'{"event": {}}'])
+    supervisor.route([b'not a json'])
+    supervisor.route([b'{"event": "x"}'])
+    supervisor.route([b'{"event": {"sender": 1}}'])
+
+    assert sum(len(b.sent) for b in supervisor.backends) == 31
+    user_to_backends = {}
+    for index, backend in enumerate(supervisor.backends):
+        for frames in backend.sent:
+            if len(frames) == 1:
+                user_id = json.loads(frames[0].decode('utf8'))['event']['sender']['id']
+                user_to_backends.setdefault(user_id, set()).add(index)
+    assert len(user_to_backends) == 5
+    assert all(len(indexes) == 1 for indexes in user_to_backends.values())
+
+
+def test_worker_dispatch_should_drop_events_of_unexpected_types():
+    worker = Worker('inproc://unused', {}, RecordingBot, threads=2)
+    worker.dispatch([b'{"event": "x"}'])
+    worker.dispatch([b'{"event": {"sender": 1}}'])
+    worker.dispatch([b'["event"]'])
+    assert all(q.empty() for q in worker.queues)
+
+
+def test_supervisor_route_should_drop_messages_to_a_full_worker():
+    supervisor = Supervisor('inproc://unused', {}, RecordingBot, processes=2)
+    supervisor.backends = [FullBackend(), DummyBackend()]
+    for i in range(4):
+        supervisor.route([b'{"event": {}}'])
+    assert len(supervisor.backends[1].sent) == 2
+
+
+def test_supervisor_should_back_off_respawning_crashing_workers(monkeypatch):
+    now = [0.0]
+    supervisor = Supervisor('inproc://unused', {}, RecordingBot, processes=1, clock=lambda: now[0])
+    exited = []
+    spawned = []
+
+    def spawn(index):
+        spawned.append(now[0])
+        supervisor.pids[len(spawned)] = index
+        supervisor._spawned_at[index] = now[0]
+
+    def waitpid(pid, options):
+        return exited.pop() if exited else (0, 0)
+
+    monkeypatch.setattr(supervisor, '_spawn', spawn)
+    monkeypatch.setattr(os, 'waitpid', waitpid)
+    spawn(0)
+    for _ in range(4):
+        exited.append((max(supervisor.pids), 256))
+        supervisor._respawn_exited()
+        while not supervisor.pids:
+            now[0] += 0.25
+            supervisor._respawn_exited()
+    assert spawned == [0.0, 0.5, 1.5, 3.5, 7.5]
+
+    now[0] += 60
+    exited.append((max(supervisor.pids), 256))
+    supervisor._respawn_exited()
+    now[0] += 0.5
+    supervisor._respawn_exited()
+    assert spawned[-1] == 68.0
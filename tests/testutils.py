@@ -2,6 +2,13 @@
 
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+import json
+import socket
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
 
 class MockTransport(object):
     def __init__(self):
@@ -15,6 +22,71 @@ class MockTransport(object):
         self.executed.append(('put', {'url': url, 'data': data}))
         return self.recorded.pop(0) if self.recorded else None
 
+    def patch(self, url, data):
+        self.executed.append(('patch', {'url': url, 'data': data}))
+        return self.recorded.pop(0) if self.recorded else None
+
     def get(self, url):
         self.executed.append(('get', {'url': url}))
         return self.recorded.pop(0) if self.recorded else None
+
+
+class JsonHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''A quiet keep-alive request handler replying JSON, shared with benchmarks'''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _reply(self, body):
+        content = json.dumps(body).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _read_json(self):
+        return json.loads(self._read_body().decode('utf8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StorageHandler(JsonHandler):
+    def do_POST(self):
+        body = self._read_json()
+        self.server.requests.append((self.path, len(body['users'])))
+        users = self.server.users
+        if self.path.endswith('/users/_mget'):
+            self._reply({'data': [users.get((u['channel'], u['user_id'])) for u in body['users']]})
+        elif self.path.endswith('/users/_mset'):
+            for u in body['users']:
+                users.setdefault((u['channel'], u['user_id']), {}).update(u['data'])
+            self._reply({})
+
+
+class StorageServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''An in-memory stand-in of the storage service'''
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StorageHandler)
+        self.users = {}
+        self.requests = []
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()